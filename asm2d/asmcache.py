@@ -0,0 +1,114 @@
+# Build cache: the outputs of the assembler (the output file, the listing, the
+# symbol map and what it printed) stored on disk, keyed by a hash of the
+# source code, the options and the code of the assembler. A build that was
+# already done is copied from the cache instead of being assembled again.
+#
+# Each build is a JSON file in the cache directory. Entries are written to a
+# temporary file and renamed, so concurrent builds never see a partial entry.
+# When the cache grows over its size limit, the least recently used entries
+# (by modification time, which is updated on every hit) are removed.
+
+from __future__ import print_function
+import base64
+import binascii
+import glob
+import hashlib
+import json
+import os
+import asmutil
+
+# Size limit of the cache directory, in bytes
+MAX_SIZE = 64 * 1024 * 1024
+EXTENSION = '.build.json'
+
+_code_signature = None
+
+def code_signature():
+    """A hash of the code of the assembler (the modules of the package) and of
+    the grammar, computed once.
+    """
+    global _code_signature
+    if _code_signature is None:
+        digest = hashlib.sha1()
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        for filename in sorted(glob.glob(os.path.join(package_dir, '*.py'))):
+            with open(filename, 'rb') as f:
+                digest.update(f.read())
+        digest.update(asmutil.grammar_signature().encode('ascii'))
+        _code_signature = digest.hexdigest()
+    return _code_signature
+
+def build_key(source, **options):
+    """The key of a build: a hash of the source code, the options (which must
+    be JSON values) and the code of the assembler.
+    """
+    digest = hashlib.sha1()
+    digest.update(code_signature().encode('ascii'))
+    digest.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+    digest.update(source if isinstance(source, bytes) else source.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class BuildCache:
+    """A directory with the outputs of previous builds. An entry is a
+    dictionary of strings (binary outputs are stored in base64).
+    """
+
+    def __init__(self, path=None, max_size=MAX_SIZE):
+        self.path = path if path is not None else os.path.join(asmutil.cache_dir(), 'builds')
+        self.max_size = max_size
+
+    def entry_file(self, key):
+        return os.path.join(self.path, key + EXTENSION)
+
+    def get(self, key):
+        "The entry of a build, or None if it isn't in the cache."
+        filename = self.entry_file(key)
+        try:
+            with open(filename) as f:
+                entry = json.load(f)
+            os.utime(filename, None)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get('binary'):
+            entry['output'] = base64.b64decode(entry['output'])
+        return entry
+
+    def put(self, key, entry, binary=False):
+        """Store the entry of a build (the output is bytes if binary is set),
+        and remove the oldest entries if the cache is over its size limit.
+        Errors writing to the cache are ignored.
+        """
+        entry = dict(entry, binary=binary)
+        if binary:
+            entry['output'] = base64.b64encode(entry['output']).decode('ascii')
+        filename = self.entry_file(key)
+        tmp_file = '{0}.{1:d}.{2}.tmp'.format(filename, os.getpid(), binascii.hexlify(os.urandom(4)))
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            with open(tmp_file, 'w') as f:
+                json.dump(entry, f)
+            os.rename(tmp_file, filename)
+        except (IOError, OSError):
+            return
+        self.evict()
+
+    def evict(self):
+        "Remove the least recently used entries, until the cache fits its size limit."
+        entries = []
+        for filename in glob.glob(os.path.join(self.path, '*' + EXTENSION)):
+            try:
+                stat = os.stat(filename)
+                entries.append((stat.st_mtime, stat.st_size, filename))
+            except OSError:
+                pass
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
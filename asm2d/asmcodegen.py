@@ -1,188 +1,189 @@
-# Outputs the memory contents in .mif (Memory Initialization File) format.
+# Generates the memory contents of a program, and outputs them in one of the
+# formats of asmoutput (.mif by default).
 
 from __future__ import print_function
-import math
 import sys
-from bitstring import BitArray
-from asmconstants import KEY_TABLE, OP_CODES, SIZE, SYM_TABLE
+import asmoutput
+from asmconstants import (ABS, DIR, EXT, FAR, IMM, IMM_FAR, IMM_REL, IND, INH, INVERTED_BRANCHES, KEY_TABLE,
+        OP_CODES, REL, SIZE, SYM_TABLE)
 from asmgrammar import Inst, Var
 
-_file = sys.stdout
-_addr_bits = 0
+class MemoryImage:
+    """The memory contents of a program: one byte per address, and a note (the
+    instruction, label, variable or value it comes from) for each address.
+    """
 
-def codegen(ast, data_table, inst_table, no_words=None, outfile=sys.stdout):
-    "Generate the memory content as a VHDL matrix."
-    global _file
-    _file = outfile
-    mem_size = inst_table[SIZE] + data_table[SIZE]
-    data_offset = inst_table[SIZE]
-    code_offset = 0
+    def __init__(self, size):
+        self.data = bytearray(size)
+        self.notes = [None] * size
 
-    if not no_words: no_words = mem_size
-    calculate_addr_bits(no_words)
+    def __len__(self):
+        return len(self.data)
 
-    output_mif_header(no_words)
+    def put(self, addr, values, note=None):
+        "Store a sequence of bytes starting at an address."
+        for value in values:
+            self.data[addr] = value
+            self.notes[addr] = note
+            addr += 1
 
-    for elem in ast:
-        if isinstance(elem, Inst):
-            if len(elem.inst) == 2:
-                codegen_inherent(elem, code_offset)
-                code_offset += elem.size
-            elif len(elem.inst) == 3:
-                if elem.size == 2:
-                    codegen_relative(elem, code_offset, inst_table)
-                elif elem.size == 3:
-                    codegen_extended(elem, code_offset, inst_table)
-                code_offset += elem.size
-            elif len(elem.inst) == 4:
-                inst_type = elem.inst[2]
-                if inst_type == 'imm':
-                    codegen_immediate(elem, code_offset)
-                elif inst_type == 'ext':
-                    codegen_extended(elem, code_offset, inst_table)
-                code_offset += elem.size
-            elif len(elem.inst) == 5:
-                inst_type = elem.inst[2]
-                if inst_type == 'ind':
-                    codegen_indexed(elem, code_offset)
-                elif inst_type == 'imm-rel':
-                    codegen_immediate_relative(elem, code_offset, inst_table)
-                code_offset += elem.size
+
+def codegen(ast, data_table, inst_table, no_words=None, outfile=sys.stdout, output_format='mif', **options):
+    """Generate the memory contents of a program, and write them to the output
+    file in the given format.
+    """
+    image = generate(ast, data_table, inst_table)
+
+    if not no_words: no_words = len(image)
+    asmoutput.FORMATS[output_format](image, no_words, outfile, **options)
+    return image
+
+def generate(ast, data_table, inst_table):
+    "Generate the memory image of a program."
+    image = MemoryImage(inst_table[SIZE] + data_table[SIZE])
 
     for elem in ast:
-        if isinstance(elem, Var):
-            codegen_data(elem, data_offset)
-            data_offset += elem.size
-
-    output_mif_footer(no_words, mem_size, data_offset)
-
-def codegen_data(elem, addr, default_value=0):
-    "Output the initial value of a variable in the data segment."
-    value = BitArray(int=default_value, length=elem.size*8).hex.upper()
-    for i in range(elem.size):
-        start, end = i*2, (i+1)*2
-        output_data(value[start:end], addr, comment=elem.id)
-        addr += 1
-
-def codegen_inherent(elem, addr):
-    "Output the memory contents of an inherent instruction (1 byte)."
-    output_opcode(elem.inst[0], elem.label, addr)
-
-def codegen_immediate(elem, addr):
-    "Output the memory contents of an immediate instruction (2 or 3 bytes)."
-    inst_name, _, inst_type, value = elem.inst
-    opcode = OP_CODES[inst_name][inst_type]
-    output_opcode(inst_name, elem.label, addr, code=opcode)
-
-    addr += 1
+        codegen_elem(image, elem, data_table, inst_table)
+
+    return image
+
+def codegen_elem(image, elem, data_table, inst_table):
+    "Generate the memory contents of an instruction or a variable."
+    if isinstance(elem, Inst):
+        mode = elem.mode
+        if mode == INH:
+            codegen_inherent(image, elem, elem.addr)
+        elif mode == REL:
+            codegen_relative(image, elem, elem.addr, inst_table)
+        elif mode == IMM:
+            codegen_immediate(image, elem, elem.addr)
+        elif mode == DIR:
+            codegen_direct(image, elem, elem.addr, data_table)
+        elif mode == EXT or mode == ABS:
+            codegen_extended(image, elem, elem.addr, data_table, inst_table)
+        elif mode == IND:
+            codegen_indexed(image, elem, elem.addr)
+        elif mode == IMM_REL:
+            codegen_immediate_relative(image, elem, elem.addr, inst_table)
+        elif mode == FAR or mode == IMM_FAR:
+            codegen_long_branch(image, elem, elem.addr, inst_table)
+    elif isinstance(elem, Var):
+        codegen_data(image, elem, elem.addr)
+
+def codegen_data(image, elem, addr, default_value=0):
+    "Generate the initial value of a variable in the data segment."
+    image.put(addr, to_bytes(default_value, elem.size), elem.id)
+
+def codegen_inherent(image, elem, addr):
+    "Generate the memory contents of an inherent instruction (1 byte)."
+    codegen_opcode(image, elem, addr)
+
+def codegen_immediate(image, elem, addr):
+    "Generate the memory contents of an immediate instruction (2 or 3 bytes)."
+    inst_name, value = elem.name, elem.value
+    codegen_opcode(image, elem, addr, code=OP_CODES[inst_name][IMM])
+
     if inst_name in {'CPK', 'LDB', 'LDG', 'LDR', 'RNDA'}:
-        data = BitArray(uint=value, length=(elem.size-1)*8).hex.upper()
+        data = to_bytes(value, elem.size-1, signed=False)
     elif inst_name == 'DRSYM':
-        data = SYM_TABLE[value]
+        data = [SYM_TABLE[value]]
     else:
-        data = BitArray(int=value, length=(elem.size-1)*8).hex.upper()
-    for i in range(elem.size-1):
-        start, end = i*2, (i+1)*2
-        output_data(data[start:end], addr, comment=value)
-        addr += 1
-
-def codegen_immediate_relative(elem, addr, inst_table):
-    """Output the memory contents of an immediate and relative instruction
+        data = to_bytes(value, elem.size-1)
+    image.put(addr+1, data, value)
+
+def codegen_immediate_relative(image, elem, addr, inst_table):
+    """Generate the memory contents of an immediate and relative instruction
     like BKE (3 bytes).
     """
-    inst_name, _, _, key, label = elem.inst
-    output_opcode(inst_name, elem.label, addr)
-
-    addr += 1
-    data = KEY_TABLE[key]
-    output_data(data, addr, comment="KEY_{0:d}".format(key))
-
-    addr += 1
-    relative_addr = inst_table[label].addr - (addr + 1)
-    data = BitArray(int=relative_addr, length=8).hex.upper()
-    output_data(data, addr, comment="{0} (rel {1:d})".format(label, relative_addr))
-
-def codegen_relative(elem, addr, inst_table):
-    "Output the memory contents of a relative instruction (2 bytes)."
-    inst_name, _, label = elem.inst
-    output_opcode(inst_name, elem.label, addr)
-
-    addr += 1
-    relative_addr = inst_table[label].addr - (addr + 1)
-    data = BitArray(int=relative_addr, length=8).hex.upper()
-    output_data(data, addr, comment="{0} (rel {1:d})".format(label, relative_addr))
-
-def codegen_indexed(elem, addr):
-    "Output the memory contents of an indexed instruction (2 bytes)."
-    inst_name, _, inst_type, offset, register = elem.inst
-    opcode = OP_CODES[inst_name][inst_type]
-    output_opcode(inst_name, elem.label, addr, code=opcode)
-
-    addr += 1
-    data = BitArray(int=offset, length=8).hex.upper()
-    output_data(data, addr, comment="{0:d},{1}".format(offset, register.upper()))
-
-def codegen_extended(elem, addr, inst_table):
-    "Output the memory contents of an extended instruction (3 bytes)."
-    if len(elem.inst) == 3:
-        inst_name, _, label = elem.inst
-        next_addr = inst_table[label].addr
-        data = BitArray(uint=next_addr, length=16).hex.upper()
-        output_opcode(inst_name, elem.label, addr)
-
-        addr += 1
-        output_data(data[:2], addr, comment="{0} (abs {1:d})".format(label, next_addr))
-        output_data(data[2:], addr+1, comment="{0} (abs {1:d})".format(label, next_addr))
-    elif len(elem.inst) == 4:
-        inst_name, _, inst_type, value = elem.inst
-        data = BitArray(uint=value, length=16).hex.upper()
-        opcode = OP_CODES[inst_name][inst_type]
-        output_opcode(inst_name, elem.label, addr, code=opcode)
-
-        addr += 1
-        output_data(data[:2], addr, comment=value)
-        output_data(data[2:], addr+1, comment=value)
+    key, label = elem.value, elem.target
+    codegen_opcode(image, elem, addr)
 
-# Helper functions
+    image.put(addr+1, [KEY_TABLE[key]], "KEY_{0:d}".format(key))
+
+    relative_addr = inst_table[label].addr - (addr + 3)
+    image.put(addr+2, to_bytes(relative_addr, 1), "{0} (rel {1:d})".format(label, relative_addr))
+
+def codegen_relative(image, elem, addr, inst_table):
+    "Generate the memory contents of a relative instruction (2 bytes)."
+    label = elem.target
+    codegen_opcode(image, elem, addr)
+
+    relative_addr = inst_table[label].addr - (addr + 2)
+    image.put(addr+1, to_bytes(relative_addr, 1), "{0} (rel {1:d})".format(label, relative_addr))
+
+def codegen_long_branch(image, elem, addr, inst_table):
+    """Generate the memory contents of a branch whose target is out of range:
+    a JMP (3 bytes) for BRA, an inverted branch over a JMP (5 bytes) for the
+    conditional branches, and a BKE over a BRA that skips a JMP (8 bytes).
+    """
+    inst_name, label = elem.name, elem.target
+    if inst_name == 'BKE':
+        key = elem.value
+        codegen_opcode(image, elem, addr)
+        image.put(addr+1, [KEY_TABLE[key]], "KEY_{0:d}".format(key))
+        image.put(addr+2, [2], "(rel 2)")
+        image.put(addr+3, [OP_CODES['BRA'], 3], "BRA (rel 3)")
+        jmp_addr = addr + 5
+    elif inst_name == 'BRA':
+        jmp_addr = addr
+    else:
+        codegen_opcode(image, elem, addr, code=OP_CODES[INVERTED_BRANCHES[inst_name]])
+        image.put(addr+1, [3], "(rel 3)")
+        jmp_addr = addr + 2
+
+    target_addr = inst_table[label].addr
+    image.put(jmp_addr, [OP_CODES['JMP']], "JMP ({0})".format(elem.label) if jmp_addr == addr and elem.label != '' else 'JMP')
+    image.put(jmp_addr+1, to_bytes(target_addr, 2, signed=False), "{0} (abs {1:d})".format(label, target_addr))
+
+def codegen_indexed(image, elem, addr):
+    "Generate the memory contents of an indexed instruction (2 bytes)."
+    offset = elem.value
+    codegen_opcode(image, elem, addr, code=OP_CODES[elem.name][IND])
+
+    image.put(addr+1, to_bytes(offset, 1), "{0:d},X".format(offset))
 
-def calculate_addr_bits(depth):
-    """Calculate the number of bits (in multiples of 4) needed to address the
-    specified number of words.
+def codegen_direct(image, elem, addr, data_table):
+    "Generate the memory contents of a direct instruction (2 bytes)."
+    var_addr = data_table[elem.target].addr
+    codegen_opcode(image, elem, addr, code=OP_CODES[elem.name][DIR])
+
+    image.put(addr+1, to_bytes(var_addr, 1, signed=False), var_addr)
+
+def codegen_extended(image, elem, addr, data_table, inst_table):
+    """Generate the memory contents of an extended instruction (3 bytes), to a
+    label or a variable.
     """
-    global _addr_bits
-    _addr_bits = int(math.ceil(math.log(depth, 2) / 4)) * 4
+    if elem.mode == ABS:
+        label = elem.target
+        next_addr = inst_table[label].addr
+        codegen_opcode(image, elem, addr)
 
-def output_opcode(inst_name, label, addr, code=None):
-    "Output the memory contents of an instruction op code (1 byte)."
+        image.put(addr+1, to_bytes(next_addr, 2, signed=False), "{0} (abs {1:d})".format(label, next_addr))
+    else:
+        var_addr = data_table[elem.target].addr
+        codegen_opcode(image, elem, addr, code=OP_CODES[elem.name][EXT])
+
+        image.put(addr+1, to_bytes(var_addr, 2, signed=False), var_addr)
+
+def codegen_opcode(image, elem, addr, code=None):
+    "Generate the op code of an instruction (1 byte)."
+    inst_name = elem.name
     code = OP_CODES[inst_name] if code is None else code
-    op_code = BitArray(uint=code, length=8).hex.upper()
-    addr_hex = BitArray(uint=addr, length=_addr_bits).hex.upper()
-    output = '{0} : {1};    -- {2}'.format(addr_hex, op_code, inst_name)
-    if label != '':
-        output += " ({0})".format(label)
-    print(output, file=_file)
-
-def output_data(data, addr, comment=None):
-    "Output the memory contents of a byte of data."
-    addr_hex = BitArray(uint=addr, length=_addr_bits).hex.upper()
-    output = '{0} : {1};'.format(addr_hex, data)
-    if comment is not None and comment != '':
-        output += '    -- {0}'.format(comment)
-    print(output, file=_file)
-
-def output_mif_header(depth, width=8, addr_radix='HEX', data_radix='HEX'):
-    "Output the header of a MIF file."
-    print('DEPTH = {0:d};\t\t\t-- Size of memory in words'.format(depth), file=_file)
-    print('WIDTH = {0:d};\t\t\t\t-- Size of word in bits'.format(width), file=_file)
-    print('ADDRESS_RADIX = {0};\t-- Radix for address values'.format(addr_radix), file=_file)
-    print('DATA_RADIX = {0};\t\t-- Radix for data values'.format(data_radix), file=_file)
-    print('CONTENT', file=_file)
-    print('BEGIN\n', file=_file)
-
-def output_mif_footer(depth, mem_size, next_addr):
-    "Output the footer of a MIF file."
-    if depth > mem_size:
-        start_addr = BitArray(uint=next_addr, length=_addr_bits).hex.upper()
-        end_addr = BitArray(uint=depth-1, length=_addr_bits).hex.upper()
-        print('\n[{0}..{1}] : {2};'.format(start_addr, end_addr, '00'), file=_file)
-    print('\nEND;', file=_file)
+    if elem.label != '':
+        image.put(addr, [code], "{0} ({1})".format(inst_name, elem.label))
+    else:
+        image.put(addr, [code], inst_name)
+
+# Helper functions
+
+def to_bytes(value, size, signed=True):
+    "Split a signed or unsigned value into bytes (most significant first)."
+    bits = size * 8
+    if signed:
+        low, high = -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+    else:
+        low, high = 0, (1 << bits) - 1
+    if value < low or value > high:
+        raise ValueError("Value {0:d} doesn't fit in {1:d} byte{2}".format(value, size, 's' if size > 1 else ''))
+    value &= (1 << bits) - 1
+    return [(value >> shift) & 0xFF for shift in range(bits - 8, -8, -8)]
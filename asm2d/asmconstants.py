@@ -1,40 +1,57 @@
-from bitstring import BitArray
-
 SIZE = '___SIZE___'
 
+# Addressing modes of the instructions (Inst.mode). The ones in the opcode
+# tables (imm, dir, ext and ind) select the opcode of the instruction.
+INH = 'inh'             # No operand
+IMM = 'imm'             # Immediate value
+DIR = 'dir'             # Variable in the first 256 bytes (one byte address)
+EXT = 'ext'             # Variable (two byte address)
+IND = 'ind'             # Offset from register X
+VAR = 'var'             # Variable whose address isn't known yet (ext or dir)
+REL = 'rel'             # Branch to a label
+ABS = 'abs'             # Jump or call to a label (two byte address)
+IMM_REL = 'imm-rel'     # Branch to a label on a key event (BKE)
+FAR = 'far'             # Branch to a label out of range (see LONG_BRANCH_SIZES)
+IMM_FAR = 'imm-far'     # BKE to a label out of range
+# Modes of the branches, short and long
+BRANCH_MODES = {REL, IMM_REL, FAR, IMM_FAR}
+
 # http://home.earthlink.net/~tdickens/68hc11/68hc11_opcode_map.html
 
 OP_CODES = {
         'ABA': 0x1B,
         'ABX': 0x3A,
-        'ADDD': {'imm': 0xC3, 'ext': 0xF3},
+        'ADDD': {'imm': 0xC3, 'dir': 0xD3, 'ext': 0xF3},
         'ASRD': 0x87,           # Unused opcode (in 8611)
+        'BCC': 0x24,            # Used by branch relaxation
         'BCS': 0x25,
         'BEQ': 0x27,
         'BHI': 0x22,
         'BKE': 0xB5,            # Shadows BITA
         'BLO': 0x25,
+        'BLS': 0x23,            # Used by branch relaxation
         'BMI': 0x2B,
         'BNE': 0x26,
         'BPL': 0x2A,
         'BRA': 0x20,
         'CLRS': 0x95,           # Shadows BITA
         'CPK': {'imm': 0x85},   # Shadows BITA
-        'CPX': {'imm': 0x8C, 'ext': 0xBC},
+        'CPX': {'imm': 0x8C, 'dir': 0x9C, 'ext': 0xBC},
         'DRCL': 0x65,           # Unused opcode (in 6811)
         'DRHLN': 0x6B,          # Unused opcode (in 6811)
         'DRRCT': 0x75,          # Unused opcode (in 6811)
         'DRSYM': {'imm': 0xA5}, # Shadows BITA
         'DRVLN': 0x7B,          # Unused opcode (in 6811)
         'INX': 0x08,
+        'JMP': 0x7E,            # Used by branch relaxation
         'JSR': 0xBD,
-        'LDAA': {'imm': 0x86, 'ext': 0xB6},
-        'LDAB': {'imm': 0xC6, 'ext': 0xF6},
+        'LDAA': {'imm': 0x86, 'dir': 0x96, 'ext': 0xB6},
+        'LDAB': {'imm': 0xC6, 'dir': 0xD6, 'ext': 0xF6},
         'LDB': {'imm': 0x41, 'ext': 0x51},      # Unused opcodes (in 6811)
-        'LDD': {'imm': 0xCC, 'ext': 0xFC},
+        'LDD': {'imm': 0xCC, 'dir': 0xDC, 'ext': 0xFC},
         'LDG': {'imm': 0x42, 'ext': 0x52},      # Unused opcodes (in 6811)
         'LDR': {'imm': 0x45, 'ext': 0x55},      # Unused opcodes (in 6811)
-        'LDX': {'imm': 0xCE, 'ext': 0xFE},
+        'LDX': {'imm': 0xCE, 'dir': 0xDE, 'ext': 0xFE},
         'LDXA': {'imm': 0x4B, 'ext': 0x5B},     # Unused opcodes (in 6811)
         'LDXB': {'imm': 0x4E, 'ext': 0x5E},     # Unused opcodes (in 6811)
         'LDYA': {'imm': 0x61, 'ext': 0x71},     # Unused opcodes (in 6811)
@@ -64,12 +81,12 @@ OP_CODES = {
         'RNDA': {'imm': 0xFA},  # Shadows ORAB
         'RSTK': 0xC7,           # Unused opcode (in 6811)
         'RTS': 0x39,
-        'STAA': {'ext': 0xB7, 'ind': 0xA7},
-        'STAB': {'ext': 0xF7, 'ind': 0xE7},
-        'STD': {'ext': 0xFD},
-        'STX': {'ext': 0xFF},
-        'SUBA': {'imm': 0x80, 'ext': 0xB0},
-        'SUBD': {'imm': 0x83, 'ext': 0xB3},
+        'STAA': {'dir': 0x97, 'ext': 0xB7, 'ind': 0xA7},
+        'STAB': {'dir': 0xD7, 'ext': 0xF7, 'ind': 0xE7},
+        'STD': {'dir': 0xDD, 'ext': 0xFD},
+        'STX': {'dir': 0xDF, 'ext': 0xFF},
+        'SUBA': {'imm': 0x80, 'dir': 0x90, 'ext': 0xB0},
+        'SUBD': {'imm': 0x83, 'dir': 0x93, 'ext': 0xB3},
         'TDX': 0xF8,            # Shadows EORB
         'TDXA': 0xC5,           # Shadows BITB
         'TDXB': 0xD5,           # Shadows BITB
@@ -78,15 +95,103 @@ OP_CODES = {
         'XGDX': 0x8F
         }
 
+# Cycles taken by each instruction (and addressing mode). The custom
+# instructions are assumed to take as long as the 6811 instruction they shadow,
+# or as a similar instruction if they use an unused opcode.
+
+CYCLES = {
+        'ABA': 2,
+        'ABX': 3,
+        'ADDD': {'imm': 4, 'dir': 5, 'ext': 6},
+        'ASRD': 3,
+        'BCC': 3,
+        'BCS': 3,
+        'BEQ': 3,
+        'BHI': 3,
+        'BKE': 4,
+        'BLO': 3,
+        'BLS': 3,
+        'BMI': 3,
+        'BNE': 3,
+        'BPL': 3,
+        'BRA': 3,
+        'CLRS': 3,
+        'CPK': {'imm': 2},
+        'CPX': {'imm': 4, 'dir': 5, 'ext': 6},
+        'DRCL': 2,
+        'DRHLN': 2,
+        'DRRCT': 2,
+        'DRSYM': {'imm': 4},
+        'DRVLN': 2,
+        'INX': 3,
+        'JMP': 3,
+        'JSR': 6,
+        'LDAA': {'imm': 2, 'dir': 3, 'ext': 4},
+        'LDAB': {'imm': 2, 'dir': 3, 'ext': 4},
+        'LDB': {'imm': 2, 'ext': 4},
+        'LDD': {'imm': 3, 'dir': 4, 'ext': 5},
+        'LDG': {'imm': 2, 'ext': 4},
+        'LDR': {'imm': 2, 'ext': 4},
+        'LDX': {'imm': 3, 'dir': 4, 'ext': 5},
+        'LDXA': {'imm': 2, 'ext': 4},
+        'LDXB': {'imm': 2, 'ext': 4},
+        'LDYA': {'imm': 2, 'ext': 4},
+        'LDYB': {'imm': 2, 'ext': 4},
+        'MUL': 10,
+        'NEGA': 2,
+        'PSHA': 3,
+        'PSHB': 3,
+        'PSHCB': 2,
+        'PSHCG': 3,
+        'PSHCR': 4,
+        'PSHX': 4,
+        'PSHXA': 4,
+        'PSHXB': 2,
+        'PSHYA': 3,
+        'PSHYB': 4,
+        'PULA': 4,
+        'PULB': 4,
+        'PULCB': 2,
+        'PULCG': 3,
+        'PULCR': 4,
+        'PULX': 5,
+        'PULXA': 4,
+        'PULXB': 2,
+        'PULYA': 3,
+        'PULYB': 4,
+        'RNDA': {'imm': 4},
+        'RSTK': 2,
+        'RTS': 5,
+        'STAA': {'dir': 3, 'ext': 4, 'ind': 4},
+        'STAB': {'dir': 3, 'ext': 4, 'ind': 4},
+        'STD': {'dir': 4, 'ext': 5},
+        'STX': {'dir': 4, 'ext': 5},
+        'SUBA': {'imm': 2, 'dir': 3, 'ext': 4},
+        'SUBD': {'imm': 4, 'dir': 5, 'ext': 6},
+        'TDX': 4,
+        'TDXA': 2,
+        'TDXB': 3,
+        'TDYA': 4,
+        'TDYB': 4,
+        'XGDX': 3
+        }
+
 # Extended instructions that operate on one byte
 INST_ONE_BYTE = {'LDAA', 'LDAB', 'LDB', 'LDG', 'LDR', 'STAA', 'STAB', 'SUBA'}
 # Instructions that interpret the numbers as unsigned
 INST_UNSIGNED = {'CPK', 'LDB', 'LDG', 'LDR', 'RNDA'}
 
+# Conditional branches with the opposite condition, used to jump over a JMP
+# when a branch is out of range
+INVERTED_BRANCHES = {'BCS': 'BCC', 'BEQ': 'BNE', 'BHI': 'BLS', 'BLO': 'BCC',
+        'BMI': 'BPL', 'BNE': 'BEQ', 'BPL': 'BMI'}
+# Size of the long form of the branches: BRA becomes a JMP, a conditional
+# branch becomes an inverted branch over a JMP, and BKE branches over a BRA
+# to skip a JMP
+LONG_BRANCH_SIZES = {None: 5, 'BRA': 3, 'BKE': 8}
+
 # Opcodes for graphic unit
-SYM_TABLE = {k:BitArray(int=v, length=8).hex.upper()
-        for k,v in zip('@# ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 .,;:&|?!<^', range(5, 56))}
+SYM_TABLE = dict(zip('@# ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 .,;:&|?!<^', range(5, 56)))
 
 # Opcodes for key press events
-KEY_TABLE = {k:BitArray(int=v, length=8).hex.upper()
-        for k,v in zip(range(0, 16), range(7, 23))}
+KEY_TABLE = dict(zip(range(0, 16), range(7, 23)))
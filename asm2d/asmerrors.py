@@ -1,13 +1,91 @@
 from __future__ import print_function
+import fnmatch
+import json
 import sys
 
 # Error reporting
 
+# Number of diagnostics written by default, the rest are only counted
+MAX_DIAGNOSTICS = 100
+
+class Diagnostic:
+    """An error or warning found while assembling a program, with the code of
+    its kind (like 'unused-label', used by the warning filters), and its line
+    and column when they're known.
+    """
+
+    def __init__(self, severity, message, lineno=None, code=None, column=None):
+        self.severity = severity
+        self.message = message
+        self.lineno = lineno
+        self.code = code
+        self.column = column
+
+    def __str__(self):
+        if self.lineno is not None and self.column is not None:
+            return "{0}: {1} (at line: {2:d}, column: {3:d})".format(self.severity.upper(), self.message,
+                    self.lineno, self.column)
+        elif self.lineno is not None:
+            return "{0}: {1} (at line: {2:d})".format(self.severity.upper(), self.message, self.lineno)
+        else:
+            return "{0}: {1}".format(self.severity.upper(), self.message)
+
+    def __repr__(self):
+        return "Diagnostic<Severity: '{0}', Code: {1}, Message: {2!r}, Line: {3}, Column: {4}>"\
+                .format(self.severity, self.code, self.message, self.lineno, self.column)
+
+    def to_json(self):
+        return {
+                'severity': self.severity,
+                'code': self.code,
+                'message': self.message,
+                'line': self.lineno,
+                'column': self.column,
+                }
+
+
+def from_json(fields):
+    "A diagnostic from its JSON object (see Diagnostic.to_json)."
+    return Diagnostic(fields['severity'], fields['message'], fields.get('line'), fields.get('code'),
+            fields.get('column'))
+
+def find_column(data, lexpos):
+    "The column (starting at 1) of a position in the input."
+    return lexpos - data.rfind('\n', 0, lexpos)
+
+def parse_warning_filter(text):
+    """Parse a warning filter (the argument of a -W flag): 'error' turns all
+    the warnings into errors, 'error=CODE' the ones with that code, 'no-CODE'
+    ignores them and 'CODE' enables them again. Codes can be patterns, like
+    'unused-*'. Returns a (pattern, action) tuple.
+    """
+    if text == 'error':
+        return '*', 'error'
+    elif text.startswith('error='):
+        return text[len('error='):], 'error'
+    elif text.startswith('no-'):
+        return text[len('no-'):], 'ignore'
+    return text, 'warning'
+
+
 class ErrorReport:
-    "A class to count errors and report totals."
+    """A class to collect diagnostics, count errors and report totals.
 
-    def __init__(self):
+    With verbose set, diagnostics are printed to stderr as they are found. With
+    fatal set, report_errors() exits the process if there are errors. Warnings
+    go through the filters (see parse_warning_filter), the last one that
+    matches the code decides. Only the first max_diagnostics are kept, the rest
+    are counted in dropped.
+    """
+
+    def __init__(self, verbose=True, fatal=True, filters=(), max_diagnostics=None):
         self._num_errors = 0
+        self.diagnostics = []
+        self.dropped = 0
+        self.verbose = verbose
+        self.fatal = fatal
+        self.filters = list(filters)
+        self.max_diagnostics = max_diagnostics
 
     def has_errors(self):
         return self._num_errors > 0
@@ -18,26 +96,83 @@ class ErrorReport:
     def add_error(self):
         self._num_errors += 1
 
+    def filter(self, diagnostic):
+        "The action of the filters for a warning: 'warning', 'error' or 'ignore'."
+        action = 'warning'
+        for pattern, filter_action in self.filters:
+            if fnmatch.fnmatchcase(diagnostic.code or '', pattern):
+                action = filter_action
+        return action
+
+    def add(self, diagnostic):
+        "Add a diagnostic, after applying the warning filters to it."
+        if diagnostic.severity == 'warning':
+            action = self.filter(diagnostic)
+            if action == 'ignore':
+                return
+            diagnostic.severity = action
+        if diagnostic.severity == 'error':
+            self.add_error()
+        self.add_diagnostic(diagnostic)
+
+    def add_diagnostic(self, diagnostic):
+        if self.max_diagnostics is not None and len(self.diagnostics) >= self.max_diagnostics:
+            self.dropped += 1
+            return
+        self.diagnostics.append(diagnostic)
+        if self.verbose:
+            print(diagnostic, file=sys.stderr)
+
     def report_errors(self):
         if self.has_errors():
-            if self.num_errors() == 1:
-                print("There is 1 error.", file=sys.stderr)
-            else:
-                print("There are {0:d} errors.".format(self.num_errors()), file=sys.stderr)
-            sys.exit(1)
+            if self.verbose:
+                if self.num_errors() == 1:
+                    print("There is 1 error.", file=sys.stderr)
+                else:
+                    print("There are {0:d} errors.".format(self.num_errors()), file=sys.stderr)
+            if self.fatal:
+                sys.exit(1)
+
+
+def write_diagnostics(diagnostics, outfile=sys.stderr, diagnostics_format='text', num_errors=0, dropped=0,
+        prefix=None):
+    """Write diagnostics (as JSON objects, see Diagnostic.to_json) as text, one
+    per line (prefixed by a file name if one is given), followed by the number
+    of diagnostics that were dropped and of errors. In JSON, they're written
+    as one object (on one line) with the diagnostics, the number of errors and
+    the number of dropped diagnostics.
+    """
+    if diagnostics_format == 'json':
+        json.dump({'diagnostics': diagnostics, 'errors': num_errors, 'dropped': dropped}, outfile, sort_keys=True)
+        outfile.write('\n')
+        return
+    for fields in diagnostics:
+        if prefix is not None:
+            print("{0}: {1}".format(prefix, from_json(fields)), file=outfile)
+        else:
+            print(from_json(fields), file=outfile)
+    if dropped > 0:
+        print("{0:d} more diagnostic{1} not shown.".format(dropped, 's' if dropped > 1 else ''), file=outfile)
+    if num_errors == 1:
+        print("There is 1 error.", file=outfile)
+    elif num_errors > 1:
+        print("There are {0:d} errors.".format(num_errors), file=outfile)
 
 
 def error(msg, *args, **kwargs):
-    "Print an error message."
-    if 'errors' in kwargs: kwargs['errors'].add_error()
-    if 'lineno' in kwargs:
-        print("ERROR: {0} (at line: {1:d})".format(msg.format(*args), kwargs['lineno']), file=sys.stderr)
+    "Report an error message."
+    diagnostic = Diagnostic('error', msg.format(*args), kwargs.get('lineno'), kwargs.get('code'),
+            kwargs.get('column'))
+    if kwargs.get('errors') is not None:
+        kwargs['errors'].add(diagnostic)
     else:
-        print("ERROR: {}".format(msg.format(*args)), file=sys.stderr)
+        print(diagnostic, file=sys.stderr)
 
 def warn(msg, *args, **kwargs):
-    "Print a warning message."
-    if 'lineno' in kwargs:
-        print("WARNING: {0} (at line: {1:d})".format(msg.format(*args), kwargs['lineno']), file=sys.stderr)
+    "Report a warning message."
+    diagnostic = Diagnostic('warning', msg.format(*args), kwargs.get('lineno'), kwargs.get('code'),
+            kwargs.get('column'))
+    if kwargs.get('errors') is not None:
+        kwargs['errors'].add(diagnostic)
     else:
-        print("WARNING: {}".format(msg.format(*args)), file=sys.stderr)
+        print(diagnostic, file=sys.stderr)
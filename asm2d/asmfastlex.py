@@ -0,0 +1,155 @@
+# A fast lexer for the 68112D, an alternative to the PLY lexer built from
+# asmtokens. It gives the same tokens (types, values, line numbers and
+# positions), with one master regex and a dictionary for the reserved words.
+#
+# The rules are tried in the same order as PLY tries the ones in asmtokens
+# (the functions in the order they are defined, then the strings from the
+# longest regex to the shortest), so the first rule that matches wins, as in
+# PLY. Whitespace and comments are skipped by the regex itself.
+
+from __future__ import print_function
+import re
+from functools import partial
+from itertools import chain
+from asmerrors import error, find_column
+from asmtokens import hex_value, reserved
+
+# Whitespace and a comment, skipped before each token (the first two rules that
+# PLY tries; a comment runs to the end of the line, so nothing but a newline
+# can follow it)
+SKIP = r'[ \t\v\r]*(?:;.*)?'
+
+# Name and regex of each token rule, in the order they are tried
+RULES = (
+        ('CHAR', r"'[A-Z0-9.,;:&?!|#@<^]'"),
+        ('IX', r'x|X'),
+        ('CONST_REF', r'\#[A-Za-z][A-Za-z0-9_]*'),
+        ('MAIN', r'\.main|\.MAIN'),
+        ('KEY_ID', r'(key|KEY)_(1[0-5]|[0-9])'),
+        ('IDENTIFIER', r'[A-Za-z][A-Za-z0-9_]*'),
+        ('HEX_NUM', r'\$([0-9a-fA-F])+'),
+        ('NUM', r'(0)|(-?[1-9][0-9]*)'),
+        ('ENDL', r'\n'),
+        ('LPAREN', r'\('),
+        ('MINUS', r'\-'),
+        ('PLUS', r'\+'),
+        ('RPAREN', r'\)'),
+        ('TIMES', r'\*'),
+        ('COMMA', r','),
+        ('DIVIDE', r'/'),
+        )
+
+# The token is optional: when no rule matches after the skipped text, the
+# match has no group, and ends at the illegal character (or the end)
+MASTER_REGEX = re.compile(SKIP + '(?:' + '|'.join('(?P<{0}>{1})'.format(name, regex)
+    for name, regex in RULES) + ')?')
+
+RESERVED = dict((word, word) for word in reserved)
+
+# Tokens made at a time (rounded up to whole lines)
+CHUNK_SIZE = 256
+
+def identifier(text):
+    "Type and value of an identifier (a reserved word is its own type)."
+    upper = text.upper()
+    return RESERVED.get(upper, 'IDENTIFIER'), upper
+
+# Type and value of the tokens whose text isn't their value, by rule name
+CONVERTERS = {
+        'CHAR': lambda text: ('CHAR', text[1]),
+        'CONST_REF': lambda text: ('CONST_REF', text[1:].upper()),
+        'HEX_NUM': lambda text: ('HEX_NUM', hex_value(text)),
+        'IDENTIFIER': identifier,
+        'KEY_ID': lambda text: ('KEY_ID', int(text.split('_')[1])),
+        'MAIN': lambda text: ('IDENTIFIER', '.main'),
+        'NUM': lambda text: ('NUM', int(text)),
+        }
+
+
+class Token(object):
+    "A token, with the attributes of a PLY token."
+    __slots__ = ('type', 'value', 'lineno', 'lexpos', 'lexer')
+
+    def __init__(self, type, value, lineno, lexpos, lexer):
+        self.type = type
+        self.value = value
+        self.lineno = lineno
+        self.lexpos = lexpos
+        self.lexer = lexer
+
+    def __repr__(self):
+        return "LexToken({0},{1!r},{2:d},{3:d})".format(self.type, self.value, self.lineno, self.lexpos)
+
+
+class FastLexer:
+    """A lexer with the interface of a PLY lexer that the parser uses: input(),
+    token(), clone() and the lineno attribute. Errors are reported to the
+    errors attribute.
+
+    The input is tokenized a chunk of lines at a time, and token is the next
+    method of an iterator over the tokens (returning None at the end), which
+    the parser calls without going through Python code. The illegal
+    characters are reported when the parser gets to them, as with PLY.
+    """
+
+    def __init__(self, errors=None):
+        self.errors = errors
+        self.lineno = 1
+        self.lexpos = 0
+        self.lexdata = ''
+        self.token = partial(next, iter(()), None)
+
+    def clone(self):
+        return FastLexer(self.errors)
+
+    def input(self, data):
+        self.lexdata = data
+        self.lexpos = 0
+        self.token = partial(next, chain.from_iterable(self.chunks(data)), None)
+
+    def chunks(self, data):
+        """Generate the tokens of the input, in chunks of whole lines with at
+        least CHUNK_SIZE tokens (except the last one).
+        """
+        match, converters = MASTER_REGEX.match, CONVERTERS
+        lineno, pos, end = self.lineno, 0, len(data)
+        while pos < end:
+            tokens, illegal = [], []
+            append = tokens.append
+            while True:
+                m = match(data, pos)
+                kind, pos = m.lastgroup, m.end()
+                if kind is None:
+                    if pos >= end: break
+                    illegal.append((len(tokens), pos, lineno))
+                    pos += 1
+                    continue
+                start = m.start(kind)
+                text = data[start:pos]
+                convert = converters.get(kind)
+                if convert is not None:
+                    kind, text = convert(text)
+                append(Token(kind, text, lineno, start, self))
+                if kind == 'ENDL':
+                    lineno += 1
+                    if len(tokens) >= CHUNK_SIZE: break
+            self.lineno, self.lexpos = lineno, pos
+            yield tokens if not illegal else self.replay(tokens, illegal)
+
+    def replay(self, tokens, illegal):
+        """Generate the tokens of a chunk, reporting each illegal character
+        (the number of tokens before it, its position and its line) before the
+        token after it.
+        """
+        illegal = iter(illegal)
+        index, pos, lineno = next(illegal)
+        for i in range(len(tokens) + 1):
+            while index == i:
+                error("Illegal character '{0}'", self.lexdata[pos], lineno=lineno,
+                        column=find_column(self.lexdata, pos), code='illegal-character', errors=self.errors)
+                index, pos, lineno = next(illegal, (None, None, None))
+            if i < len(tokens):
+                yield tokens[i]
+
+    def __iter__(self):
+        return iter(self.token, None)
@@ -0,0 +1,96 @@
+# Control flow analysis: finds the instructions that can be reached from the
+# main label (following fall-through, branches, BKE and JSR), and removes the
+# code and the variables that are never used.
+
+from __future__ import print_function
+from asmconstants import DIR, EXT, SIZE, VAR
+from asmerrors import warn
+from asmgrammar import Inst, Var
+from asmsemantic import MAIN, branch_target
+
+# Instructions after which the execution doesn't continue with the next one
+NO_FALL_THROUGH = {'BRA', 'JMP', 'RTS'}
+
+def successors(insts, i, index, calls=True):
+    """The indices of the instructions that can run after the instruction at
+    index i. The index maps labels to indices. Without calls, the subroutine
+    called by a JSR isn't included (only the instruction after it).
+    """
+    elem = insts[i]
+    result = []
+    if elem.name not in NO_FALL_THROUGH and i + 1 < len(insts):
+        result.append(i + 1)
+    label = branch_target(elem)
+    if label is None and (elem.name == 'JMP' or calls and elem.name == 'JSR'):
+        label = elem.target
+    if label in index:
+        result.append(index[label])
+    return result
+
+def reachable(ast, inst_table):
+    "The instructions that can be reached from the main label, in AST order."
+    insts = [elem for elem in ast if isinstance(elem, Inst)]
+    index = dict((id(elem), i) for i, elem in enumerate(insts))
+    labels = dict((label, index[id(inst_table[label])]) for label in inst_table
+            if label != SIZE and id(inst_table[label]) in index)
+    if MAIN not in labels:
+        return []
+
+    seen = set([labels[MAIN]])
+    pending = [labels[MAIN]]
+    while pending:
+        for j in successors(insts, pending.pop(), labels):
+            if j not in seen:
+                seen.add(j)
+                pending.append(j)
+    return [elem for i, elem in enumerate(insts) if i in seen]
+
+def referenced(insts):
+    "The names of the variables referenced by a list of instructions."
+    return set(elem.target for elem in insts if elem.mode in {EXT, DIR, VAR})
+
+def eliminate_dead(ast, data_table, inst_table):
+    """Remove the instructions that can't be reached from the main label and
+    the variables they don't reference, and update the symbol tables. Returns
+    the removed blocks of code (lists of consecutive instructions) and
+    variables. The addresses must be assigned again afterwards (with
+    asmsemantic.allocate).
+    """
+    live = reachable(ast, inst_table)
+    if not live:
+        return [], []
+    live_ids = set(id(elem) for elem in live)
+    used_vars = referenced(live)
+
+    dead_blocks, block = [], []
+    for elem in [elem for elem in ast if isinstance(elem, Inst)]:
+        if id(elem) in live_ids:
+            block = []
+        else:
+            if not block:
+                dead_blocks.append(block)
+            block.append(elem)
+    dead_insts = [elem for block in dead_blocks for elem in block]
+    dead_vars = [elem for elem in ast if isinstance(elem, Var) and elem.id not in used_vars]
+    dead_ids = set(id(elem) for elem in dead_insts + dead_vars)
+    ast[:] = [elem for elem in ast if id(elem) not in dead_ids]
+
+    for elem in dead_insts:
+        if elem.label != '':
+            del inst_table[elem.label]
+        inst_table[SIZE] -= elem.size
+    for elem in dead_vars:
+        del data_table[elem.id]
+        data_table[SIZE] -= elem.size
+    return dead_blocks, dead_vars
+
+def report_dead(dead_blocks, dead_vars, errors):
+    "Warn about each block of code and each variable that was removed."
+    for block in dead_blocks:
+        start, size = block[0], sum(elem.size for elem in block)
+        warn("Removed unreachable code{0} ({1:d} byte{2})",
+                " at {0}".format(start.label) if start.label != '' else '', size, 's' if size > 1 else '',
+                lineno=start.lineno, code='removed-code', errors=errors)
+    for elem in dead_vars:
+        warn("Removed unused variable {0} ({1:d} byte{2})", elem.id, elem.size, 's' if elem.size > 1 else '',
+                lineno=elem.lineno, code='removed-variable', errors=errors)
@@ -3,51 +3,71 @@
 
 from __future__ import print_function
 from functools import wraps
-from asmconstants import SIZE
-from asmerrors import error, warn
+from asmconstants import ABS, IMM, IMM_REL, IND, INH, REL, SIZE, VAR
+from asmerrors import error, find_column, warn
 from asmtokens import tokens
 
 # AST nodes
 
-class Const:
-    "AST node for a constant."
-    def __init__(self, id, value, lineno):
+class Const(object):
+    """AST node for a constant. Its value is the number it's defined as, or
+    None until the semantic analysis evaluates its expression.
+    """
+    __slots__ = ('id', 'expr', 'value', 'used', 'lineno')
+
+    def __init__(self, id, expr, lineno):
         self.id = id
-        self.value = value
+        self.expr = expr
+        self.value = expr[1] if expr[0] == 'num' else None
         self.used = False
         self.lineno = lineno
     def __repr__(self):
         return "Const<Id: '{0}', Value: {1}, Used: {2}, Line: {3:d}>"\
                 .format(self.id, self.value, self.used, self.lineno)
 
-class Var:
+class Var(object):
     "AST node for a variable."
+    __slots__ = ('id', 'size', 'addr', 'used', 'zero_page', 'lineno')
+
     def __init__(self, id, size, lineno):
         self.id = id
         self.size = size
         self.addr = -1
         self.used = False
+        self.zero_page = False
         self.lineno = lineno
     def __repr__(self):
         return "Var<Id: '{0}', Size: {1:d}, Addr: {2:d}, Used: {3}, Line: {4:d}>"\
                 .format(self.id, self.size, self.addr, self.used, self.lineno)
 
-class Inst:
-    "AST node for an instruction."
-    def __init__(self, label, inst, size, lineno):
+class Inst(object):
+    """AST node for an instruction: its name, addressing mode (see
+    asmconstants), size and operands. The value is the immediate value, the
+    offset (ind) or the key (imm-rel and imm-far), and the target is the
+    variable or the label it references.
+    """
+    __slots__ = ('label', 'name', 'mode', 'size', 'value', 'target', 'addr', 'used', 'lineno')
+
+    def __init__(self, label, lineno, name, size, mode=INH, value=None, target=None):
         self.label = label
-        self.inst = inst
+        self.name = name
+        self.mode = mode
         self.size = size
+        self.value = value
+        self.target = target
         self.addr = -1
         self.used = False if label != '.main' else True
         self.lineno = lineno
     def __repr__(self):
         if self.label != '':
             return "Inst<Label: '{0}', Size: {1:d}, Addr: {2:d}, Used: {3}, Line: {4:d}, Detail: {5!r}>"\
-                    .format(self.label, self.size, self.addr, self.used, self.lineno, str(self.inst))
+                    .format(self.label, self.size, self.addr, self.used, self.lineno, self.detail())
         else:
             return "Inst<Label: '{0}', Size: {1:d}, Addr: {2:d}, Line: {3:d}, Detail: {4!r}>"\
-                    .format(self.label, self.size, self.addr, self.lineno, str(self.inst))
+                    .format(self.label, self.size, self.addr, self.lineno, self.detail())
+    def detail(self):
+        "The name, mode and operands of the instruction."
+        return ' '.join(str(part) for part in (self.name, self.mode, self.value, self.target) if part is not None)
 
 
 # Helper decorator
@@ -75,66 +95,66 @@ precedence = (
         )
 
 def p_asm(p):
-    'asm : element ENDL asm'
-    if p[1] is None:
-        p[0] = p[3]
-    else:
-        p[0] = [p[1]] + p[3]
+    'asm : asm element ENDL'
+    p[0] = p[1]
+    if p[2] is not None:
+        p[0].append(p[2])
 def p_asm_empty(p):
     'asm : '
     p[0] = []
 
+def p_asm_error(p):
+    'asm : asm error ENDL'
+    error("Syntax error in instruction", lineno=p.lineno(2), code='syntax-error', errors=p.parser.errors)
+    p[0] = p[1]
+
 # Elements
 
 def p_element_declaration_constant(p):
     'element : IDENTIFIER EQU expr'
     name, lineno = p[1], p.lineno(1)
     if name in p.parser.const_table:
-        warn("Overriding already defined constant {0}", name, lineno=lineno)
-    try:
-        p.parser.const_table[name] = Const(name, eval_expr(p[3], p, lineno), lineno)
-    except SyntaxError: pass
-    pass
+        warn("Overriding already defined constant {0}", name, lineno=lineno,
+                code='constant-redefined', errors=p.parser.errors)
+    p.parser.const_table[name] = Const(name, p[3], lineno)
 
 def p_element_declaration_variable(p):
     'element : IDENTIFIER RMB NUM'
     name, size, lineno = p[1], p[3], p.lineno(1)
     if name in p.parser.data_table:
-        error("Duplicate name definition {0}", name, lineno=lineno, errors=p.parser.errors)
+        error("Duplicate name definition {0}", name, lineno=lineno, code='duplicate-name', errors=p.parser.errors)
     if size <= 0:
         error("Error in variable declaration {0}: the number of bytes must be greater than zero",
-                name, lineno=lineno, errors=p.parser.errors)
+                name, lineno=lineno, code='variable-size', errors=p.parser.errors)
     p[0] = Var(p[1], p[3], lineno)
     p.parser.data_table[name] = p[0]
     p.parser.data_table[SIZE] += size
 
 def p_element_declaration_error(p):
     'element : IDENTIFIER error expr'
-    error("Syntax error in declaration {0}", p[1], lineno=p.lineno(1), errors=p.parser.errors)
+    error("Syntax error in declaration {0}", p[1], lineno=p.lineno(1), code='syntax-error', errors=p.parser.errors)
 
 
 def p_element_instruction_label(p):
     'element : IDENTIFIER instruction'
     name, size, lineno = p[1], p[2][1], p.lineno(1)
     if name in p.parser.inst_table:
-        error("Duplicate label definition: {0}", name, lineno=lineno, errors=p.parser.errors)
-    p[0] = Inst(p[1], p[2], p[2][1], p.lineno(1))
+        error("Duplicate label definition: {0}", name, lineno=lineno, code='duplicate-label', errors=p.parser.errors)
+    p[0] = Inst(p[1], p.lineno(1), *p[2])
     p.parser.inst_table[name] = p[0]
     p.parser.inst_table[SIZE] += size
 
 def p_element_instruction_label_error(p):
     'element : IDENTIFIER error'
-    error("Syntax error in instruction at label {0}", p[1], lineno=p.lineno(1), errors=p.parser.errors)
+    error("Syntax error in instruction at label {0}", p[1], lineno=p.lineno(1),
+            code='syntax-error', errors=p.parser.errors)
 
 
 def p_element_instruction(p):
     'element : instruction'
     p.parser.inst_table[SIZE] += p[1][1]
-    p[0] = Inst('', p[1], p[1][1], p.lineno(1))
+    p[0] = Inst('', p.lineno(1), *p[1])
 
-def p_element_instruction_error(p):
-    'element : error'
-    error("Syntax error in instruction", lineno=p.lineno(1), errors=p.parser.errors)
 
 def p_element_empty(p):
     'element : '
@@ -175,12 +195,12 @@ def p_instruction_add(p):
 @lineno(1)
 def p_instruction_addd_expr(p):
     'instruction : ADDD expr'
-    p[0] = (p[1], 3, 'imm', eval_expr(p[2], p, p.lineno(1)))
+    p[0] = (p[1], 3, IMM, fold_expr(p[2]))
 
 @lineno(1)
 def p_instruction_addd_var(p):
     'instruction : ADDD IDENTIFIER'
-    p[0] = (p[1], 3, 'var', p[2])
+    p[0] = (p[1], 3, VAR, None, p[2])
 
 # ASRD
 @lineno(1)
@@ -199,13 +219,13 @@ def p_instruction_branch(p):
                    | BNE IDENTIFIER
                    | BPL IDENTIFIER
                    | BRA IDENTIFIER'''
-    p[0] = (p[1], 2, p[2])
+    p[0] = (p[1], 2, REL, None, p[2])
 
 # BKE
 @lineno(1)
 def p_instruction_branch_keyevent(p):
     'instruction : BKE LPAREN KEY_ID RPAREN IDENTIFIER'
-    p[0] = (p[1], 3, 'imm-rel', p[3], p[5])
+    p[0] = (p[1], 3, IMM_REL, p[3], p[5])
 
 # CLRS
 @lineno(1)
@@ -219,12 +239,12 @@ def p_instruction_compare_expr(p):
     '''instruction : CPK expr
                    | CPX expr'''
     size = 2 if p[1] in {'CPK'} else 3
-    p[0] = (p[1], size, 'imm', eval_expr(p[2], p, p.lineno(1)))
+    p[0] = (p[1], size, IMM, fold_expr(p[2]))
 
 @lineno(1)
 def p_instruction_compare_var(p):
     'instruction : CPX IDENTIFIER'
-    p[0] = (p[1], 3, 'var', p[2])
+    p[0] = (p[1], 3, VAR, None, p[2])
 
 # DRCL, DRHLN, DRRCT, DRVLN
 @lineno(1)
@@ -239,7 +259,7 @@ def p_instruction_draw(p):
 @lineno(1)
 def p_instruction_draw_symbol(p):
     'instruction : DRSYM CHAR'
-    p[0] = (p[1], 2, 'imm', p[2])
+    p[0] = (p[1], 2, IMM, p[2])
 
 # INX
 @lineno(1)
@@ -251,7 +271,7 @@ def p_instruction_inx(p):
 @lineno(1)
 def p_instruction_jsr(p):
     'instruction : JSR IDENTIFIER'
-    p[0] = (p[1], 3, p[2])
+    p[0] = (p[1], 3, ABS, None, p[2])
 
 # LDB, LDD, LDG, LDR, LDX, LDXA, LDXB, LDYA, LDYB
 @lineno(1)
@@ -268,7 +288,7 @@ def p_instruction_load_expr(p):
                    | LDYA expr
                    | LDYB expr'''
     size = 2 if p[1] in {'LDAA', 'LDAB', 'LDB', 'LDG', 'LDR'} else 3
-    p[0] = (p[1], size, 'imm', eval_expr(p[2], p, p.lineno(1)))
+    p[0] = (p[1], size, IMM, fold_expr(p[2]))
 
 @lineno(1)
 def p_instruction_load_var(p):
@@ -283,7 +303,7 @@ def p_instruction_load_var(p):
                    | LDXB IDENTIFIER
                    | LDYA IDENTIFIER
                    | LDYB IDENTIFIER'''
-    p[0] = (p[1], 3, 'var', p[2])
+    p[0] = (p[1], 3, VAR, None, p[2])
 
 # MUL
 @lineno(1)
@@ -331,7 +351,7 @@ def p_instruction_stack_pop(p):
 @lineno(1)
 def p_instruction_random(p):
     'instruction : RNDA expr'
-    p[0] = (p[1], 2, 'imm', eval_expr(p[2], p, p.lineno(1)))
+    p[0] = (p[1], 2, IMM, fold_expr(p[2]))
 
 # RSTK
 @lineno(1)
@@ -350,7 +370,7 @@ def p_instruction_rts(p):
 def p_instruction_store_ind(p):
     '''instruction : STAA NUM COMMA IX
                    | STAB NUM COMMA IX'''
-    p[0] = (p[1], 2, 'ind', p[2], 'x')
+    p[0] = (p[1], 2, IND, p[2])
 
 @lineno(1)
 def p_instruction_store_var(p):
@@ -358,7 +378,7 @@ def p_instruction_store_var(p):
                    | STAB IDENTIFIER
                    | STD IDENTIFIER
                    | STX IDENTIFIER'''
-    p[0] = (p[1], 3, 'var', p[2])
+    p[0] = (p[1], 3, VAR, None, p[2])
 
 # SUBA, SUBD
 @lineno(1)
@@ -366,13 +386,13 @@ def p_instruction_subtract_expr(p):
     '''instruction : SUBA expr
                    | SUBD expr'''
     size = 2 if p[1] in {'SUBA'} else 3
-    p[0] = (p[1], size, 'imm', eval_expr(p[2], p, p.lineno(1)))
+    p[0] = (p[1], size, IMM, fold_expr(p[2]))
 
 @lineno(1)
 def p_instruction_subtract_var(p):
     '''instruction : SUBA IDENTIFIER
                    | SUBD IDENTIFIER'''
-    p[0] = (p[1], 3, 'var', p[2])
+    p[0] = (p[1], 3, VAR, None, p[2])
 
 # TDXA, TDXB, TDYA, TDYB
 @lineno(1)
@@ -391,29 +411,26 @@ def p_instruction_xgdx(p):
     p[0] = (p[1], 1)
 
 def p_error(t):
+    syntax_error(t, t.lexer.errors if t is not None else None)
+
+def syntax_error(t, errors):
+    """Report a syntax error near a token, or at the end of the input if there's
+    no token. The parsers of asmutil report to their error report (PLY gives no
+    way to get it at the end of the input).
+    """
+    if t is None:
+        error("Syntax error at the end of the input", code='syntax-error', errors=errors)
+        return
     value = t.value if t.value != '\n' else 'NEWLINE'
-    error("Syntax error near token {0}", value, lineno=t.lineno)
+    error("Syntax error near token {0}", value, lineno=t.lineno, column=find_column(t.lexer.lexdata, t.lexpos),
+            code='syntax-error', errors=errors)
 
 
 # Functions to walk the AST
 
-def eval_expr(ast, p, lineno):
-    "Returns the value obtained by evaluating an expression."
-    expr_type = ast[0]
-    if expr_type == 'num':
-        return ast[1]
-    elif expr_type == 'const':
-        name = ast[1]
-        if name not in p.parser.const_table:
-            error("Undefined constant {0}", name, lineno=lineno, errors=p.parser.errors)
-            raise SyntaxError
-        p.parser.const_table[name].used = True
-        return p.parser.const_table[name].value
-    elif expr_type == '+':
-        return eval_expr(ast[1], p, lineno) + eval_expr(ast[2], p, lineno)
-    elif expr_type == '-':
-        return eval_expr(ast[1], p, lineno) - eval_expr(ast[2], p, lineno)
-    elif expr_type == '*':
-        return eval_expr(ast[1], p, lineno) * eval_expr(ast[2], p, lineno)
-    elif expr_type == '/':
-        return eval_expr(ast[1], p, lineno) / eval_expr(ast[2], p, lineno)
+def fold_expr(ast):
+    """The number of an expression that is a number, or the expression itself
+    (constants can be defined after they're used, so they're evaluated by the
+    semantic analysis).
+    """
+    return ast[1] if ast[0] == 'num' else ast
@@ -0,0 +1,80 @@
+# Data layout: places the most used variables in the first 256 bytes of memory,
+# so the instructions that reference them can use direct addressing.
+
+from __future__ import print_function
+from asmconstants import DIR, EXT, REL, SIZE, OP_CODES
+from asmgrammar import Inst, Var
+from asmsemantic import DIRECT_PAGE, MAIN, branch_target
+
+# The zero page region starts after a BRA to the main label, so it can't be
+# bigger than the maximum offset of a relative branch.
+ZERO_PAGE_SIZE = 127
+# Weight of a reference inside a loop, relative to one outside of it
+LOOP_WEIGHT = 10
+
+def place_zero_page(ast, data_table, inst_table, profile=None):
+    """Move the most referenced variables to a region at the start of memory,
+    right after a branch to the main label. References are weighted by their
+    execution count in the profile (a dictionary of line numbers to counts),
+    or by their loop nesting if there's no profile.
+    Returns the list of variables that were moved. The addresses must be
+    assigned again afterwards (with asmsemantic.allocate).
+    """
+    if inst_table[SIZE] + data_table[SIZE] <= DIRECT_PAGE or MAIN not in inst_table:
+        return []
+
+    weights = reference_weights(ast, profile)
+    candidates = sorted((name for name in weights if weights[name] > 0),
+            key=lambda name: (-float(weights[name]) / data_table[name].size, data_table[name].lineno))
+
+    zero_page, free = [], ZERO_PAGE_SIZE
+    for name in candidates:
+        if data_table[name].size <= free:
+            zero_page.append(data_table[name])
+            free -= data_table[name].size
+    if not zero_page:
+        return []
+
+    for var in zero_page:
+        var.zero_page = True
+        ast.remove(var)
+    first = next(i for i, elem in enumerate(ast) if isinstance(elem, Inst))
+    trampoline = Inst('', inst_table[MAIN].lineno, 'BRA', 2, REL, target=MAIN)
+    ast[first:first] = [trampoline] + zero_page
+    inst_table[SIZE] += trampoline.size
+    return zero_page
+
+def reference_weights(ast, profile=None):
+    """Weight the references to each variable from instructions that have a
+    direct addressing mode.
+    """
+    insts = [elem for elem in ast if isinstance(elem, Inst)]
+    depths = loop_depths(insts) if profile is None else None
+
+    weights = {}
+    for i, elem in enumerate(insts):
+        if elem.mode in {EXT, DIR} and DIR in OP_CODES[elem.name]:
+            if profile is None:
+                weight = LOOP_WEIGHT ** depths[i]
+            else:
+                weight = profile.get(elem.lineno, 0)
+            weights[elem.target] = weights.get(elem.target, 0) + weight
+    return weights
+
+def loop_depths(insts):
+    """The loop nesting depth of each instruction. A loop is the range of
+    instructions between a backward branch and its target.
+    """
+    index = dict((elem.label, i) for i, elem in enumerate(insts) if elem.label != '')
+    deltas = [0] * (len(insts) + 1)
+    for i, elem in enumerate(insts):
+        target = branch_target(elem)
+        if target in index and index[target] <= i:
+            deltas[index[target]] += 1
+            deltas[i + 1] -= 1
+
+    depths, depth = [], 0
+    for delta in deltas[:-1]:
+        depth += delta
+        depths.append(depth)
+    return depths
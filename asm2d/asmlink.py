@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+# Linker: lays out the object files of the modules of a program (see
+# asmobject) in one memory image, and resolves their relocations.
+#
+# The layout follows the same rules as asmsemantic.layout: the code of the
+# module with the main label starts at the main address, followed by the code
+# of the other modules (in the order they are given), and then by the data
+# sections. A module uses its own symbols first, the ones of the other modules
+# otherwise (a symbol used by another module must be defined only once).
+
+from __future__ import print_function
+import argparse
+import os
+import sys
+import asmobject
+import asmoutput
+from asmcodegen import MemoryImage, to_bytes
+from asmerrors import ErrorReport, error
+from asmsemantic import MAIN, MAIN_ADDR
+from assembler import Assembler, read_file
+
+class Module:
+    "An object file in a program, with the addresses of its sections."
+
+    def __init__(self, name, obj):
+        self.name = name
+        self.obj = obj
+        self.code_addr = None
+        self.data_addr = None
+
+    def addr(self, symbol):
+        "The address of a symbol of the module."
+        entry = self.obj.symbols[symbol]
+        base = self.code_addr if entry['section'] == 'code' else self.data_addr
+        return base + entry['offset']
+
+
+def layout(modules):
+    "Assign the addresses of the sections of the modules. Returns the code size."
+    code_offset = MAIN_ADDR
+    for module in modules:
+        module.code_addr = code_offset
+        code_offset += module.obj.code_size
+    data_offset = code_offset
+    for module in modules:
+        module.data_addr = data_offset
+        data_offset += module.obj.data_size
+    return code_offset - MAIN_ADDR
+
+def link(modules, errors):
+    """Link the modules of a program: returns the memory image, or None if
+    there were errors. The module with the main label is moved first.
+    """
+    mains = [module for module in modules if module.obj.symbols.get(MAIN, {}).get('section') == 'code']
+    if not mains:
+        error("Main entry point not defined", code='main-undefined', errors=errors)
+    elif len(mains) > 1:
+        error("Main entry point defined in modules {0}", ', '.join(module.name for module in mains),
+                code='duplicate-main', errors=errors)
+    if errors.has_errors():
+        return None
+    modules[:] = mains + [module for module in modules if module is not mains[0]]
+
+    definitions = {}
+    for module in modules:
+        for symbol in module.obj.symbols:
+            definitions.setdefault(symbol, []).append(module)
+
+    code_size = layout(modules)
+    data_size = sum(module.obj.data_size for module in modules)
+    image = MemoryImage(code_size + data_size)
+    for module in modules:
+        image.data[module.code_addr:module.code_addr+module.obj.code_size] = module.obj.image.data
+        image.notes[module.code_addr:module.code_addr+module.obj.code_size] = module.obj.image.notes
+        for symbol, entry in module.obj.symbols.items():
+            if entry['section'] == 'data':
+                image.put(module.addr(symbol), [0] * entry['size'], symbol)
+
+    for module in modules:
+        for reloc in module.obj.relocations:
+            relocate(image, module, reloc, definitions, errors)
+    return None if errors.has_errors() else image
+
+def relocate(image, module, reloc, definitions, errors):
+    "Patch the bytes of a relocation with the address of its symbol."
+    symbol, section = reloc['symbol'], reloc['section']
+    kind = 'label' if section == 'code' else 'variable'
+    if symbol in module.obj.symbols:
+        target = module
+    elif len(definitions.get(symbol, [])) == 1:
+        target = definitions[symbol][0]
+    elif symbol in definitions:
+        error("{0} {1} defined in modules {2} (used in {3})", kind.capitalize(), symbol,
+                ', '.join(other.name for other in definitions[symbol]), module.name,
+                lineno=reloc['line'], code='duplicate-symbol', errors=errors)
+        return
+    else:
+        error("Undefined {0} {1} (in {2})", kind, symbol, module.name, lineno=reloc['line'],
+                code='undefined-symbol', errors=errors)
+        return
+    if target.obj.symbols[symbol]['section'] != section:
+        error("{0} is not a {1} (in {2})", symbol, kind, module.name, lineno=reloc['line'],
+                code='symbol-section', errors=errors)
+        return
+
+    addr = target.addr(symbol)
+    offset = module.code_addr + reloc['offset']
+    if reloc['type'] == 'abs16':
+        note = "{0} (abs {1:d})".format(symbol, addr) if section == 'code' else addr
+        image.put(offset, to_bytes(addr, 2, signed=False), note)
+    else:
+        relative_addr = addr - (offset + 1)
+        if relative_addr < -128 or relative_addr > 127:
+            error("Branch to {0} out of range (in {1})", symbol, module.name, lineno=reloc['line'],
+                    code='branch-range', errors=errors)
+            return
+        image.put(offset, to_bytes(relative_addr, 1), "{0} (rel {1:d})".format(symbol, relative_addr))
+
+def symbol_map(modules):
+    """The symbols of a linked program, in the format of asmoutput.symbol_map.
+    Symbols defined in more than one module are prefixed by the module name.
+    """
+    counts = {}
+    for module in modules:
+        for symbol in module.obj.symbols:
+            counts[symbol] = counts.get(symbol, 0) + 1
+    symbols = {'constants': {}, 'labels': {}, 'variables': {}}
+    for module in modules:
+        for symbol, entry in module.obj.symbols.items():
+            name = symbol if counts[symbol] == 1 else '{0}:{1}'.format(module.name, symbol)
+            table = symbols['labels'] if entry['section'] == 'code' else symbols['variables']
+            table[name] = {'addr': module.addr(symbol), 'size': entry['size'], 'line': entry['line']}
+    return symbols
+
+
+def load_module(filename, assembler=None):
+    """Load the object file of a module. For a source file, the object file
+    next to it is used if it's newer, otherwise the source is assembled and the
+    object file written.
+    """
+    base, ext = os.path.splitext(filename)
+    if ext != asmobject.EXTENSION:
+        object_file = base + asmobject.EXTENSION
+        if not os.path.isfile(object_file) or os.path.getmtime(object_file) < os.path.getmtime(filename):
+            result = (assembler or Assembler()).assemble(read_file(filename), errors=ErrorReport(),
+                    relocatable=True)
+            with open(object_file, 'w') as f:
+                f.write(result.output)
+            return Module(filename, result.object)
+        filename = object_file
+    try:
+        return Module(filename, asmobject.read_object(read_file(filename)))
+    except ValueError as e:
+        print("Error reading object file '{0}': {1}.".format(filename, e), file=sys.stderr)
+        sys.exit(1)
+
+
+def main():
+    "Parse the command line arguments, and link the modules."
+    parser = argparse.ArgumentParser(
+            description='Linker for the object files of asm2d (source files are assembled if they changed).')
+    parser.add_argument('files', nargs='+', help='the object (or source) files')
+    parser.add_argument('-o', '--output-file',
+            help='the output file (by default, the name of the first file with the extension of the format)')
+    parser.add_argument('-w', '--words', type=int, default=None,
+            help='the number of words in the memory')
+    parser.add_argument('-f', '--format', choices=sorted(asmoutput.FORMATS),
+            help='the output format (by default, guessed from the output file name, or mif)')
+    parser.add_argument('-c', '--compact', action='store_true',
+            help='write runs of identical bytes as address ranges, without comments')
+    parser.add_argument('--comments', action='store_true',
+            help='keep the comments in compact mode')
+    parser.add_argument('-m', '--map', nargs='?', const='',
+            help='write a symbol map, as JSON if the name ends with .json')
+    args = parser.parse_args()
+
+    output_format = args.format
+    if output_format is None:
+        output_format = asmoutput.guess_format(args.output_file or '')
+    filename, ext = os.path.splitext(args.files[0])
+    output_file = args.output_file
+    if output_file is None:
+        output_file = filename + asmoutput.EXTENSIONS[output_format]
+    map_file = filename + '.map' if args.map == '' else args.map
+
+    assembler = Assembler()
+    modules = [load_module(name, assembler) for name in args.files]
+    errors = ErrorReport()
+    image = link(modules, errors)
+    errors.report_errors()
+
+    mode = 'wb+' if output_format in asmoutput.BINARY_FORMATS else 'w+'
+    with open(output_file, mode) as f:
+        asmoutput.FORMATS[output_format](image, args.words or len(image), f, compact=args.compact,
+                comments=args.comments or not args.compact)
+    if map_file is not None:
+        with open(map_file, 'w') as f:
+            if map_file.lower().endswith('.json'):
+                asmoutput.output_map_json(symbol_map(modules), f)
+            else:
+                asmoutput.output_map(symbol_map(modules), f)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# Relocatable object files: a module of a program assembled on its own, with
+# the labels and variables it doesn't define left to the linker (asmlink).
+#
+# An object file is a JSON object with the bytes of the code section (and the
+# notes of the memory image), the size of the data section, the symbols the
+# module defines (labels in the code section, variables in the data section,
+# with their offset in the section), the externals it references and the
+# relocations: the addresses in the code section that depend on where the
+# symbols end up. Relocations are absolute (two bytes: JSR, JMP, extended
+# variables and long branches) or relative (one byte: branches and BKE to an
+# external label). Branches to a label of the same module are resolved by the
+# assembler, since the code section is moved as a whole.
+
+from __future__ import print_function
+import binascii
+import json
+import sys
+from asmcodegen import MemoryImage, codegen_elem, codegen_opcode
+from asmconstants import ABS, EXT, FAR, IMM_FAR, IMM_REL, KEY_TABLE, OP_CODES, REL, SIZE
+from asmgrammar import Inst, Var
+
+FORMAT = 'asm2d-object'
+VERSION = 1
+EXTENSION = '.o2d'
+
+class ObjectFile:
+    """A relocatable module: the memory image of its code section, the size of
+    its data section, its symbols, externals and relocations.
+
+    A symbol is a dictionary with the section ('code' or 'data'), the offset
+    in the section, the size and the line. A relocation is a dictionary with
+    the offset of the bytes to patch in the code section, the type ('abs16' or
+    'rel8'), the symbol, the section the symbol must be in and the line.
+    """
+
+    def __init__(self, image, data_size, symbols, externals, relocations):
+        self.image = image
+        self.data_size = data_size
+        self.symbols = symbols
+        self.externals = externals
+        self.relocations = relocations
+
+    @property
+    def code_size(self):
+        return len(self.image)
+
+    def to_json(self):
+        return {
+                'format': FORMAT,
+                'version': VERSION,
+                'code': binascii.hexlify(bytes(self.image.data)).decode('ascii'),
+                'notes': self.image.notes,
+                'data_size': self.data_size,
+                'symbols': self.symbols,
+                'externals': sorted(self.externals),
+                'relocations': self.relocations,
+                }
+
+
+def reference(elem, externals):
+    """The symbol an instruction references that needs a relocation, the type
+    of relocation, the offset of the bytes to patch and the section of the
+    symbol, or None if it doesn't need one.
+    """
+    mode = elem.mode
+    if mode == ABS:
+        return elem.target, 'abs16', elem.addr + 1, 'code'
+    elif mode == REL and elem.target in externals:
+        return elem.target, 'rel8', elem.addr + 1, 'code'
+    elif mode == EXT:
+        return elem.target, 'abs16', elem.addr + 1, 'data'
+    elif mode == FAR or mode == IMM_FAR:
+        # The JMP at the end of the long branch
+        return elem.target, 'abs16', elem.addr + elem.size - 2, 'code'
+    elif mode == IMM_REL and elem.target in externals:
+        return elem.target, 'rel8', elem.addr + 2, 'code'
+    return None
+
+def codegen_external(image, elem, offset, symbol):
+    """Generate the memory contents of an instruction that references an
+    external symbol, leaving its address (or offset) to the linker.
+    """
+    code = OP_CODES[elem.name][EXT] if elem.mode == EXT else OP_CODES[elem.name]
+    codegen_opcode(image, elem, elem.addr, code=code)
+    if elem.mode == IMM_REL:
+        key = elem.value
+        image.put(elem.addr + 1, [KEY_TABLE[key]], "KEY_{0:d}".format(key))
+    image.put(offset, [0] * (elem.addr + elem.size - offset), symbol)
+
+def generate_object(ast, data_table, inst_table, externals):
+    """Generate the object file of a module, analysed with the given set of
+    externals (see asmsemantic.analyse). Variables must not be in the zero
+    page.
+    """
+    code_size = inst_table[SIZE]
+    image = MemoryImage(code_size)
+    relocations = []
+    for elem in ast:
+        if not isinstance(elem, Inst):
+            continue
+        ref = reference(elem, externals)
+        if ref is not None and ref[0] in externals:
+            codegen_external(image, elem, ref[2], ref[0])
+        else:
+            codegen_elem(image, elem, data_table, inst_table)
+        if ref is not None:
+            symbol, reloc_type, offset, section = ref
+            relocations.append({'offset': offset, 'type': reloc_type, 'symbol': symbol, 'section': section,
+                'line': elem.lineno})
+
+    symbols = {}
+    for elem in ast:
+        if isinstance(elem, Inst) and elem.label != '':
+            symbols[elem.label] = {'section': 'code', 'offset': elem.addr, 'size': elem.size, 'line': elem.lineno}
+        elif isinstance(elem, Var):
+            symbols[elem.id] = {'section': 'data', 'offset': elem.addr - code_size, 'size': elem.size,
+                    'line': elem.lineno}
+    return ObjectFile(image, data_table[SIZE], symbols, set(externals), relocations)
+
+def write_object(obj, outfile=sys.stdout):
+    "Write an object file."
+    json.dump(obj.to_json(), outfile, sort_keys=True, separators=(',', ':'))
+    outfile.write('\n')
+
+def read_object(contents):
+    """Read an object file from its contents. Raises ValueError if it isn't a
+    valid object file.
+    """
+    try:
+        fields = json.loads(contents)
+        if fields.get('format') != FORMAT or fields.get('version') != VERSION:
+            raise ValueError("Not an asm2d object file (version {0:d})".format(VERSION))
+        data = bytearray(binascii.unhexlify(fields['code']))
+        image = MemoryImage(len(data))
+        image.data[:] = data
+        image.notes[:] = fields['notes']
+        return ObjectFile(image, fields['data_size'], fields['symbols'], set(fields['externals']),
+                fields['relocations'])
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError("Invalid object file ({0})".format(e))
@@ -0,0 +1,144 @@
+# Peephole optimizer: rewrites short sequences of instructions into cheaper
+# ones. It runs between the semantic analysis and the code generation, and the
+# addresses must be assigned again afterwards (with asmsemantic.allocate).
+
+from __future__ import print_function
+import sys
+from asmconstants import ABS, CYCLES, DIR, EXT, IND
+from asmerrors import ErrorReport
+from asmgrammar import Inst
+from asmsemantic import branch_target
+from asmstack import StackAnalysis
+from asmtiming import inst_cycles
+
+# Loads that can be removed right after a store of the same register
+STORE_LOADS = {'STAA': 'LDAA', 'STAB': 'LDAB', 'STD': 'LDD', 'STX': 'LDX'}
+
+def operand(elem):
+    "The memory operand of an instruction (a variable or an offset), or None."
+    if elem.mode == EXT or elem.mode == DIR:
+        return elem.target
+    elif elem.mode == IND:
+        return IND, elem.value
+    return None
+
+# Rules: each one gets the list of instructions and an index, and returns the
+# number of instructions it replaces from that index, the instructions that are
+# left (it can change them, but not add new ones) and the cycles saved, or None
+# if it doesn't apply. Instructions with a label can't be removed (they can be
+# the target of a branch).
+
+def rule_store_load(insts, i, inst_table):
+    "STAA X / LDAA X: the load is redundant (the store sets the same flags)."
+    store, load = insts[i:i+2]
+    if load.label == '' and STORE_LOADS.get(store.name) == load.name and \
+            operand(store) is not None and operand(store) == operand(load):
+        return 2, [store], inst_cycles(load)
+
+def rule_tail_call(insts, i, inst_table):
+    """JSR L / RTS: jump to the subroutine, which returns to our caller. Only
+    when the stack analysis shows that the subroutine leaves the stack as it
+    found it and never pulls its return address (a subroutine that reads
+    arguments under its return address needs to be called).
+    """
+    call, ret = insts[i:i+2]
+    if call.name == 'JSR' and ret.name == 'RTS' and ret.label == '' and keeps_stack(insts, inst_table, call.target):
+        saved = inst_cycles(call) + inst_cycles(ret) - CYCLES['JMP']
+        call.name, call.mode = 'JMP', ABS
+        return 2, [call], saved
+
+def keeps_stack(insts, inst_table, label):
+    """Whether a subroutine returns with the stack depth it was called with, on
+    every path, without going below it.
+    """
+    analysis = StackAnalysis(insts, inst_table, ErrorReport(verbose=False, fatal=False))
+    if label not in analysis.index:
+        return False
+    routine = analysis.routine(label)
+    return routine.net == 0 and routine.min_depth >= 0 and not analysis.recursive and not analysis.unbalanced
+
+def rule_push_pull(insts, i, inst_table):
+    "PSHA / PULA: nothing happens in between, the pair can be removed."
+    push, pull = insts[i:i+2]
+    if push.label == '' and pull.label == '' and push.name.startswith('PSH') and \
+            pull.name == 'PUL' + push.name[3:]:
+        return 2, [], inst_cycles(push) + inst_cycles(pull)
+
+def rule_thread_branch(insts, i, inst_table):
+    "B L / L: BRA M: branch directly to M (skipping the BRA)."
+    label = branch_target(insts[i])
+    if label not in inst_table:
+        return None
+    saved, seen = 0, {label}
+    while inst_table[label].name == 'BRA':
+        saved += inst_cycles(inst_table[label])
+        label = branch_target(inst_table[label])
+        if label in seen or label not in inst_table:
+            # The chain loops (or leaves the program): leave the branch alone
+            return None
+        seen.add(label)
+    if label != branch_target(insts[i]):
+        insts[i].target = label
+        inst_table[label].used = True
+        return 1, [insts[i]], saved
+
+# Name, function and number of instructions of each rule
+RULES = [
+        ('store-load', rule_store_load, 2),
+        ('tail-call', rule_tail_call, 2),
+        ('push-pull', rule_push_pull, 2),
+        ('thread-branch', rule_thread_branch, 1)
+        ]
+
+class Stats:
+    "Hit counts, and bytes and cycles saved by each rule."
+
+    def __init__(self, rules=RULES):
+        self.rules = [name for name, _, _ in rules]
+        self.hits = dict((name, 0) for name in self.rules)
+        self.bytes = dict((name, 0) for name in self.rules)
+        self.cycles = dict((name, 0) for name in self.rules)
+
+    def add(self, name, bytes_saved, cycles_saved):
+        self.hits[name] += 1
+        self.bytes[name] += bytes_saved
+        self.cycles[name] += cycles_saved
+
+    def report(self, outfile=sys.stderr):
+        "Print the hits and savings of each rule, and the totals."
+        row = "{0:<14} {1:>6} {2:>6} {3:>7}"
+        print(row.format('rule', 'hits', 'bytes', 'cycles'), file=outfile)
+        for name in self.rules:
+            print(row.format(name, self.hits[name], self.bytes[name], self.cycles[name]), file=outfile)
+        print(row.format('total', sum(self.hits.values()), sum(self.bytes.values()),
+            sum(self.cycles.values())), file=outfile)
+
+
+def optimize(ast, inst_table, rules=RULES):
+    """Apply the rules to the instructions of a program until none of them
+    applies. Variables in the AST are left where they are. Returns the stats.
+    """
+    stats = Stats(rules)
+    changed = True
+    while changed:
+        changed = False
+        insts = [elem for elem in ast if isinstance(elem, Inst)]
+        removed = set()
+        i = 0
+        while i < len(insts):
+            for name, rule, width in rules:
+                if i + width > len(insts):
+                    continue
+                size = sum(elem.size for elem in insts[i:i+width])
+                match = rule(insts, i, inst_table)
+                if match is not None:
+                    count, kept, cycles = match
+                    removed.update(id(elem) for elem in insts[i:i+count] if elem not in kept)
+                    stats.add(name, size - sum(elem.size for elem in kept), cycles)
+                    insts[i:i+count] = kept
+                    changed = True
+                    break
+            else:
+                i += 1
+        ast[:] = [elem for elem in ast if id(elem) not in removed]
+    return stats
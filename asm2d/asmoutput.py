@@ -0,0 +1,220 @@
+# Output formats for the memory image of a program: MIF (Memory Initialization
+# File), Intel HEX, raw binary and $readmemh. Also the listing (the source code
+# with the address and bytes of each line) and the symbol map.
+
+from __future__ import print_function
+import json
+import math
+import os
+import sys
+from itertools import groupby
+
+# Helper functions
+
+def calculate_addr_bits(depth):
+    """Calculate the number of bits (in multiples of 4) needed to address the
+    specified number of words.
+    """
+    return int(math.ceil(math.log(depth, 2) / 4)) * 4
+
+# MIF output
+
+def output_mif(image, depth, outfile=sys.stdout, compact=False, comments=True, **options):
+    """Output the memory image in MIF format, with the notes as comments. In
+    compact mode, runs of identical bytes (with the same comment) are written
+    as address ranges.
+    """
+    addr_format = '{{0:0{0:d}X}}'.format(calculate_addr_bits(depth) // 4)
+    notes = image.notes if comments else [None] * len(image)
+    lines = mif_header(depth)
+
+    if compact:
+        lines.extend(mif_runs(image.data, notes, depth, addr_format))
+        lines.append('\nEND;')
+    else:
+        for addr, (value, note) in enumerate(zip(image.data, notes)):
+            lines.append(mif_line(addr_format.format(addr), value, note))
+        lines.extend(mif_footer(depth, len(image), addr_format))
+
+    outfile.write('\n'.join(lines) + '\n')
+
+def mif_runs(data, notes, depth, addr_format):
+    """The lines of the content of a MIF file, with runs of identical bytes
+    coalesced into address ranges. The unused memory at the end of the block
+    (filled with zeros) is merged with the last run when possible.
+    """
+    runs = []
+    for (value, note), run in groupby(zip(data, notes)):
+        start = runs[-1][1] + 1 if runs else 0
+        runs.append([start, start + len(list(run)) - 1, value, note])
+    if depth > len(data):
+        if runs and runs[-1][2:] == [0, None]:
+            runs[-1][1] = depth - 1
+        else:
+            runs.append([len(data), depth - 1, 0, None])
+
+    lines = []
+    for start, end, value, note in runs:
+        if start == end:
+            addr = addr_format.format(start)
+        else:
+            addr = '[{0}..{1}]'.format(addr_format.format(start), addr_format.format(end))
+        lines.append(mif_line(addr, value, note))
+    return lines
+
+def mif_line(addr, value, note):
+    "A line of the content of a MIF file."
+    line = '{0} : {1:02X};'.format(addr, value)
+    if note is not None and note != '':
+        line += '    -- {0}'.format(note)
+    return line
+
+def mif_header(depth, width=8, addr_radix='HEX', data_radix='HEX'):
+    "The lines of the header of a MIF file."
+    return ['DEPTH = {0:d};\t\t\t-- Size of memory in words'.format(depth),
+            'WIDTH = {0:d};\t\t\t\t-- Size of word in bits'.format(width),
+            'ADDRESS_RADIX = {0};\t-- Radix for address values'.format(addr_radix),
+            'DATA_RADIX = {0};\t\t-- Radix for data values'.format(data_radix),
+            'CONTENT',
+            'BEGIN\n']
+
+def mif_footer(depth, mem_size, addr_format):
+    "The lines of the footer of a MIF file."
+    lines = []
+    if depth > mem_size:
+        lines.append('\n[{0}..{1}] : {2};'.format(addr_format.format(mem_size), addr_format.format(depth-1), '00'))
+    lines.append('\nEND;')
+    return lines
+
+# Intel HEX output
+
+def output_intel_hex(image, depth, outfile=sys.stdout, record_size=16, **options):
+    """Output the memory image in Intel HEX format. Extended linear address
+    records are added for memories larger than 64K.
+    """
+    data = bytes(image.data) + bytes(bytearray(max(0, depth - len(image))))
+    lines = []
+    for addr in range(0, len(data), record_size):
+        if addr > 0xFFFF and addr & 0xFFFF < record_size:
+            lines.append(intel_hex_record(0, 4, bytearray([addr >> 24 & 0xFF, addr >> 16 & 0xFF])))
+        lines.append(intel_hex_record(addr & 0xFFFF, 0, bytearray(data[addr:addr+record_size])))
+    lines.append(intel_hex_record(0, 1, bytearray()))
+    outfile.write('\n'.join(lines) + '\n')
+
+def intel_hex_record(addr, record_type, data):
+    "A record (line) of an Intel HEX file."
+    record = bytearray([len(data), addr >> 8, addr & 0xFF, record_type]) + data
+    checksum = -sum(record) & 0xFF
+    return ':' + ''.join('{0:02X}'.format(value) for value in record) + '{0:02X}'.format(checksum)
+
+# Raw binary output
+
+def output_binary(image, depth, outfile=sys.stdout, **options):
+    "Output the memory image as raw bytes."
+    outfile.write(bytes(image.data) + bytes(bytearray(max(0, depth - len(image)))))
+
+# $readmemh output
+
+def output_readmemh(image, depth, outfile=sys.stdout, comments=True, **options):
+    """Output the memory image as a $readmemh file (one byte per line), with the
+    notes as comments.
+    """
+    notes = image.notes if comments else [None] * len(image)
+    lines = []
+    for value, note in zip(image.data, notes):
+        if note is not None and note != '':
+            lines.append('{0:02X}    // {1}'.format(value, note))
+        else:
+            lines.append('{0:02X}'.format(value))
+    lines.extend(['00'] * max(0, depth - len(image)))
+    outfile.write('\n'.join(lines) + '\n')
+
+# Listing
+
+# Bytes in each line of a listing (the rest go in continuation lines)
+LISTING_BYTES = 4
+
+def output_listing(image, ast, source, outfile=sys.stdout):
+    """Output a listing of a program: each line of the source code, with the
+    address and the bytes of the instruction or variable it defines.
+    """
+    addr_format = '{{0:0{0:d}X}}'.format(max(calculate_addr_bits(max(len(image), 2)) // 4, 4))
+    blank = ' ' * len(addr_format.format(0))
+    lines_addr = dict((elem.lineno, (elem.addr, elem.size)) for elem in ast if hasattr(elem, 'addr'))
+    lines = []
+    for lineno, line in enumerate(source.splitlines(), 1):
+        if lineno in lines_addr:
+            addr, size = lines_addr[lineno]
+            data = image.data[addr:addr+size]
+            lines.append(listing_line(addr_format.format(addr), data[:LISTING_BYTES], lineno, line))
+            for start in range(LISTING_BYTES, size, LISTING_BYTES):
+                lines.append(listing_line(addr_format.format(addr + start), data[start:start+LISTING_BYTES]))
+        else:
+            lines.append(listing_line(blank, [], lineno, line))
+    outfile.write('\n'.join(lines) + '\n')
+
+def listing_line(addr, data, lineno=None, line=''):
+    "A line of a listing: the address, the bytes, the line number and the source."
+    data = ' '.join('{0:02X}'.format(value) for value in data)
+    lineno = '' if lineno is None else lineno
+    return '{0}  {1:<{2}} {3:>5}  {4}'.format(addr, data, LISTING_BYTES * 3, lineno, line).rstrip()
+
+# Symbol map
+
+def symbol_map(const_table, data_table, inst_table):
+    """The symbols of a program: the value of each constant, and the address,
+    size and line of each label and variable.
+    """
+    return {
+            'constants': dict((name, {'value': const.value, 'line': const.lineno})
+                for name, const in const_table.items()),
+            'labels': dict((name, {'addr': inst.addr, 'size': inst.size, 'line': inst.lineno})
+                for name, inst in inst_table.items() if hasattr(inst, 'addr')),
+            'variables': dict((name, {'addr': var.addr, 'size': var.size, 'line': var.lineno})
+                for name, var in data_table.items() if hasattr(var, 'addr')),
+            }
+
+def output_map(symbols, outfile=sys.stdout):
+    """Output a symbol map as text: the labels and variables sorted by address,
+    and then the constants.
+    """
+    lines = ['{0:<6} {1:>5} {2:<9} {3:<24} {4:>5}'.format('addr', 'size', 'type', 'name', 'line')]
+    entries = [(entry['addr'], name, 'label', entry) for name, entry in symbols['labels'].items()]
+    entries += [(entry['addr'], name, 'variable', entry) for name, entry in symbols['variables'].items()]
+    for addr, name, kind, entry in sorted(entries):
+        lines.append('{0:04X}   {1:>5d} {2:<9} {3:<24} {4:>5d}'.format(addr, entry['size'], kind, name, entry['line']))
+    for name, entry in sorted(symbols['constants'].items()):
+        lines.append('{0:<6} {1:>5} {2:<9} {3:<24} {4:>5d}'.format(entry['value'], '', 'constant', name, entry['line']))
+    outfile.write('\n'.join(lines) + '\n')
+
+def output_map_json(symbols, outfile=sys.stdout):
+    "Output a symbol map as a JSON object."
+    json.dump(symbols, outfile, indent=2, separators=(',', ': '), sort_keys=True)
+    outfile.write('\n')
+
+# Formats
+
+FORMATS = {
+        'bin': output_binary,
+        'ihex': output_intel_hex,
+        'mif': output_mif,
+        'readmemh': output_readmemh,
+        }
+
+# Formats that must be written to a file opened in binary mode
+BINARY_FORMATS = {'bin'}
+
+EXTENSIONS = {
+        'bin': '.bin',
+        'ihex': '.hex',
+        'mif': '.mif',
+        'readmemh': '.mem',
+        }
+
+def guess_format(filename, default='mif'):
+    "Find the output format from the extension of a file name."
+    _, ext = os.path.splitext(filename)
+    for output_format, format_ext in EXTENSIONS.items():
+        if ext.lower() == format_ext:
+            return output_format
+    return default
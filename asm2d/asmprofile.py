@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+# Profiler: runs a program in the simulator for a number of frames, pressing
+# the keys given by a script, and counts how many times each instruction runs
+# and the cycles it takes. The counts are mapped back to the source lines and
+# labels, and written as a hot spot report, an annotated listing and a JSON
+# profile (that asm2d --profile reads to place the variables with -z).
+#
+# A key script has one line per change of the keys: the frame where it
+# happens, followed by the keys that are pressed from then on (none to release
+# them all). Comments start with ';'. For example:
+#
+#     0   KEY_1
+#     30  KEY_1 KEY_9
+#     60
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import re
+import sys
+from asmconstants import CYCLES, SIZE
+from asmgrammar import Inst
+from asmerrors import ErrorReport
+from assembler import Assembler, read_file
+from sim import DECODER, SYNC, Machine, SimulationError
+
+# Instructions that run before giving up, if the program never ends a frame
+INSTRUCTION_LIMIT = 100 * 1000 * 1000
+
+class ProfiledMachine(Machine):
+    """A machine that counts the runs and cycles of the instruction at each
+    address, and the calls and cycles of each subroutine (including the ones
+    it calls).
+    """
+
+    def __init__(self, image, **kwargs):
+        Machine.__init__(self, image, **kwargs)
+        self.counts = [0] * len(self.mem)
+        self.costs = [0] * len(self.mem)
+        self.elapsed = 0
+        # Subroutine calls in progress: (address, elapsed cycles on entry)
+        self.calls = [(self.pc, 0)]
+        self.call_counts = {}
+        self.call_cycles = {}
+
+    def decode(self, pc):
+        "Decode the instruction at an address, wrapping its handler to count its runs."
+        handler, operand, next_pc, cost = Machine.decode(self, pc)
+        name = DECODER[self.mem[pc]][0]
+        if name in SYNC:
+            operand = (self.count_skipped(operand[0], pc, next_pc), operand[1])
+
+        def op_counted(m, op, ret):
+            m.counts[pc] += 1
+            m.costs[pc] += cost
+            m.elapsed += cost
+            if name == 'JSR':
+                m.call_counts[op] = m.call_counts.get(op, 0) + 1
+                m.calls.append((op, m.elapsed))
+            elif name == 'RTS' and len(m.calls) > 1:
+                m.close_call(m.calls.pop())
+            return handler(m, op, ret)
+
+        entry = self.decoded[pc] = (op_counted, operand, next_pc, cost)
+        return entry
+
+    def count_skipped(self, handler, pc, next_pc):
+        """Wrap a handler that uses the game clock, to count the iterations of
+        a wait loop (CPK and BNE) that it skips.
+        """
+        def op_sync_counted(m, op, ret):
+            instructions, cycles = m.instructions, m.cycles
+            ret = handler(m, op, ret)
+            skipped = (m.instructions - instructions) // 2
+            if skipped > 0:
+                m.counts[pc] += skipped
+                m.counts[next_pc] += skipped
+                m.costs[pc] += skipped * CYCLES['CPK']['imm']
+                m.costs[next_pc] += m.cycles - cycles - skipped * CYCLES['CPK']['imm']
+                m.elapsed += m.cycles - cycles
+            return ret
+        return op_sync_counted
+
+    def close_call(self, call):
+        "Add the cycles of a call (unless it's a recursive one) to its routine."
+        addr, start = call
+        if all(addr != other for other, _ in self.calls):
+            self.call_cycles[addr] = self.call_cycles.get(addr, 0) + self.elapsed - start
+
+    def inclusive_cycles(self):
+        """The cycles of each subroutine, including the routines it calls and
+        the calls that are still in progress.
+        """
+        result = dict(self.call_cycles)
+        seen = set()
+        for addr, start in self.calls:
+            if addr not in seen:
+                seen.add(addr)
+                result[addr] = result.get(addr, 0) + self.elapsed - start
+        return result
+
+
+class Profile:
+    """The execution counts of a program, mapped to its source: the runs and
+    cycles of each line, and the cycles of each label (from the label to the
+    next one, and including the subroutines it calls).
+    """
+
+    def __init__(self, machine, ast):
+        self.frames = machine.frames
+        self.cycles = machine.elapsed
+        self.instructions = sum(machine.counts)
+        self.insts = [elem for elem in ast if isinstance(elem, Inst)]
+
+        self.lines = {}
+        self.line_cycles = {}
+        self.addresses = {}
+        for elem in self.insts:
+            count = machine.counts[elem.addr]
+            if count > 0:
+                self.lines[elem.lineno] = self.lines.get(elem.lineno, 0) + count
+                self.line_cycles[elem.lineno] = self.line_cycles.get(elem.lineno, 0) + machine.costs[elem.addr]
+                self.addresses[elem.addr] = count
+
+        self.labels = []
+        self.self_cycles = {}
+        self.calls = {}
+        self.inclusive = {}
+        inclusive = machine.inclusive_cycles()
+        label = None
+        for elem in self.insts:
+            if elem.label != '':
+                label = elem.label
+                self.labels.append(label)
+                self.self_cycles[label] = 0
+                self.calls[label] = machine.call_counts.get(elem.addr, 0)
+                self.inclusive[label] = inclusive.get(elem.addr)
+            if label is not None:
+                self.self_cycles[label] += machine.costs[elem.addr]
+
+    def label_line(self, label):
+        return next(elem.lineno for elem in self.insts if elem.label == label)
+
+    def hot_spots(self, top=None):
+        "The lines that took most cycles, with their runs and cycles."
+        lines = sorted(self.line_cycles, key=lambda lineno: (-self.line_cycles[lineno], lineno))
+        return [(lineno, self.lines[lineno], self.line_cycles[lineno]) for lineno in lines[:top]]
+
+    def to_json(self):
+        "The profile as a JSON object (the line numbers are the keys of 'lines')."
+        return {
+                'frames': self.frames,
+                'cycles': self.cycles,
+                'instructions': self.instructions,
+                'lines': dict((str(lineno), count) for lineno, count in self.lines.items()),
+                'addresses': dict((str(addr), count) for addr, count in self.addresses.items()),
+                'labels': dict((label, {
+                    'cycles': self.self_cycles[label],
+                    'calls': self.calls[label],
+                    'inclusive': self.inclusive[label]}) for label in self.labels)
+                }
+
+
+def percent(value, total):
+    return 100.0 * value / total if total > 0 else 0.0
+
+def report(profile, source, outfile=sys.stdout, top=20):
+    "Print the totals, the labels that took cycles and the hottest lines."
+    source_lines = source.splitlines()
+    print("{0:d} frames, {1:d} instructions, {2:d} cycles ({3:.0f} per frame)".format(profile.frames,
+        profile.instructions, profile.cycles, profile.cycles / float(max(profile.frames, 1))), file=outfile)
+
+    print(file=outfile)
+    row = "{0:<24} {1:>6} {2:>8} {3:>12} {4:>6} {5:>12} {6:>6}"
+    print(row.format('label', 'line', 'calls', 'cycles', '%', 'inclusive', '%'), file=outfile)
+    labels = [label for label in profile.labels if profile.self_cycles[label] > 0 or profile.inclusive[label]]
+    for label in sorted(labels, key=lambda label: -profile.self_cycles[label]):
+        inclusive = profile.inclusive[label]
+        print(row.format(label, profile.label_line(label), profile.calls[label] or '',
+            profile.self_cycles[label], '{0:.1f}'.format(percent(profile.self_cycles[label], profile.cycles)),
+            '' if inclusive is None else inclusive,
+            '' if inclusive is None else '{0:.1f}'.format(percent(inclusive, profile.cycles))), file=outfile)
+
+    print(file=outfile)
+    row = "{0:>6} {1:>10} {2:>12} {3:>6}  {4}"
+    print(row.format('line', 'runs', 'cycles', '%', 'source'), file=outfile)
+    for lineno, count, cycles in profile.hot_spots(top):
+        print(row.format(lineno, count, cycles, '{0:.1f}'.format(percent(cycles, profile.cycles)),
+            source_lines[lineno - 1].strip()), file=outfile)
+
+def annotate(profile, source, outfile=sys.stdout):
+    "Print the source code, with the runs and cycles of each line."
+    for lineno, line in enumerate(source.splitlines(), 1):
+        if lineno in profile.lines:
+            print("{0:>10} {1:>12} | {2}".format(profile.lines[lineno], profile.line_cycles[lineno], line),
+                    file=outfile)
+        else:
+            print("{0:>10} {1:>12} | {2}".format('', '', line), file=outfile)
+
+
+def read_key_script(text):
+    """Read a key script: a list of (frame, keys) tuples, sorted by frame.
+    Raises ValueError if a line isn't valid.
+    """
+    script = []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        fields = line.split(';')[0].split()
+        if not fields:
+            continue
+        keys = set()
+        for field in fields[1:]:
+            match = re.match(r'(?:key|KEY)_(1[0-5]|[0-9])$', field)
+            if match is None:
+                raise ValueError("Invalid key '{0}' in line {1:d}".format(field, lineno))
+            keys.add(int(match.group(1)))
+        if not fields[0].isdigit():
+            raise ValueError("Invalid frame '{0}' in line {1:d}".format(fields[0], lineno))
+        script.append((int(fields[0]), keys))
+    return sorted(script, key=lambda event: event[0])
+
+def run_profile(result, frames, script=(), seed=0, instructions=INSTRUCTION_LIMIT):
+    """Run an assembled program (an assembler.Result) for a number of frames,
+    pressing the keys of a script, and return its profile.
+    """
+    machine = ProfiledMachine(result.image, code_size=result.inst_table[SIZE], seed=seed)
+    events = list(script)
+    while machine.frames < frames and not machine.halted and machine.instructions < instructions:
+        while events and events[0][0] <= machine.frames:
+            machine.keys = set(events.pop(0)[1])
+        if machine.run(frames=1, instructions=instructions - machine.instructions) == 0:
+            break
+    return Profile(machine, result.ast)
+
+
+def main():
+    "Parse the command line arguments, and profile the program."
+    parser = argparse.ArgumentParser(
+            description='Profiler for the 68112D: runs a program in the simulator and reports the hot spots.')
+    parser.add_argument('file', help='the source file')
+    parser.add_argument('-n', '--frames', type=int, default=600,
+            help='the number of frames to run (600 by default)')
+    parser.add_argument('-k', '--keys',
+            help='a key script: lines with a frame and the keys pressed from then on')
+    parser.add_argument('--seed', type=int, default=0,
+            help='the seed of the random numbers (RNDA)')
+    parser.add_argument('--top', type=int, default=20,
+            help='the number of lines in the hot spot report')
+    parser.add_argument('-o', '--output-file',
+            help='the JSON profile (by default, the source file name with .prof.json)')
+    parser.add_argument('-a', '--annotate',
+            help='write the source code with the runs and cycles of each line to this file')
+    args = parser.parse_args()
+
+    source = read_file(args.file)
+    script = []
+    if args.keys is not None:
+        try:
+            script = read_key_script(read_file(args.keys))
+        except ValueError as e:
+            print("Error reading key script '{0}': {1}.".format(args.keys, e), file=sys.stderr)
+            sys.exit(1)
+
+    result = Assembler().assemble(source, errors=ErrorReport())
+    try:
+        profile = run_profile(result, args.frames, script, seed=args.seed)
+    except SimulationError as e:
+        print("Simulation error: {0}.".format(e), file=sys.stderr)
+        sys.exit(1)
+
+    report(profile, source, top=args.top)
+    output_file = args.output_file
+    if output_file is None:
+        output_file = os.path.splitext(args.file)[0] + '.prof.json'
+    with open(output_file, 'w') as f:
+        json.dump(profile.to_json(), f, indent=2, separators=(',', ': '), sort_keys=True)
+    if args.annotate is not None:
+        with open(args.annotate, 'w') as f:
+            annotate(profile, source, f)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,112 +1,318 @@
 # Semantic analysis of an AST (parsed 68hc11 assembly code).
 
 from __future__ import print_function
-from asmconstants import SIZE, INST_ONE_BYTE, INST_UNSIGNED
+from asmconstants import (ABS, BRANCH_MODES, DIR, EXT, FAR, IMM, IMM_FAR, IMM_REL, IND, INST_ONE_BYTE,
+        INST_UNSIGNED, LONG_BRANCH_SIZES, OP_CODES, REL, SIZE, VAR)
 from asmerrors import error, warn
 from asmgrammar import Inst, Var
 
 MAIN = '.main'
 MAIN_ADDR = 0
+# Addresses below this one can be used in direct mode (one byte)
+DIRECT_PAGE = 256
 
-def analyse(ast, const_table, data_table, inst_table, errors):
-    "Semantic analysis for the AST."
+def analyse(ast, const_table, data_table, inst_table, errors, direct=False, externals=None):
+    """Semantic analysis for the AST. With direct set, instructions use direct
+    addressing for the variables that end up in the first 256 bytes. If a set
+    of externals is given, the program is a module of a bigger one (see
+    asmobject): the labels and variables it doesn't define are added to the
+    set, instead of being errors.
+    """
 
-    if MAIN not in inst_table:
-        error("Main entry point not defined", errors=errors)
+    if MAIN not in inst_table and externals is None:
+        error("Main entry point not defined", code='main-undefined', errors=errors)
 
-    first_pass(ast, const_table, data_table, inst_table, errors)
+    resolve_constants(ast, const_table, errors)
+    first_pass(ast, const_table, data_table, inst_table, errors, externals=externals)
+    relaxed = allocate(ast, data_table, inst_table, direct=direct)
     second_pass(ast, data_table, inst_table, errors)
 
+    for elem in [elem for elem in ast if isinstance(elem, Inst) and elem.mode in {FAR, IMM_FAR}]:
+        warn("Branch to {0} out of range, replaced with a jump", branch_target(elem), lineno=elem.lineno,
+                code='branch-relaxed', errors=errors)
+    if relaxed > 0:
+        warn("Branch relaxation added {0:d} byte{1}", relaxed, 's' if relaxed > 1 else '',
+                code='branch-relaxed', errors=errors)
+
     errors.report_errors()
 
-def first_pass(ast, const_table, data_table, inst_table, errors):
+def resolve_constants(ast, const_table, errors):
+    """Evaluate the constants, and the immediate values that are expressions.
+    Constants can reference constants defined after them: each one is
+    evaluated once, after the constants it depends on (walking the dependency
+    graph with a stack, so long chains don't hit the recursion limit), and its
+    value is kept for the other references. Circular definitions are errors.
+    The constants and values that can't be evaluated are left as None.
+    """
+    failed = set()
+    for name in sorted(const_table, key=lambda name: const_table[name].lineno):
+        path, on_path = [name], {name}
+        while path:
+            const = const_table[path[-1]]
+            if const.value is not None or const.id in failed:
+                on_path.discard(path.pop())
+                continue
+            refs = [ref for ref in const_refs(const.expr) if ref in const_table]
+            for ref in refs:
+                const_table[ref].used = True
+            pending = [ref for ref in refs if const_table[ref].value is None and ref not in failed]
+            cycle = [ref for ref in pending if ref in on_path]
+            if cycle:
+                loop = path[path.index(cycle[0]):]
+                error("Circular definition of constant {0}: {1}", cycle[0], ' -> '.join(loop + [cycle[0]]),
+                        lineno=const.lineno, code='constant-cycle', errors=errors)
+                failed.update(loop)
+            elif pending:
+                path.append(pending[0])
+                on_path.add(pending[0])
+            else:
+                const.value = eval_expr(const.expr, const_table, const.lineno, errors)
+                if const.value is None:
+                    failed.add(const.id)
+
+    for elem in ast:
+        if isinstance(elem, Inst) and elem.mode == IMM and isinstance(elem.value, tuple):
+            elem.value = eval_expr(elem.value, const_table, elem.lineno, errors)
+
+def const_refs(expr):
+    "The names of the constants an expression references."
+    if expr[0] == 'const':
+        return [expr[1]]
+    elif expr[0] == 'num':
+        return []
+    return const_refs(expr[1]) + const_refs(expr[2])
+
+def eval_expr(expr, const_table, lineno, errors):
+    """The value of an expression whose constants are evaluated, or None if it
+    references a constant that is undefined (which is reported) or that
+    couldn't be evaluated.
+    """
+    expr_type = expr[0]
+    if expr_type == 'num':
+        return expr[1]
+    elif expr_type == 'const':
+        name = expr[1]
+        if name not in const_table:
+            error("Undefined constant {0}", name, lineno=lineno, code='undefined-constant', errors=errors)
+            return None
+        const_table[name].used = True
+        return const_table[name].value
+
+    left = eval_expr(expr[1], const_table, lineno, errors)
+    right = eval_expr(expr[2], const_table, lineno, errors)
+    if left is None or right is None:
+        return None
+    elif expr_type == '+':
+        return left + right
+    elif expr_type == '-':
+        return left - right
+    elif expr_type == '*':
+        return left * right
+    elif right == 0:
+        error("Division by zero", lineno=lineno, code='division-by-zero', errors=errors)
+        return None
+    return left // right
+
+def first_pass(ast, const_table, data_table, inst_table, errors, externals=None):
     """The first pass assigns an address to variables (data segment) and
     labels, and checks for undefined references. It also warns about constants,
     variables and labels that are not used, and about mismatches between
-    variable size and instruction size.
+    variable size and instruction size. If a set of externals is given, the
+    undefined references are added to it, and the labels and variables aren't
+    reported as unused (other modules can use them).
     """
-    data_offset = inst_table[SIZE]
-    code_offset = 0
+    layout(ast, data_table, inst_table)
     main_lineno = 0
 
     for elem in ast:
-        if isinstance(elem, Var):
-            data_table[elem.id].addr = data_offset
-            data_offset += elem.size
         if isinstance(elem, Inst):
-            if elem.label != '':
-                if elem.label == MAIN: main_lineno = elem.lineno
-                inst_table[elem.label].addr = code_offset
-            code_offset += elem.size
+            if elem.label == MAIN: main_lineno = elem.lineno
 
-            if len(elem.inst) == 3:
-                _, _, label = elem.inst
-                if label not in inst_table:
-                    error("Undefined label {}", label, lineno=elem.lineno, errors=errors)
+            if elem.mode in {REL, ABS, IMM_REL}:
+                label = elem.target
+                if label not in inst_table and externals is not None:
+                    externals.add(label)
+                elif label not in inst_table:
+                    error("Undefined label {}", label, lineno=elem.lineno, code='undefined-label', errors=errors)
                 else:
                     inst_table[label].used = True
-            elif len(elem.inst) == 4:
-                name, size, inst_type, value = elem.inst
-                if inst_type == 'var':
-                    if value not in data_table:
-                        error("Undefined variable {}", value, lineno=elem.lineno, errors=errors)
-                    else:
-                        data_table[value].used = True
-                        elem.inst = (name, size, 'ext', data_table[value].addr)
-
-                        var_size = data_table[value].size
-                        inst_size = 1 if name in INST_ONE_BYTE else 2
-                        if inst_size != var_size:
-                            warn("Size mismatch: instruction {0} expects {1:d} byte{2}, variable {3} has {4:d} byte{5}",
-                                    name, inst_size, 's' if inst_size > 1 else '', value, var_size,
-                                    's' if var_size > 1 else '', lineno=elem.lineno)
-            elif len(elem.inst) == 5:
-                _, _, inst_type, _, label = elem.inst
-                if inst_type == 'imm-rel':
-                    if label not in inst_table:
-                        error("Undefined label {}", label, lineno=elem.lineno, errors=errors)
-                    else:
-                        inst_table[label].used = True
+            elif elem.mode == VAR:
+                name, value = elem.name, elem.target
+                if value not in data_table and externals is not None:
+                    externals.add(value)
+                    elem.mode = EXT
+                elif value not in data_table:
+                    error("Undefined variable {}", value, lineno=elem.lineno,
+                            code='undefined-variable', errors=errors)
+                else:
+                    data_table[value].used = True
+                    elem.mode = EXT
+
+                    var_size = data_table[value].size
+                    inst_size = 1 if name in INST_ONE_BYTE else 2
+                    if inst_size != var_size:
+                        warn("Size mismatch: instruction {0} expects {1:d} byte{2}, variable {3} has {4:d} byte{5}",
+                                name, inst_size, 's' if inst_size > 1 else '', value, var_size,
+                                's' if var_size > 1 else '', lineno=elem.lineno,
+                                code='size-mismatch', errors=errors)
 
     # Warnings for unused constants, variables and labels
     for const in [k for k in const_table if const_table[k].used == False]:
-        warn("Unused constant {}", const, lineno=const_table[const].lineno)
+        warn("Unused constant {}", const, lineno=const_table[const].lineno, code='unused-constant', errors=errors)
 
-    for var in [k for k in data_table if k != SIZE and data_table[k].used == False]:
-        warn("Unused variable {}", var, lineno=data_table[var].lineno)
+    if externals is None:
+        for var in [k for k in data_table if k != SIZE and data_table[k].used == False]:
+            warn("Unused variable {}", var, lineno=data_table[var].lineno, code='unused-variable', errors=errors)
 
-    for label in [k for k in inst_table if k != SIZE and inst_table[k].used == False]:
-        warn("Unused label {}", label, lineno=inst_table[label].lineno)
+        for label in [k for k in inst_table if k != SIZE and inst_table[k].used == False]:
+            warn("Unused label {}", label, lineno=inst_table[label].lineno, code='unused-label', errors=errors)
 
     if MAIN in inst_table and inst_table[MAIN].addr != MAIN_ADDR:
-        error("Main label should be the first instruction",lineno=main_lineno, errors=errors)
+        error("Main label should be the first instruction",lineno=main_lineno, code='main-not-first', errors=errors)
+
+def allocate(ast, data_table, inst_table, direct=False):
+    """Choose the size of branches and the addressing mode of the instructions
+    that reference variables, and assign the final addresses.
+
+    Branches that are out of range are first replaced with jumps, which makes
+    the code grow, until all of them are in range. Then the code shrinks:
+    variables in the first 256 bytes are accessed in direct mode (if direct is
+    set) and replaced branches that are now in range become short again.
+    Shrinking never moves a branch away from its target or a variable up, so
+    both steps reach a fixed point. Returns the bytes added by the long
+    branches.
+    """
+    for elem in ast:
+        if isinstance(elem, Inst):
+            if elem.mode == DIR:
+                elem.mode = EXT
+                elem.size += 1
+            elif elem.mode in {FAR, IMM_FAR}:
+                shorten_branch(elem)
+
+    layout(ast, data_table, inst_table)
+    while relax_branches(ast, inst_table):
+        layout(ast, data_table, inst_table)
+
+    while True:
+        changed = direct and select_direct(ast, data_table)
+        changed = shorten_branches(ast, inst_table) or changed
+        if not changed: break
+        layout(ast, data_table, inst_table)
+
+    return sum(elem.size - short_branch_size(elem) for elem in ast
+            if isinstance(elem, Inst) and elem.mode in {FAR, IMM_FAR})
+
+def layout(ast, data_table, inst_table):
+    """Assign an address to every instruction and variable. The code starts at
+    the main address, and it's followed by the data segment. Variables in the
+    zero page are placed in the code segment, where they appear in the AST.
+    """
+    code_offset = MAIN_ADDR
+    code_size = 0
+    for elem in ast:
+        if isinstance(elem, Inst):
+            elem.addr = code_offset
+            code_offset += elem.size
+            code_size += elem.size
+        elif isinstance(elem, Var) and elem.zero_page:
+            elem.addr = code_offset
+            code_offset += elem.size
+    inst_table[SIZE] = code_size
+
+    data_offset = code_offset
+    for elem in ast:
+        if isinstance(elem, Var) and not elem.zero_page:
+            elem.addr = data_offset
+            data_offset += elem.size
+
+def branch_target(elem):
+    """The label a branch instruction (short or long) jumps to, or None if the
+    instruction isn't a branch.
+    """
+    return elem.target if elem.mode in BRANCH_MODES else None
+
+def short_branch_size(elem):
+    "The size of the short (relative) form of a branch."
+    return 3 if elem.name == 'BKE' else 2
+
+def branch_offset(elem, inst_table):
+    """The relative offset the short form of a branch would need to reach its
+    target, with the current addresses.
+    """
+    target = inst_table[branch_target(elem)].addr
+    short_size = short_branch_size(elem)
+    if target > elem.addr:
+        target -= elem.size - short_size
+    return target - (elem.addr + short_size)
+
+def relax_branches(ast, inst_table):
+    """Replace the short branches whose target is out of range with long ones.
+    Returns True if any branch changed.
+    """
+    changed = False
+    for elem in ast:
+        if isinstance(elem, Inst) and branch_target(elem) in inst_table and elem.size == short_branch_size(elem):
+            offset = branch_offset(elem, inst_table)
+            if offset < -128 or offset > 127:
+                elem.mode = IMM_FAR if elem.mode == IMM_REL else FAR
+                elem.size = LONG_BRANCH_SIZES.get(elem.name, LONG_BRANCH_SIZES[None])
+                changed = True
+    return changed
+
+def shorten_branches(ast, inst_table):
+    """Replace the long branches whose target is in range with short ones.
+    Returns True if any branch changed.
+    """
+    changed = False
+    for elem in ast:
+        if isinstance(elem, Inst) and elem.mode in {FAR, IMM_FAR}:
+            offset = branch_offset(elem, inst_table)
+            if offset >= -128 and offset <= 127:
+                shorten_branch(elem)
+                changed = True
+    return changed
+
+def shorten_branch(elem):
+    "Turn a long branch back into a short one."
+    elem.mode = IMM_REL if elem.mode == IMM_FAR else REL
+    elem.size = short_branch_size(elem)
+
+def select_direct(ast, data_table):
+    """Switch the extended instructions that reference a variable in the first
+    256 bytes to direct mode. Returns True if any instruction changed.
+    """
+    changed = False
+    for elem in ast:
+        if isinstance(elem, Inst) and elem.mode == EXT and DIR in OP_CODES[elem.name] and \
+                data_table[elem.target].addr < DIRECT_PAGE:
+            elem.mode = DIR
+            elem.size -= 1
+            changed = True
+    return changed
 
 def second_pass(ast, data_table, inst_table, errors):
     """The second pass handles unsigned values (color registers, fps) and checks
     that immediate values are of the correct size (one or two bytes).
     """
     for elem in ast:
-        if isinstance(elem, Inst):
-            if len(elem.inst) == 4:
-                name, size, inst_type, value = elem.inst
-                if name in INST_UNSIGNED:
-                    if value < 0 or value > 255:
+        # Values that couldn't be evaluated are None, and were already reported
+        if isinstance(elem, Inst) and elem.value is not None:
+            name, size, value = elem.name, elem.size, elem.value
+            if elem.mode == IMM and name in INST_UNSIGNED:
+                if value < 0 or value > 255:
+                    error("Value out of range {0} (instruction {1})",
+                            value, name, lineno=elem.lineno, code='value-range', errors=errors)
+            elif elem.mode == IMM and name != 'DRSYM':
+                if size == 2:
+                    if value < -128 or value > 127:
                         error("Value out of range {0} (instruction {1})",
-                                value, name, lineno=elem.lineno, errors=errors)
-                    else:
-                        elem.inst = (name, size, inst_type, value)
-                elif inst_type == 'imm' and name != 'DRSYM':
-                    if size == 2:
-                        if value < -128 or value > 127:
-                            error("Value out of range {0} (instruction {1})",
-                                    value, name, lineno=elem.lineno, errors=errors)
-                    elif size == 3:
-                        if value < -32768 or value > 32767:
-                            error("Value out of range {0} (instruction {1})",
-                                    value, name, lineno=elem.lineno, errors=errors)
-            elif len(elem.inst) == 5:
-                name, _, inst_type, offset, _ = elem.inst
-                if inst_type == 'ind':
-                    if offset < -128 or offset > 127:
+                                value, name, lineno=elem.lineno, code='value-range', errors=errors)
+                elif size == 3:
+                    if value < -32768 or value > 32767:
                         error("Value out of range {0} (instruction {1})",
-                                offset, name, lineno=elem.lineno, errors=errors)
+                                value, name, lineno=elem.lineno, code='value-range', errors=errors)
+            elif elem.mode == IND:
+                if value < -128 or value > 127:
+                    error("Value out of range {0} (instruction {1})",
+                            value, name, lineno=elem.lineno, code='value-range', errors=errors)
@@ -0,0 +1,150 @@
+# Stack analysis: the maximum stack depth of every routine (including the
+# routines it calls) and of the whole program, and the paths that leave the
+# stack unbalanced.
+#
+# A routine can pull more than it pushes (to read arguments pushed by the
+# caller, under its return address), as long as it does it on every path: its
+# net effect is the stack depth when it returns, relative to its entry.
+
+from __future__ import print_function
+import sys
+from asmconstants import SIZE
+from asmerrors import warn
+from asmflow import successors
+from asmgrammar import Inst
+from asmsemantic import MAIN
+
+UNBOUNDED = float('inf')
+# Bytes of the return address pushed by JSR
+RETURN_ADDRESS = 2
+
+# Bytes pushed (or pulled, if negative) by the stack instructions
+STACK_EFFECTS = {
+        'PSHA': 1, 'PSHB': 1, 'PSHCB': 1, 'PSHCG': 1, 'PSHCR': 1,
+        'PSHX': 2, 'PSHXA': 2, 'PSHXB': 2, 'PSHYA': 2, 'PSHYB': 2,
+        'PULA': -1, 'PULB': -1, 'PULCB': -1, 'PULCG': -1, 'PULCR': -1,
+        'PULX': -2, 'PULXA': -2, 'PULXB': -2, 'PULYA': -2, 'PULYB': -2
+        }
+
+class RoutineStack:
+    """The stack usage of a routine: the maximum and minimum depths (relative
+    to its entry, including the routines it calls; the minimum is negative if
+    it pulls its return address) and the net effect (None if it never
+    returns).
+    """
+
+    def __init__(self, label, max_depth=0, net=None, min_depth=0):
+        self.label = label
+        self.max_depth = max_depth
+        self.min_depth = min_depth
+        self.net = net
+
+
+class StackAnalysis:
+    "Stack analysis of a program."
+
+    def __init__(self, ast, inst_table, errors=None):
+        self.insts = [elem for elem in ast if isinstance(elem, Inst)]
+        self.index = dict((elem.label, i) for i, elem in enumerate(self.insts) if elem.label != '')
+        self.inst_table = inst_table
+        self.errors = errors
+        self.routines = {}
+        self.recursive = set()
+        self.unbalanced = set()
+
+    def routine(self, label):
+        "The stack usage of a routine, computed once."
+        if label in self.routines:
+            if self.routines[label] is None:
+                self.recursive.add(label)
+                return RoutineStack(label, UNBOUNDED, 0)
+            return self.routines[label]
+        self.routines[label] = None
+        self.routines[label] = self.walk(label)
+        return self.routines[label]
+
+    def walk(self, label):
+        """Follow all the paths of a routine, keeping the depth of the stack at
+        each instruction.
+        """
+        insts = self.insts
+        result = RoutineStack(label)
+        depths = {self.index[label]: 0}
+        pending = [self.index[label]]
+        while pending:
+            i = pending.pop()
+            elem, depth = insts[i], depths[i]
+            name = elem.name
+            if name in STACK_EFFECTS:
+                depth += STACK_EFFECTS[name]
+                result.max_depth = max(result.max_depth, depth)
+                result.min_depth = min(result.min_depth, depth)
+            elif name == 'JSR':
+                callee = self.routine(elem.target)
+                result.max_depth = max(result.max_depth, depth + RETURN_ADDRESS + callee.max_depth)
+                result.min_depth = min(result.min_depth, depth + RETURN_ADDRESS + callee.min_depth)
+                if callee.net is None:
+                    continue
+                depth += callee.net
+            elif name == 'RTS':
+                if result.net is not None and result.net != depth:
+                    self.report_unbalanced(elem, "Routine {0} returns with different stack depths ({1:+d} and {2:+d})",
+                            label, result.net, depth)
+                result.net = depth if result.net is None else min(result.net, depth)
+                continue
+
+            for j in successors(insts, i, self.index, calls=False):
+                if j not in depths:
+                    depths[j] = depth
+                    pending.append(j)
+                elif depths[j] != depth:
+                    self.report_unbalanced(insts[j], "Unbalanced stack: reached with depths {0:+d} and {1:+d}",
+                            depths[j], depth)
+                    if depth > depths[j]:
+                        # The stack grows on every iteration of a loop
+                        result.max_depth = UNBOUNDED
+        return result
+
+    def report_unbalanced(self, elem, msg, *args):
+        if elem.lineno not in self.unbalanced:
+            self.unbalanced.add(elem.lineno)
+            warn(msg, *args, lineno=elem.lineno, code='unbalanced-stack', errors=self.errors)
+
+    def total(self):
+        "The maximum stack depth of the program (from the main label)."
+        if MAIN not in self.index:
+            return 0
+        return self.routine(MAIN).max_depth
+
+    def check(self):
+        "Warn about the recursive routines."
+        self.total()
+        for label in sorted(self.recursive):
+            warn("Recursive routine {0}, the stack depth is unbounded", label,
+                    lineno=self.insts[self.index[label]].lineno, code='recursion', errors=self.errors)
+
+
+def format_bytes(value):
+    "Format a number of bytes, or 'unbounded'."
+    return 'unbounded' if value == UNBOUNDED else '{0:d}'.format(value)
+
+def report(analysis, data_table, outfile=sys.stderr):
+    """Print the stack usage of every routine, the RAM to reserve for the stack
+    and the memory size it needs.
+    """
+    total = analysis.total()
+    row = "{0:<24} {1:>6} {2:>10} {3:>6}"
+    print(row.format('routine', 'line', 'max depth', 'net'), file=outfile)
+    for label in sorted(analysis.routines, key=lambda label: analysis.index[label]):
+        routine = analysis.routines[label]
+        net = '-' if routine.net is None else '{0:+d}'.format(routine.net)
+        print(row.format(label, analysis.insts[analysis.index[label]].lineno, format_bytes(routine.max_depth),
+            net), file=outfile)
+
+    print(file=outfile)
+    if total == UNBOUNDED:
+        print("Stack: unbounded", file=outfile)
+    else:
+        print("Stack: {0:d} bytes".format(total), file=outfile)
+        words = analysis.inst_table[SIZE] + data_table[SIZE] + total
+        print("Memory: {0:d} words (-w {0:d})".format(words), file=outfile)
@@ -0,0 +1,391 @@
+# Static timing analysis: the best and worst case cycles of every routine and
+# basic block, and of every frame (the code that runs between two RSTK, not
+# counting the loops that wait for the game clock).
+#
+# Loops need a bound, given with a comment on the line of the branch back to
+# the start of the loop (or on the first line of the loop):
+#
+#     LOOP        SUBD    1
+#                 BNE     LOOP        ; LOOP 20
+#
+# means that the branch is taken at most 20 times. Without a bound, the worst
+# case is unbounded.
+
+from __future__ import print_function
+import re
+import sys
+from asmconstants import ABS, CYCLES, FAR, IMM_FAR, IMM_REL, INH, REL
+from asmerrors import error, warn
+from asmgrammar import Inst
+from asmsemantic import MAIN, branch_target
+
+UNBOUNDED = float('inf')
+LOOP_PRAGMA = re.compile(r';\s*LOOP\s+(\d+)', re.IGNORECASE)
+
+# Instructions that end a basic block (besides the branches)
+BLOCK_END = {'JMP', 'JSR', 'RSTK', 'RTS'}
+
+def inst_cycles(elem, taken=True):
+    """The cycles taken by an instruction. The long forms of the branches take
+    a different number of cycles when the branch is taken or not.
+    """
+    name, mode = elem.name, elem.mode
+    if mode in {INH, REL, ABS, IMM_REL}:
+        return CYCLES[name]
+    elif mode == FAR:
+        if name == 'BRA':
+            return CYCLES['JMP']
+        return CYCLES[name] + CYCLES['JMP'] if taken else CYCLES[name]
+    elif mode == IMM_FAR:
+        return CYCLES[name] + (CYCLES['JMP'] if taken else CYCLES['BRA'])
+    return CYCLES[name][mode]
+
+def loop_bounds(source):
+    "Find the loop bounds in the comments of the source code, by line number."
+    bounds = {}
+    for lineno, line in enumerate(source.splitlines(), 1):
+        match = LOOP_PRAGMA.search(line)
+        if match:
+            bounds[lineno] = int(match.group(1))
+    return bounds
+
+def is_wait(insts, i):
+    "Whether the instruction at index i starts a loop that waits for the clock."
+    return insts[i].name == 'CPK' and i + 1 < len(insts) and insts[i].label != '' and \
+            insts[i + 1].name == 'BNE' and branch_target(insts[i + 1]) == insts[i].label
+
+
+class Block:
+    """A basic block: a sequence of instructions that run one after the other.
+    The kind is 'wait' (a loop that waits for the clock), 'rstk', 'call',
+    'return' or 'flow'.
+    """
+
+    def __init__(self, insts):
+        self.insts = insts
+        self.succs = []
+        self.call = None
+        last = insts[-1]
+        self.best = sum(inst_cycles(elem, taken=False) for elem in insts)
+        self.worst = sum(inst_cycles(elem) for elem in insts)
+        if len(insts) == 2 and insts[0].name == 'CPK' and branch_target(last) == insts[0].label:
+            self.kind = 'wait'
+        elif last.name == 'RSTK':
+            self.kind = 'rstk'
+        elif last.name == 'JSR':
+            self.kind, self.call = 'call', last.target
+        elif last.name == 'RTS':
+            self.kind = 'return'
+        else:
+            self.kind = 'flow'
+
+    @property
+    def lineno(self):
+        return self.insts[0].lineno
+
+    @property
+    def name(self):
+        "The label of the block, or its line number."
+        return self.insts[0].label or "line {0:d}".format(self.lineno)
+
+
+class Costs:
+    """Best and worst case cycles of a region of code, from its start to a
+    return (RTS) and to the end of the frame (RSTK or a wait for the clock).
+    None if the region has no path to them.
+    """
+
+    def __init__(self):
+        self.to_return = None
+        self.to_frame = None
+
+
+def merge(costs, best, worst):
+    "Merge best and worst case cycles into a (best, worst) pair, or None."
+    if costs is None:
+        return (best, worst)
+    return (min(costs[0], best), max(costs[1], worst))
+
+
+class TimingAnalysis:
+    "Timing analysis of a program, after the addresses have been assigned."
+
+    def __init__(self, ast, bounds=None):
+        self.insts = [elem for elem in ast if isinstance(elem, Inst)]
+        self.bounds = bounds or {}
+        self.blocks = self.build_blocks()
+        self.routines = {}
+        self.tails = {}
+        self.regions = {}
+        self.unbounded = set()
+        self.recursive = set()
+
+    def build_blocks(self):
+        "Split the instructions in basic blocks, and link them."
+        insts = self.insts
+        leaders = set([0])
+        for i, elem in enumerate(insts):
+            if elem.label != '' or is_wait(insts, i):
+                leaders.add(i)
+            if branch_target(elem) is not None or elem.name in BLOCK_END:
+                leaders.add(i + 1)
+        leaders = sorted(leader for leader in leaders if leader < len(insts))
+
+        blocks = [Block(insts[start:end]) for start, end in zip(leaders, leaders[1:] + [len(insts)])]
+        self.block_at = dict((id(block.insts[0]), i) for i, block in enumerate(blocks))
+        self.label_block = dict((block.insts[0].label, i) for i, block in enumerate(blocks)
+                if block.insts[0].label != '')
+
+        for i, block in enumerate(blocks):
+            last = block.insts[-1]
+            target = branch_target(last)
+            if last.name == 'JMP':
+                target = last.target
+            if target in self.label_block:
+                block.succs.append(self.label_block[target])
+            if last.name not in {'BRA', 'JMP', 'RTS'} and i + 1 < len(blocks):
+                block.succs.append(i + 1)
+        return blocks
+
+    def routine(self, label):
+        "The costs of a routine (from its label), computed once."
+        if label not in self.routines:
+            if label not in self.label_block:
+                return Costs()
+            self.routines[label] = None
+            self.routines[label] = self.region(self.label_block[label])[0]
+        elif self.routines[label] is None:
+            # Recursion: there's no bound on the depth
+            self.recursive.add(label)
+            costs = Costs()
+            costs.to_return = (0, UNBOUNDED)
+            return costs
+        return self.routines[label]
+
+    def tail(self, label):
+        """The costs from the places where a new frame starts inside a routine
+        (and the routines it calls) to its return.
+        """
+        if label not in self.tails:
+            self.tails[label] = None
+            costs = None
+            for start, initial in self.region(self.label_block[label])[1]:
+                to_return = self.region(start, initial)[0].to_return
+                if to_return is not None:
+                    costs = merge(costs, *to_return)
+            self.tails[label] = costs
+        return self.tails[label]
+
+    def node_costs(self, i):
+        """The best and worst cycles of a block (including the routines it
+        calls), the frame exit costs (or None), and whether the execution
+        continues with the next blocks in the same frame.
+        """
+        block = self.blocks[i]
+        if block.kind == 'wait':
+            return (0, 0), (0, 0), False
+        if block.kind == 'rstk':
+            return (block.best, block.worst), (block.best, block.worst), False
+        if block.kind == 'call':
+            callee = self.routine(block.call)
+            to_frame = None
+            if callee.to_frame is not None:
+                to_frame = (block.best + callee.to_frame[0], block.worst + callee.to_frame[1])
+            if callee.to_return is None:
+                return (block.best, block.worst), to_frame, False
+            return (block.best + callee.to_return[0], block.worst + callee.to_return[1]), to_frame, True
+        return (block.best, block.worst), None, block.kind != 'return'
+
+    def region(self, start, initial=(0, 0)):
+        """The costs from a block to the returns and the frame ends reachable
+        from it, and the places where a new frame starts (a block and its
+        initial costs).
+        """
+        if (start, initial) not in self.regions:
+            self.regions[(start, initial)] = self.analyse_region(start, initial)
+        return self.regions[(start, initial)]
+
+    def analyse_region(self, start, initial):
+        # Blocks in the region, and the order in which they are finished
+        nodes, order, back_edges = {}, [], []
+        stack, state = [(start, iter(self.successors(start)))], {start: 1}
+        nodes[start] = self.node_costs(start)
+        while stack:
+            i, succs = stack[-1]
+            for j in succs:
+                if j not in state:
+                    state[j] = 1
+                    nodes[j] = self.node_costs(j)
+                    stack.append((j, iter(self.successors(j))))
+                    break
+                elif state[j] == 1:
+                    back_edges.append((i, j))
+            else:
+                state[i] = 2
+                order.append(i)
+                stack.pop()
+        order.reverse()
+
+        worst = dict((i, nodes[i][0][1]) for i in nodes)
+        for header, tails, body in self.loops(back_edges, nodes):
+            bound = self.loop_bound(header, tails)
+            if bound is None:
+                self.unbounded.add(self.blocks[header].lineno)
+                worst[header] = UNBOUNDED
+            else:
+                iteration = max(self.longest(header, tail, body, worst, back_edges) for tail in tails)
+                worst[header] += bound * iteration
+
+        # Longest and shortest paths over the blocks (without the back edges)
+        back = set(back_edges)
+        best_to, worst_to = {start: initial[0] + nodes[start][0][0]}, {start: initial[1] + worst[start]}
+        costs, starts = Costs(), []
+        for i in order:
+            if i not in best_to:
+                continue
+            block = self.blocks[i]
+            (best, _), to_frame, flows = nodes[i]
+            if to_frame is not None:
+                before_best, before_worst = best_to[i] - best, worst_to[i] - worst[i]
+                costs.to_frame = merge(costs.to_frame, before_best + to_frame[0], before_worst + to_frame[1])
+            if block.kind == 'return':
+                costs.to_return = merge(costs.to_return, best_to[i], worst_to[i])
+            if block.kind in {'wait', 'rstk'}:
+                starts.extend((j, (0, 0)) for j in self.frame_starts(i))
+            elif block.kind == 'call' and self.routine(block.call).to_frame is not None:
+                tail = self.tail(block.call)
+                starts.extend((j, tail) for j in block.succs if tail is not None)
+                starts.extend(self.region(self.label_block[block.call])[1])
+            if not flows:
+                continue
+            for j in self.successors(i):
+                if (i, j) in back:
+                    continue
+                best_to[j] = min(best_to.get(j, UNBOUNDED), best_to[i] + nodes[j][0][0])
+                worst_to[j] = max(worst_to.get(j, -1), worst_to[i] + worst[j])
+        return costs, starts
+
+    def frame_starts(self, i):
+        "The blocks where a new frame starts, after a wait or an RSTK."
+        block = self.blocks[i]
+        succs = [j for j in block.succs if j != i]
+        if block.kind == 'wait' and len(succs) == 1 and self.blocks[succs[0]].kind == 'rstk':
+            succs = self.blocks[succs[0]].succs
+        return succs
+
+    def successors(self, i):
+        "The blocks that can run after a block, in the same frame."
+        block = self.blocks[i]
+        if block.kind in {'wait', 'rstk', 'return'}:
+            return []
+        if block.kind == 'call' and self.routine(block.call).to_return is None:
+            return []
+        return block.succs
+
+    def loops(self, back_edges, nodes):
+        """The loops of a region, innermost first: the header, the blocks that
+        branch back to it and the blocks in the loop.
+        """
+        headers = {}
+        for tail, header in back_edges:
+            headers.setdefault(header, []).append(tail)
+        loops = []
+        for header, tails in headers.items():
+            body, pending = set([header]), list(tails)
+            while pending:
+                i = pending.pop()
+                if i not in body:
+                    body.add(i)
+                    pending.extend(j for j in nodes if i in self.blocks[j].succs)
+            loops.append((header, tails, body))
+        loops.sort(key=lambda loop: len(loop[2]))
+        return loops
+
+    def loop_bound(self, header, tails):
+        "The bound of a loop, from the comments on its first or last lines."
+        lines = [self.blocks[header].lineno] + [self.blocks[tail].insts[-1].lineno for tail in tails]
+        found = [self.bounds[lineno] for lineno in lines if lineno in self.bounds]
+        return max(found) if found else None
+
+    def longest(self, header, tail, body, worst, back_edges):
+        "The worst case cycles of an iteration of a loop (a path in its body)."
+        back = set(back_edges)
+        memo = {}
+        def longest_from(i):
+            if i == tail:
+                return worst[i]
+            if i not in memo:
+                memo[i] = -UNBOUNDED
+                paths = [longest_from(j) for j in self.successors(i) if j in body and (i, j) not in back]
+                memo[i] = worst[i] + max(paths) if paths else -UNBOUNDED
+            return memo[i]
+        return max(longest_from(header), 0)
+
+    def frames(self):
+        """The frames of the program, as a list of (block, costs) for each
+        place where a frame starts (the main label, and after each RSTK).
+        """
+        if MAIN not in self.label_block:
+            return []
+        result, seen = [], set()
+        pending = [(self.label_block[MAIN], (0, 0))]
+        while pending:
+            start, initial = pending.pop(0)
+            if (start, initial) in seen:
+                continue
+            seen.add((start, initial))
+            costs, starts = self.region(start, initial)
+            if costs.to_frame is not None:
+                result.append((self.blocks[start], costs.to_frame))
+            pending.extend(starts)
+        return result
+
+
+def format_cycles(value):
+    return 'unbounded' if value == UNBOUNDED else '{0:d}'.format(value)
+
+def report(analysis, outfile=sys.stderr):
+    "Print the cycles of every routine, basic block and frame."
+    row = "{0:<24} {1:>6} {2:>10} {3:>10}"
+    print(row.format('routine', 'line', 'best', 'worst') + "  (* ends a frame)", file=outfile)
+    labels = [MAIN] + sorted(set(block.call for block in analysis.blocks if block.kind == 'call'),
+            key=lambda label: analysis.blocks[analysis.label_block.get(label, 0)].lineno)
+    for label in labels:
+        if label not in analysis.label_block:
+            continue
+        routine = analysis.routine(label)
+        costs = routine.to_return or routine.to_frame
+        if costs is not None:
+            print(row.format(label, analysis.blocks[analysis.label_block[label]].lineno,
+                format_cycles(costs[0]), format_cycles(costs[1])) + ("  *" if routine.to_frame else ''),
+                file=outfile)
+
+    print(file=outfile)
+    print(row.format('block', 'line', 'best', 'worst'), file=outfile)
+    for block in analysis.blocks:
+        print(row.format(block.name, block.lineno, block.best, block.worst), file=outfile)
+
+    print(file=outfile)
+    print(row.format('frame (from)', 'line', 'best', 'worst'), file=outfile)
+    for block, costs in analysis.frames():
+        print(row.format(block.name, block.lineno, format_cycles(costs[0]), format_cycles(costs[1])),
+                file=outfile)
+
+def worst_frame(analysis):
+    "The worst case cycles of a frame (0 if there are no frames)."
+    return max([costs[1] for _, costs in analysis.frames()] or [0])
+
+def check_timing(analysis, errors, budget=None):
+    """Warn about the loops without a bound and the recursive routines, and
+    report an error if the worst case of a frame goes over a budget of cycles.
+    """
+    frames = analysis.frames()
+    for lineno in sorted(analysis.unbounded):
+        warn("Loop without a bound (add a '; LOOP n' comment)", lineno=lineno, code='unbounded-loop', errors=errors)
+    for label in sorted(analysis.recursive):
+        warn("Recursive routine {0}, the worst case is unbounded", label,
+                lineno=analysis.blocks[analysis.label_block[label]].lineno, code='recursion', errors=errors)
+    for block, costs in frames:
+        if budget is not None and costs[1] > budget:
+            error("Frame from {0} takes up to {1} cycles, over the budget of {2:d}", block.name,
+                    format_cycles(costs[1]), budget, lineno=block.lineno, code='cycle-budget', errors=errors)
@@ -2,8 +2,7 @@
 # microprocessor.
 
 from __future__ import print_function
-from bitstring import BitArray
-from asmerrors import error
+from asmerrors import error, find_column
 
 tokens = (
         'ABA',              # Add accumulator B to accumulator A
@@ -146,9 +145,17 @@ def t_IDENTIFIER(t):
         t.type = t.value
     return t
 
+def hex_value(text):
+    """The value of a hexadecimal literal ($F0), as a signed number with 4 bits
+    per digit.
+    """
+    bits = 4 * (len(text) - 1)
+    value = int(text[1:], 16)
+    return value - (1 << bits) if value >> (bits - 1) else value
+
 def t_HEX_NUM(t):
     r'\$([0-9a-fA-F])+'
-    t.value = BitArray(hex="0x" + t.value[1:]).int
+    t.value = hex_value(t.value)
     return t
 
 def t_NUM(t):
@@ -165,5 +172,6 @@ def t_ENDL(t):
     return t
 
 def t_error(t):
-    error("Illegal character '{0}'", t.value[0], errors=t.lexer.errors, lineno=t.lexer.lineno)
+    error("Illegal character '{0}'", t.value[0], lineno=t.lexer.lineno, column=find_column(t.lexer.lexdata, t.lexpos),
+            code='illegal-character', errors=t.lexer.errors)
     t.lexer.skip(1)
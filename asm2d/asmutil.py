@@ -1,27 +1,114 @@
-import ply.lex as lex
-import ply.yacc as yacc
+import binascii
+import copy
+import functools
+import hashlib
+import os
+import ply
+import asmfastlex
 import asmtokens
 import asmgrammar
 from asmconstants import SIZE
 
 # Factories
 
-def create_lexer(errors):
-    "Create an instance of the lexer."
+def create_lexer(errors, fast=False):
+    """Create an instance of the lexer: the PLY lexer, or with fast set, the
+    single regex lexer of asmfastlex (which gives the same tokens).
+    """
+    if fast:
+        return asmfastlex.FastLexer(errors)
+    import ply.lex as lex
     asmlexer = lex.lex(module=asmtokens)
     asmlexer.errors = errors
     return asmlexer
 
 def create_parser(errors, debug=False):
     "Create an instance of the parser."
+    import ply.yacc as yacc
     if debug:
         asmparser = yacc.yacc(module=asmgrammar, tabmodule="parsetabasm")
     else:
-        asmparser = yacc.yacc(module=asmgrammar, write_tables=0, debug=0)
+        asmparser = load_parser()
+    reset_parser(asmparser, errors)
+    return asmparser
+
+def reset_parser(asmparser, errors):
+    """Clear the symbol tables of the parser, before parsing a new program, and
+    report its syntax errors to the error report.
+    """
     asmparser.errors = errors
+    asmparser.errorfunc = functools.partial(asmgrammar.syntax_error, errors=errors)
     asmparser.const_table = {}
     asmparser.data_table = {}
     asmparser.inst_table = {}
     asmparser.data_table[SIZE] = 0
     asmparser.inst_table[SIZE] = 0
+
+def clone_lexer(asmlexer, errors):
+    "Create a copy of the lexer with its own state, sharing the master regex."
+    clone = asmlexer.clone()
+    clone.errors = errors
+    clone.lineno = 1
+    return clone
+
+def clone_parser(asmparser, errors):
+    "Create a copy of the parser with its own state, sharing the parse tables."
+    clone = copy.copy(asmparser)
+    reset_parser(clone, errors)
+    return clone
+
+# Parse table cache
+
+def cache_dir():
+    """The directory where asm2d keeps its cached files. It can be changed with
+    the ASM2D_CACHE_DIR environment variable.
+    """
+    path = os.environ.get('ASM2D_CACHE_DIR')
+    if path:
+        return path
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'asm2d')
+
+def grammar_signature():
+    """A hash of everything the LALR tables depend on: the grammar productions,
+    the precedence rules, the tokens and the version of PLY (which doesn't
+    import PLY itself, so it's cheap for the build cache).
+    """
+    digest = hashlib.sha1()
+    digest.update(repr((asmgrammar.start, asmgrammar.precedence, asmtokens.tokens)).encode('utf-8'))
+    for name in sorted(dir(asmgrammar)):
+        if name.startswith('p_'):
+            digest.update('{0}:{1}'.format(name, getattr(asmgrammar, name).__doc__).encode('utf-8'))
+    digest.update('ply-{0}'.format(ply.__version__).encode('utf-8'))
+    return digest.hexdigest()
+
+def parse_table_file():
+    "The path of the cached parse tables for the current grammar."
+    return os.path.join(cache_dir(), 'parsetab-{0}.pickle'.format(grammar_signature()))
+
+def load_parser():
+    """Create the parser from the cached parse tables, generating them if they
+    don't exist (or can't be read). New tables are written to a temporary file
+    and renamed, so concurrent runs never see a partial file.
+    """
+    import ply.yacc as yacc
+    table_file = parse_table_file()
+    if os.path.isfile(table_file):
+        try:
+            return yacc.yacc(module=asmgrammar, picklefile=table_file, debug=0,
+                    errorlog=yacc.NullLogger())
+        except Exception:
+            pass
+    try:
+        if not os.path.isdir(os.path.dirname(table_file)):
+            os.makedirs(os.path.dirname(table_file))
+    except OSError:
+        return yacc.yacc(module=asmgrammar, write_tables=0, debug=0)
+    tmp_file = '{0}.{1:d}.{2}.tmp'.format(table_file, os.getpid(), binascii.hexlify(os.urandom(4)))
+    asmparser = yacc.yacc(module=asmgrammar, picklefile=tmp_file, debug=0,
+            errorlog=yacc.NullLogger())
+    try:
+        os.rename(tmp_file, table_file)
+    except OSError:
+        pass
     return asmparser
@@ -3,13 +3,158 @@
 
 from __future__ import print_function
 import argparse
+import json
 import os
-import pkg_resources
 import sys
+import time
+from StringIO import StringIO
+import asmcache
 import asmcodegen
+import asmflow
+import asmlayout
+import asmobject
+import asmoptimize
+import asmoutput
 import asmsemantic
+import asmstack
+import asmtiming
 import asmutil
-from asmerrors import ErrorReport
+from asm2d import __version__
+from asmconstants import SIZE
+from asmerrors import MAX_DIAGNOSTICS, Diagnostic, ErrorReport, error, parse_warning_filter, write_diagnostics
+
+class Result:
+    """The result of assembling a program: the memory image, its contents in
+    the output format, the AST, the symbol tables and the diagnostics. The image and
+    the output are None if there were errors. The stats of the optimizer, the
+    timing analysis, the stack analysis, the listing, the symbol map and the
+    object file are None if they didn't run.
+    """
+
+    def __init__(self, errors, image=None, output=None, ast=None, const_table=None, data_table=None, inst_table=None):
+        self.errors = errors
+        self.image = image
+        self.output = output
+        self.ast = ast
+        self.const_table = const_table
+        self.data_table = data_table
+        self.inst_table = inst_table
+        self.optimizations = None
+        self.timing = None
+        self.stack = None
+        self.listing = None
+        self.symbols = None
+        self.object = None
+
+    @property
+    def diagnostics(self):
+        return self.errors.diagnostics
+
+    @property
+    def ok(self):
+        return not self.errors.has_errors()
+
+
+class Assembler:
+    """An assembler that can be reused to assemble many programs, without
+    building the lexer and the parser again. It keeps no state between calls to
+    assemble(), so it can be shared between threads. With fast_lexer set, it
+    uses the lexer of asmfastlex instead of the PLY one.
+    """
+
+    def __init__(self, fast_lexer=False):
+        self._lexer = asmutil.create_lexer(None, fast=fast_lexer)
+        self._parser = asmutil.create_parser(None)
+
+    def assemble(self, source, no_words=None, errors=None, output_format='mif', direct=False,
+            zero_page=False, profile=None, optimize=False, strip=False,
+            timing=False, cycle_budget=None, stack=False, listing=False, symbols=False, relocatable=False,
+            **options):
+        """Assemble the source code of a program. Diagnostics are collected in
+        the result instead of being printed, unless an error report is given.
+        With direct set, variables in the first 256 bytes are accessed in
+        direct mode. With zero_page set, the most used variables are moved
+        there (see asmlayout). With optimize set, the peephole optimizer runs
+        before the code generation (see asmoptimize). With strip set, the code
+        that can't be reached from the main label and the variables it doesn't
+        use are removed (see asmflow). With timing set, or a cycle budget for
+        the frames, the timing analysis runs (see asmtiming), and a frame over
+        the budget is an error. With stack set, the stack analysis runs (see
+        asmstack). With listing set, the listing of the program is generated,
+        and with symbols set, its symbol map (see asmoutput). With relocatable
+        set, the source is a module of a bigger program: it can reference
+        labels and variables of other modules, and the output is an object file
+        for the linker (see asmobject). The options that need the whole program
+        (direct, zero_page, strip, timing and stack) are ignored then. A memory
+        size (no_words) smaller than the program is an error. The options are
+        passed to the writer of the output format.
+        """
+        if errors is None:
+            errors = ErrorReport(verbose=False, fatal=False)
+        if not source.endswith('\n'):
+            source += '\n'
+        asmlexer = asmutil.clone_lexer(self._lexer, errors)
+        asmparser = asmutil.clone_parser(self._parser, errors)
+
+        ast = asmparser.parse(source, lexer=asmlexer) or []
+        result = Result(errors, ast=ast, const_table=asmparser.const_table,
+                data_table=asmparser.data_table, inst_table=asmparser.inst_table)
+
+        externals = None
+        if relocatable:
+            externals = set()
+            direct = zero_page = strip = timing = stack = False
+            cycle_budget = None
+        asmsemantic.analyse(ast, asmparser.const_table, asmparser.data_table, asmparser.inst_table, errors,
+                direct=direct, externals=externals)
+        if errors.has_errors():
+            return result
+
+        if optimize:
+            result.optimizations = asmoptimize.optimize(ast, asmparser.inst_table)
+        if strip:
+            dead_blocks, dead_vars = asmflow.eliminate_dead(ast, asmparser.data_table, asmparser.inst_table)
+            asmflow.report_dead(dead_blocks, dead_vars, errors)
+        if zero_page:
+            asmlayout.place_zero_page(ast, asmparser.data_table, asmparser.inst_table, profile=profile)
+        if optimize or strip or zero_page:
+            asmsemantic.allocate(ast, asmparser.data_table, asmparser.inst_table, direct=direct or zero_page)
+
+        if timing or cycle_budget is not None:
+            result.timing = asmtiming.TimingAnalysis(ast, asmtiming.loop_bounds(source))
+            asmtiming.check_timing(result.timing, errors, budget=cycle_budget)
+            errors.report_errors()
+            if errors.has_errors():
+                return result
+        if stack:
+            result.stack = asmstack.StackAnalysis(ast, asmparser.inst_table, errors)
+            result.stack.check()
+
+        program_size = asmparser.inst_table[SIZE] + asmparser.data_table[SIZE]
+        if not relocatable and no_words and no_words < program_size:
+            error("Program needs {0:d} words, -w is {1:d}", program_size, no_words, code='memory-size',
+                    errors=errors)
+            errors.report_errors()
+            return result
+
+        outfile = StringIO()
+        if relocatable:
+            result.object = asmobject.generate_object(ast, asmparser.data_table, asmparser.inst_table, externals)
+            result.image = result.object.image
+            asmobject.write_object(result.object, outfile)
+        else:
+            result.image = asmcodegen.codegen(ast, asmparser.data_table, asmparser.inst_table,
+                    no_words=no_words, outfile=outfile, output_format=output_format, **options)
+        result.output = outfile.getvalue()
+        if listing:
+            outfile = StringIO()
+            asmoutput.output_listing(result.image, ast, source, outfile)
+            result.listing = outfile.getvalue()
+        if symbols:
+            result.symbols = asmoutput.symbol_map(asmparser.const_table, asmparser.data_table,
+                    asmparser.inst_table)
+        return result
+
 
 def read_file(filename):
     "Read the contents of a file into memory."
@@ -25,19 +170,308 @@ def read_file(filename):
         sys.exit(1)
 
 
-def run_compiler(input_file, output_file, no_words):
-    "Run the compiler on the source file."
-    errors = ErrorReport()
-    asmlexer = asmutil.create_lexer(errors)
-    asmparser = asmutil.create_parser(errors, debug=False)
+def read_source(filename):
+    "Read the contents of a file, or None if it's missing or can't be read."
+    try:
+        with open(filename) as f:
+            return f.read()
+    except IOError:
+        return None
+
+
+def read_profile(filename):
+    """Read the execution count of each line from a profile (a JSON object with
+    a 'lines' object, that maps line numbers to counts).
+    """
+    try:
+        with open(filename) as f:
+            lines = json.load(f)['lines']
+        return dict((int(lineno), count) for lineno, count in lines.items())
+    except (IOError, ValueError, KeyError, AttributeError):
+        print("Error reading profile '{}'.".format(filename), file=sys.stderr)
+        sys.exit(1)
+
+
+def build(input_string, no_words, output_format='mif', listing=False, map_format=None, assembler=None,
+        errors=None, fast_lexer=False, **options):
+    """Assemble a program, printing the diagnostics as they are found (and
+    exiting if there are errors, unless an error report is given). Returns the
+    build: a dictionary with the output, the diagnostics (as JSON objects),
+    the number of errors and of dropped diagnostics, the reports of the
+    analyses, the listing and the symbol map (as text, or JSON if the map
+    format is 'json').
+    """
+    errors = errors or ErrorReport()
+    assembler = assembler or Assembler(fast_lexer=fast_lexer)
+    result = assembler.assemble(input_string, no_words=no_words, errors=errors,
+            output_format=output_format, listing=listing, symbols=map_format is not None, **options)
+    reports = StringIO()
+    if result.optimizations is not None:
+        result.optimizations.report(reports)
+    if result.timing is not None and options.get('timing'):
+        asmtiming.report(result.timing, reports)
+    if result.stack is not None:
+        asmstack.report(result.stack, result.data_table, reports)
+
+    symbol_map = None
+    if map_format is not None and result.symbols is not None:
+        outfile = StringIO()
+        if map_format == 'json':
+            asmoutput.output_map_json(result.symbols, outfile)
+        else:
+            asmoutput.output_map(result.symbols, outfile)
+        symbol_map = outfile.getvalue()
+    return {
+            'output': result.output,
+            'diagnostics': [diagnostic.to_json() for diagnostic in result.diagnostics],
+            'errors': errors.num_errors(),
+            'dropped': errors.dropped,
+            'reports': reports.getvalue(),
+            'listing': result.listing,
+            'map': symbol_map,
+            }
+
 
+def map_format(map_file):
+    "The format of a symbol map file: JSON if its name ends with .json, text otherwise."
+    if map_file is None:
+        return None
+    return 'json' if map_file.lower().endswith('.json') else 'text'
+
+def cached_build(input_string, no_words, output_format='mif', listing=False, map_format=None, cache=None,
+        assembler=None, errors=None, fast_lexer=False, **options):
+    """Build a program (see build), or copy the build from the cache if it was
+    already done. The diagnostics of a cached build are printed again, unless
+    the error report isn't verbose. The warning filters and the diagnostics
+    cap of the error report are part of the key of the build.
+    """
+    errors = errors or ErrorReport()
+    entry = key = None
+    if cache is not None:
+        key = asmcache.build_key(input_string, no_words=no_words, output_format=output_format,
+                listing=listing, map_format=map_format, warning_filters=errors.filters,
+                max_diagnostics=errors.max_diagnostics, **options)
+        entry = cache.get(key)
+        if entry is not None and errors.verbose:
+            write_diagnostics(entry['diagnostics'], dropped=entry['dropped'])
+    if entry is None:
+        entry = build(input_string, no_words, output_format=output_format, listing=listing,
+                map_format=map_format, assembler=assembler, errors=errors, fast_lexer=fast_lexer, **options)
+        if cache is not None and not errors.has_errors():
+            cache.put(key, entry, binary=output_format in asmoutput.BINARY_FORMATS)
+    return entry
+
+def write_outputs(entry, output_file, output_format='mif', listing_file=None, map_file=None):
+    "Write the output, the listing and the symbol map of a build."
+    mode = 'wb+' if output_format in asmoutput.BINARY_FORMATS else 'w+'
+    with open(output_file, mode) as f:
+        f.write(entry['output'])
+    if listing_file is not None:
+        with open(listing_file, 'w') as f:
+            f.write(entry['listing'])
+    if map_file is not None:
+        with open(map_file, 'w') as f:
+            f.write(entry['map'])
+
+def diagnostics_report(warning_filters=(), max_diagnostics=MAX_DIAGNOSTICS):
+    """An error report that collects the diagnostics of a build without
+    printing them, with the warning filters (the arguments of -W flags) and
+    the diagnostics cap.
+    """
+    return ErrorReport(verbose=False, fatal=False, filters=[parse_warning_filter(text) for text in warning_filters],
+            max_diagnostics=max_diagnostics)
+
+def print_diagnostics(entry, input_file, diagnostics_format='text'):
+    """Print the diagnostics of a build, when it ends: to stderr as text, or
+    to stdout as a JSON object (see asmerrors.write_diagnostics).
+    """
+    if diagnostics_format == 'json':
+        diagnostics = [dict(fields, file=input_file) for fields in entry['diagnostics']]
+        write_diagnostics(diagnostics, sys.stdout, 'json', entry['errors'], entry['dropped'])
+    else:
+        write_diagnostics(entry['diagnostics'], sys.stderr, num_errors=entry['errors'], dropped=entry['dropped'])
+
+def run_compiler(input_file, output_file, no_words, output_format='mif', listing_file=None, map_file=None,
+        cache=None, fast_lexer=False, warning_filters=(), max_diagnostics=MAX_DIAGNOSTICS,
+        diagnostics_format='text', **options):
+    """Run the compiler on the source file. The listing and the symbol map
+    (JSON if its name ends with .json, text otherwise) are written if their
+    file names are given. With a build cache (see asmcache), the outputs of a
+    build that was already done are copied from it, and its diagnostics are
+    printed again. Exits if there are errors.
+    """
     input_string = read_file(input_file)
-    ast = asmparser.parse(input_string, lexer=asmlexer)
+    errors = diagnostics_report(warning_filters, max_diagnostics)
+    entry = cached_build(input_string, no_words, output_format=output_format, listing=listing_file is not None,
+            map_format=map_format(map_file), cache=cache, errors=errors, fast_lexer=fast_lexer, **options)
+    print_diagnostics(entry, input_file, diagnostics_format)
+    if entry['errors'] > 0:
+        sys.exit(1)
+    sys.stderr.write(entry['reports'])
+    write_outputs(entry, output_file, output_format, listing_file, map_file)
+
 
-    asmsemantic.analyse(ast, asmparser.const_table, asmparser.data_table, asmparser.inst_table, errors)
+# Batch mode: many files assembled by a pool of worker processes, each one
+# with its own assembler
 
-    with open(output_file, 'w+') as f:
-        asmcodegen.codegen(ast, asmparser.data_table, asmparser.inst_table, no_words=no_words, outfile=f)
+_worker_assembler = None
+
+def init_worker(fast_lexer=False):
+    "Build the lexer and the parser of a worker."
+    global _worker_assembler
+    _worker_assembler = Assembler(fast_lexer=fast_lexer)
+
+def batch_build(task):
+    """Assemble a file in a worker. Returns the file name, the build (without
+    the outputs, which are written by the worker) and True if it was
+    assembled.
+    """
+    (input_file, output_file, listing_file, map_file, no_words, output_format, cache, warning_filters,
+            max_diagnostics, options) = task
+    try:
+        with open(input_file) as f:
+            input_string = f.read()
+    except IOError:
+        diagnostic = Diagnostic('error', "Error reading file '{}'".format(input_file), code='read-error')
+        return input_file, {'diagnostics': [diagnostic.to_json()], 'errors': 1, 'dropped': 0, 'reports': ''}, False
+    errors = diagnostics_report(warning_filters, max_diagnostics)
+    entry = cached_build(input_string, no_words, output_format=output_format, listing=listing_file is not None,
+            map_format=map_format(map_file), cache=cache, assembler=_worker_assembler, errors=errors, **options)
+    summary = dict((name, entry[name]) for name in ('diagnostics', 'errors', 'dropped', 'reports'))
+    if entry['errors'] > 0:
+        return input_file, dict(summary, reports=''), False
+    write_outputs(entry, output_file, output_format, listing_file, map_file)
+    return input_file, summary, True
+
+def run_batch(tasks, jobs=None, fast_lexer=False, diagnostics_format='text'):
+    """Assemble many files (tasks for batch_build) with a pool of processes
+    (one per CPU by default). The diagnostics and reports of each file are
+    printed, in order, prefixed by its name (or with JSON diagnostics, the
+    diagnostics of all the files are printed at the end). Returns the number
+    of files that failed.
+    """
+    pool = None
+    if jobs == 1 or len(tasks) == 1:
+        init_worker(fast_lexer)
+        results = (batch_build(task) for task in tasks)
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs, initializer=init_worker, initargs=(fast_lexer,))
+        results = pool.imap(batch_build, tasks)
+
+    failed = num_errors = dropped = 0
+    diagnostics = []
+    try:
+        for input_file, entry, ok in results:
+            if diagnostics_format == 'json':
+                diagnostics.extend(dict(fields, file=input_file) for fields in entry['diagnostics'])
+                num_errors += entry['errors']
+                dropped += entry['dropped']
+            else:
+                write_diagnostics(entry['diagnostics'], dropped=entry['dropped'], prefix=input_file)
+            if entry['reports']:
+                print("{0}:".format(input_file), file=sys.stderr)
+                sys.stderr.write(entry['reports'])
+            if not ok:
+                failed += 1
+    finally:
+        if pool is not None:
+            pool.terminate()
+    if diagnostics_format == 'json':
+        write_diagnostics(diagnostics, sys.stdout, 'json', num_errors, dropped)
+    print("{0:d} file{1} assembled, {2:d} failed.".format(len(tasks), 's' if len(tasks) != 1 else '', failed),
+            file=sys.stderr)
+    return failed
+
+def read_manifest(filename):
+    """Read a manifest: one source file per line, optionally followed by its
+    output file (relative to the directory of the manifest). Comments start
+    with '#'.
+    """
+    base_dir = os.path.dirname(filename)
+    files = []
+    for line in read_file(filename).splitlines():
+        fields = line.split('#')[0].split()
+        if len(fields) > 2:
+            print("Invalid line in manifest '{0}': {1}".format(filename, line.strip()), file=sys.stderr)
+            sys.exit(1)
+        elif fields:
+            paths = [os.path.join(base_dir, field) for field in fields]
+            files.append((paths[0], paths[1] if len(paths) > 1 else None))
+    return files
+
+
+def write_if_changed(filename, contents, binary=False):
+    """Write a file if its contents changed, replacing it atomically (the new
+    contents are written to a temporary file, which is renamed). Returns True
+    if the file was written.
+    """
+    mode = 'b' if binary else ''
+    try:
+        with open(filename, 'r' + mode) as f:
+            if f.read() == contents:
+                return False
+    except IOError:
+        pass
+    tmp_file = '{0}.{1:d}.tmp'.format(filename, os.getpid())
+    with open(tmp_file, 'w' + mode) as f:
+        f.write(contents)
+    os.rename(tmp_file, filename)
+    return True
+
+
+def watch(input_file, output_file, no_words, output_format='mif', listing_file=None, map_file=None,
+        interval=0.5, fast_lexer=False, warning_filters=(), max_diagnostics=MAX_DIAGNOSTICS,
+        diagnostics_format='text', **options):
+    """Assemble the source file every time it changes, until interrupted. The
+    lexer and the parser are built once. The output files are only written
+    when their contents change, so the tools that watch them (like Quartus)
+    don't reload an identical image. The diagnostics of each build are printed
+    when it ends (with JSON diagnostics, one JSON object per line).
+    """
+    assembler = Assembler(fast_lexer=fast_lexer)
+    last_stat = last_source = None
+    try:
+        while True:
+            try:
+                stat = os.stat(input_file)
+                stat = (stat.st_mtime, stat.st_size)
+            except OSError:
+                stat = None
+            if stat is not None and stat != last_stat:
+                # Editors that save by deleting and renaming can remove the
+                # file after the stat: poll again instead of exiting
+                source = read_source(input_file)
+                if source is not None:
+                    last_stat = stat
+                if source is not None and source != last_source:
+                    last_source = source
+                    errors = diagnostics_report(warning_filters, max_diagnostics)
+                    watch_build(assembler, source, output_file, no_words, output_format, listing_file,
+                            map_file, errors=errors, input_file=input_file,
+                            diagnostics_format=diagnostics_format, **options)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+def watch_build(assembler, source, output_file, no_words, output_format, listing_file, map_file, errors=None,
+        input_file=None, diagnostics_format='text', **options):
+    "Assemble the source in watch mode, and write the outputs that changed."
+    errors = errors or diagnostics_report()
+    entry = build(source, no_words, output_format=output_format, listing=listing_file is not None,
+            map_format=map_format(map_file), assembler=assembler, errors=errors, **options)
+    print_diagnostics(entry, input_file, diagnostics_format)
+    if errors.has_errors():
+        print("{0}: not written".format(output_file), file=sys.stderr)
+        return
+    sys.stderr.write(entry['reports'])
+
+    written = write_if_changed(output_file, entry['output'], binary=output_format in asmoutput.BINARY_FORMATS)
+    if listing_file is not None:
+        write_if_changed(listing_file, entry['listing'])
+    if map_file is not None:
+        write_if_changed(map_file, entry['map'])
+    print("{0}: {1}".format(output_file, 'written' if written else 'unchanged'), file=sys.stderr)
 
 
 def main():
@@ -45,21 +479,115 @@ def main():
     parser = argparse.ArgumentParser(
             description='Assembler for an extended 68HC11 clone.',
             epilog='As private parts to the gods are we, they play with us for their sport.')
-    parser.add_argument('file', help='the source file')
+    parser.add_argument('files', nargs='*', metavar='file', help='the source files')
+    parser.add_argument('--manifest',
+            help='a file with the source files to assemble (one per line, optionally followed by its output file)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help='the number of processes that assemble many files (by default, one per CPU)')
     parser.add_argument('-o', '--output-file',
             help='the output file')
     parser.add_argument('-w', '--words', type=int, default=None,
             help='the number of words in the memory')
-    version = 'asm2d {}'.format(pkg_resources.require('asm2d')[0].version)
+    parser.add_argument('-d', '--direct', action='store_true',
+            help='use direct addressing for the variables in the first 256 bytes')
+    parser.add_argument('-z', '--zero-page', action='store_true',
+            help='move the most used variables to the first 256 bytes (implies -d)')
+    parser.add_argument('--profile',
+            help='a profile (JSON) to weight the variable references with -z')
+    parser.add_argument('-O', '--optimize', action='store_true',
+            help='run the peephole optimizer, and report the bytes and cycles saved')
+    parser.add_argument('-s', '--strip', action='store_true',
+            help='remove the code that can\'t be reached from .main, and the variables it doesn\'t use')
+    parser.add_argument('-t', '--timing', action='store_true',
+            help='report the best and worst case cycles of every routine, basic block and frame')
+    parser.add_argument('--cycle-budget', type=int, default=None,
+            help='fail if the worst case of a frame takes more cycles than this')
+    parser.add_argument('--stack', action='store_true',
+            help='report the maximum stack depth of every routine, and the memory size it needs')
+    parser.add_argument('--watch', action='store_true',
+            help='assemble the source file again every time it changes (the output is only written if it changed)')
+    parser.add_argument('-W', dest='warnings', action='append', default=[], metavar='FILTER',
+            help='a warning filter: no-CODE ignores the warnings with that code (it can be a pattern, like '
+            'unused-*), CODE enables them again, error=CODE turns them into errors and error all the warnings')
+    parser.add_argument('--diagnostics-format', choices=['text', 'json'], default='text',
+            help='write the diagnostics as text to stderr (the default), or as a JSON object to stdout')
+    parser.add_argument('--max-diagnostics', type=int, default=MAX_DIAGNOSTICS,
+            help='the number of diagnostics written for a file, the rest are only counted '
+            '({0:d} by default)'.format(MAX_DIAGNOSTICS))
+    parser.add_argument('--fast-lexer', action='store_true',
+            help='use the single regex lexer (it gives the same tokens as the default one)')
+    parser.add_argument('--cache-dir',
+            help='keep the outputs of the builds in this directory, and reuse them (also set by ASM2D_BUILD_CACHE)')
+    parser.add_argument('--no-cache', action='store_true',
+            help='don\'t use the build cache')
+    parser.add_argument('-f', '--format', choices=sorted(asmoutput.FORMATS),
+            help='the output format (by default, guessed from the output file name, or mif)')
+    parser.add_argument('-c', '--compact', action='store_true',
+            help='write runs of identical bytes as address ranges, without comments')
+    parser.add_argument('--comments', action='store_true',
+            help='keep the comments in compact mode')
+    parser.add_argument('--object', action='store_true',
+            help='write a relocatable object file (.o2d) for asm2d-link, instead of the memory image')
+    parser.add_argument('-l', '--listing', nargs='?', const='',
+            help='write a listing (by default, to the source file name with .lst)')
+    parser.add_argument('-m', '--map', nargs='?', const='',
+            help='write a symbol map, as JSON if the name ends with .json (by default, to the source file name with .map)')
+    version = 'asm2d {0}'.format(__version__)
     parser.add_argument('-v', '--version', action='version', version=version)
     args = parser.parse_args()
 
-    output_file = args.output_file
-    if output_file is None:
-        filename, ext = os.path.splitext(args.file)
-        output_file = filename + '.mif'
+    files = [(name, None) for name in args.files]
+    if args.manifest is not None:
+        files.extend(read_manifest(args.manifest))
+    if not files:
+        parser.error('no source files')
+    batch = len(files) > 1 or args.manifest is not None
+    if batch and args.watch:
+        parser.error('--watch works with a single source file')
+    if batch and (args.output_file or args.listing or args.map):
+        parser.error('the names of the output files can only be given for a single source file '
+                '(use a manifest to name them)')
+
+    outputs = []
+    for input_file, output_file in files:
+        output_file = output_file or args.output_file
+        output_format = args.format or asmoutput.guess_format(output_file or '')
+        filename, ext = os.path.splitext(input_file)
+        if output_file is None:
+            output_file = filename + (asmobject.EXTENSION if args.object else asmoutput.EXTENSIONS[output_format])
+        listing_file = filename + '.lst' if args.listing == '' else args.listing
+        map_file = filename + '.map' if args.map == '' else args.map
+        outputs.append((input_file, output_file, output_format, listing_file, map_file))
+
+    profile = None
+    if args.profile is not None:
+        profile = read_profile(args.profile)
+
+    cache = None
+    cache_dir = args.cache_dir or os.environ.get('ASM2D_BUILD_CACHE')
+    if cache_dir and not args.no_cache:
+        cache = asmcache.BuildCache(cache_dir)
 
-    run_compiler(args.file, output_file, args.words)
+    options = dict(direct=args.direct, zero_page=args.zero_page, profile=profile, optimize=args.optimize,
+            strip=args.strip, timing=args.timing, cycle_budget=args.cycle_budget, stack=args.stack,
+            relocatable=args.object, compact=args.compact, comments=args.comments or not args.compact)
+    if batch:
+        tasks = [(input_file, output_file, listing_file, map_file, args.words, output_format, cache,
+                args.warnings, args.max_diagnostics, options)
+                for input_file, output_file, output_format, listing_file, map_file in outputs]
+        if run_batch(tasks, args.jobs, fast_lexer=args.fast_lexer, diagnostics_format=args.diagnostics_format) > 0:
+            sys.exit(1)
+    else:
+        input_file, output_file, output_format, listing_file, map_file = outputs[0]
+        if args.watch:
+            watch(input_file, output_file, args.words, output_format=output_format, listing_file=listing_file,
+                    map_file=map_file, fast_lexer=args.fast_lexer, warning_filters=args.warnings,
+                    max_diagnostics=args.max_diagnostics, diagnostics_format=args.diagnostics_format, **options)
+        else:
+            run_compiler(input_file, output_file, args.words, output_format=output_format,
+                    listing_file=listing_file, map_file=map_file, cache=cache, fast_lexer=args.fast_lexer,
+                    warning_filters=args.warnings, max_diagnostics=args.max_diagnostics,
+                    diagnostics_format=args.diagnostics_format, **options)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,578 @@
+# Instruction set simulator for the 68112D: runs a memory image produced by
+# asmcodegen, without rendering anything (the drawing instructions are
+# recorded as draw commands).
+#
+# The instructions are decoded once (the first time they run) into a handler,
+# an operand and the address of the next instruction, using a table built
+# from asmconstants.OP_CODES. The game clock, read by CPK and reset by RSTK,
+# counts ticks of TICK_CYCLES cycles. RSTK also marks the end of a frame.
+
+from __future__ import print_function
+import random
+from asmconstants import CYCLES, INST_ONE_BYTE, KEY_TABLE, OP_CODES, SYM_TABLE
+
+# Memory size (the stack starts at the top)
+MEMORY_SIZE = 0x10000
+# Cycles per tick of the game clock
+TICK_CYCLES = 1000
+
+# Instructions that use the cycle count (the game clock)
+SYNC = {'CPK', 'RSTK'}
+# Instructions whose target is relative (branches), or absolute
+RELATIVE = {'BCC', 'BCS', 'BEQ', 'BHI', 'BLO', 'BLS', 'BMI', 'BNE', 'BPL', 'BRA'}
+ABSOLUTE = {'JMP', 'JSR'}
+# Immediate instructions with a one byte operand
+IMM_ONE_BYTE = INST_ONE_BYTE | {'CPK', 'DRSYM', 'RNDA'}
+
+KEYS = dict((code, key) for key, code in KEY_TABLE.items())
+SYMBOLS = dict((code, sym) for sym, code in SYM_TABLE.items())
+
+
+class SimulationError(Exception):
+    "The program did something the simulator can't run."
+
+    def __init__(self, message, pc):
+        Exception.__init__(self, "{0} (at address: {1:d})".format(message, pc))
+        self.pc = pc
+
+class _Sync(Exception):
+    """Raised instead of running a handler that needs the cycle count, which
+    the simulation loop keeps in a local variable.
+    """
+
+    def __init__(self, handler, operand, pc):
+        Exception.__init__(self)
+        self.handler = handler
+        self.operand = operand
+        self.pc = pc
+
+class _Stop(Exception):
+    "Stops the simulation loop, at the given address."
+
+    def __init__(self, pc, halted=False):
+        Exception.__init__(self)
+        self.pc = pc
+        self.halted = halted
+
+
+# Helper functions
+
+def signed8(value):
+    return value - 0x100 if value & 0x80 else value
+
+def read16(mem, addr):
+    return (mem[addr] << 8) | mem[addr + 1]
+
+def write16(m, addr, value):
+    m.mem[addr] = value >> 8
+    m.mem[addr + 1] = value & 0xFF
+    if addr < m.code_size:
+        m.invalidate(addr, 2)
+
+def add(m, x, y, bits):
+    "Add two values, and set the flags."
+    mask, sign = (1 << bits) - 1, 1 << (bits - 1)
+    r = x + y
+    m.c = r > mask
+    r &= mask
+    m.n, m.z, m.v = r & sign != 0, r == 0, ~(x ^ y) & (x ^ r) & sign != 0
+    return r
+
+def sub(m, x, y, bits):
+    "Subtract two values, and set the flags."
+    mask, sign = (1 << bits) - 1, 1 << (bits - 1)
+    r = (x - y) & mask
+    m.n, m.z, m.v, m.c = r & sign != 0, r == 0, (x ^ y) & (x ^ r) & sign != 0, y > x
+    return r
+
+def test(m, value, sign):
+    "Set the flags for a load or a store."
+    m.n, m.z, m.v = value & sign != 0, value == 0, False
+    return value
+
+def push8(m, value):
+    if m.sp < 1:
+        raise SimulationError("Stack overflow", m.sp)
+    m.mem[m.sp] = value
+    m.sp -= 1
+
+def push16(m, value):
+    push8(m, value & 0xFF)
+    push8(m, value >> 8)
+
+def pull8(m):
+    m.sp += 1
+    return m.mem[m.sp]
+
+def pull16(m):
+    high = pull8(m)
+    return (high << 8) | pull8(m)
+
+
+# Handlers: each one gets the machine, the operand and the address of the next
+# instruction, and returns the address of the instruction that runs next. The
+# operand is the value for immediate instructions, the target address for
+# branches and jumps, and the address for the other instructions (memory
+# reads are added by the decoder, see VALUE_HANDLERS).
+
+def op_ABA(m, op, pc):
+    m.a = add(m, m.a, m.b, 8)
+    return pc
+
+def op_ABX(m, op, pc):
+    # The 68112D adds B as a signed value (the games rely on it)
+    m.x = (m.x + signed8(m.b)) & 0xFFFF
+    return pc
+
+def op_ADDD(m, value, pc):
+    d = add(m, (m.a << 8) | m.b, value, 16)
+    m.a, m.b = d >> 8, d & 0xFF
+    return pc
+
+def op_ASRD(m, op, pc):
+    d = (m.a << 8) | m.b
+    m.c = d & 1 != 0
+    d = (d >> 1) | (d & 0x8000)
+    m.a, m.b = d >> 8, d & 0xFF
+    m.n, m.z = d & 0x8000 != 0, d == 0
+    m.v = m.n != m.c
+    return pc
+
+def op_BCC(m, target, pc):
+    return pc if m.c else target
+
+def op_BCS(m, target, pc):
+    return target if m.c else pc
+
+def op_BEQ(m, target, pc):
+    return target if m.z else pc
+
+def op_BHI(m, target, pc):
+    return pc if m.c or m.z else target
+
+def op_BKE(m, op, pc):
+    key, target = op
+    return target if key in m.keys else pc
+
+def op_BLS(m, target, pc):
+    return target if m.c or m.z else pc
+
+def op_BMI(m, target, pc):
+    return target if m.n else pc
+
+def op_BNE(m, target, pc):
+    return pc if m.z else target
+
+def op_BPL(m, target, pc):
+    return pc if m.n else target
+
+def op_BRA(m, target, pc):
+    return target
+
+def op_CLRS(m, op, pc):
+    m.draws.append(('CLRS',))
+    return pc
+
+def op_sync(m, op, pc):
+    handler, operand = op
+    raise _Sync(handler, operand, pc)
+
+def op_CPK(m, value, pc):
+    sub(m, m.clock(), value, 8)
+    return pc
+
+def op_CPK_wait(m, value, pc):
+    "CPK in a loop that waits for the clock: skip the iterations."
+    ticks = (value - m.clock()) & 0xFF
+    if ticks > 0:
+        elapsed = m.cycles - m.clock_start
+        target = m.clock_start + (elapsed // m.tick_cycles + ticks) * m.tick_cycles
+        loop_cycles = CYCLES['CPK']['imm'] + CYCLES['BNE']
+        iterations = (target - m.cycles + loop_cycles - 1) // loop_cycles
+        m.cycles += iterations * loop_cycles
+        m.instructions += iterations * 2
+    return op_CPK(m, value, pc)
+
+def op_CPX(m, value, pc):
+    sub(m, m.x, value, 16)
+    return pc
+
+def draw(name):
+    def op_draw(m, op, pc):
+        m.draws.append((name, m.xa, m.ya, m.xb, m.yb, (m.red, m.green, m.blue)))
+        return pc
+    return op_draw
+
+def op_DRSYM(m, value, pc):
+    m.draws.append(('DRSYM', m.xa, m.ya, SYMBOLS.get(value, value), None, (m.red, m.green, m.blue)))
+    return pc
+
+def op_INX(m, op, pc):
+    m.x = (m.x + 1) & 0xFFFF
+    m.z = m.x == 0
+    return pc
+
+def op_JMP(m, target, pc):
+    return target
+
+def op_JSR(m, target, pc):
+    mem, sp = m.mem, m.sp
+    if sp < 2:
+        raise SimulationError("Stack overflow", sp)
+    mem[sp] = pc & 0xFF
+    mem[sp - 1] = pc >> 8
+    m.sp = sp - 2
+    return target
+
+def op_LDAA(m, value, pc):
+    m.a = value
+    m.n, m.z, m.v = value > 0x7F, value == 0, False
+    return pc
+
+def op_LDAB(m, value, pc):
+    m.b = value
+    m.n, m.z, m.v = value > 0x7F, value == 0, False
+    return pc
+
+def op_LDB(m, value, pc):
+    m.blue = value
+    return pc
+
+def op_LDD(m, value, pc):
+    m.a, m.b = value >> 8, value & 0xFF
+    m.n, m.z, m.v = value > 0x7FFF, value == 0, False
+    return pc
+
+def op_LDG(m, value, pc):
+    m.green = value
+    return pc
+
+def op_LDR(m, value, pc):
+    m.red = value
+    return pc
+
+def op_LDX(m, value, pc):
+    m.x = value
+    m.n, m.z, m.v = value > 0x7FFF, value == 0, False
+    return pc
+
+def op_LDXA(m, value, pc):
+    m.xa = value
+    return pc
+
+def op_LDXB(m, value, pc):
+    m.xb = value
+    return pc
+
+def op_LDYA(m, value, pc):
+    m.ya = value
+    return pc
+
+def op_LDYB(m, value, pc):
+    m.yb = value
+    return pc
+
+def op_MUL(m, op, pc):
+    d = m.a * m.b
+    m.a, m.b = d >> 8, d & 0xFF
+    m.c = d & 0x80 != 0
+    return pc
+
+def op_NEGA(m, op, pc):
+    m.a = sub(m, 0, m.a, 8)
+    return pc
+
+def push(register, size):
+    push_value = push8 if size == 1 else push16
+    def op_push(m, op, pc):
+        push_value(m, getattr(m, register))
+        return pc
+    return op_push
+
+def pull(register, size):
+    pull_value = pull8 if size == 1 else pull16
+    def op_pull(m, op, pc):
+        setattr(m, register, pull_value(m))
+        return pc
+    return op_pull
+
+def op_PSHX(m, op, pc):
+    mem, sp = m.mem, m.sp
+    if sp < 2:
+        raise SimulationError("Stack overflow", sp)
+    mem[sp] = m.x & 0xFF
+    mem[sp - 1] = m.x >> 8
+    m.sp = sp - 2
+    return pc
+
+def op_PULX(m, op, pc):
+    mem, sp = m.mem, m.sp + 2
+    m.x = (mem[sp - 1] << 8) | mem[sp]
+    m.sp = sp
+    return pc
+
+def op_RNDA(m, value, pc):
+    m.a = m.random.randrange(value) if value > 0 else m.random.randrange(0x100)
+    return pc
+
+def op_RSTK(m, op, pc):
+    m.clock_start = m.cycles
+    m.end_frame()
+    if m.frame_limit is not None and m.frames >= m.frame_limit:
+        raise _Stop(pc)
+    return pc
+
+def op_RTS(m, op, pc):
+    mem, sp = m.mem, m.sp + 2
+    if sp >= len(mem):
+        raise _Stop(pc, halted=True)
+    m.sp = sp
+    return (mem[sp - 1] << 8) | mem[sp]
+
+def op_STAA(m, addr, pc):
+    m.mem[addr] = test(m, m.a, 0x80)
+    if addr < m.code_size:
+        m.invalidate(addr, 1)
+    return pc
+
+def op_STAB(m, addr, pc):
+    m.mem[addr] = test(m, m.b, 0x80)
+    if addr < m.code_size:
+        m.invalidate(addr, 1)
+    return pc
+
+def op_STD(m, addr, pc):
+    write16(m, addr, test(m, (m.a << 8) | m.b, 0x8000))
+    return pc
+
+def op_STX(m, addr, pc):
+    write16(m, addr, test(m, m.x, 0x8000))
+    return pc
+
+def op_SUBA(m, value, pc):
+    m.a = sub(m, m.a, value, 8)
+    return pc
+
+def op_SUBD(m, value, pc):
+    d = sub(m, (m.a << 8) | m.b, value, 16)
+    m.a, m.b = d >> 8, d & 0xFF
+    return pc
+
+def transfer(register):
+    def op_transfer(m, op, pc):
+        setattr(m, register, (m.a << 8) | m.b)
+        return pc
+    return op_transfer
+
+def op_XGDX(m, op, pc):
+    d = (m.a << 8) | m.b
+    m.a, m.b, m.x = m.x >> 8, m.x & 0xFF, d
+    return pc
+
+HANDLERS = {
+        'ABA': op_ABA, 'ABX': op_ABX, 'ADDD': op_ADDD, 'ASRD': op_ASRD,
+        'BCC': op_BCC, 'BCS': op_BCS, 'BEQ': op_BEQ, 'BHI': op_BHI, 'BKE': op_BKE, 'BLO': op_BCS,
+        'BLS': op_BLS, 'BMI': op_BMI, 'BNE': op_BNE, 'BPL': op_BPL, 'BRA': op_BRA,
+        'CLRS': op_CLRS, 'CPK': op_CPK, 'CPX': op_CPX,
+        'DRCL': draw('DRCL'), 'DRHLN': draw('DRHLN'), 'DRRCT': draw('DRRCT'), 'DRSYM': op_DRSYM,
+        'DRVLN': draw('DRVLN'),
+        'INX': op_INX, 'JMP': op_JMP, 'JSR': op_JSR,
+        'LDAA': op_LDAA, 'LDAB': op_LDAB, 'LDB': op_LDB, 'LDD': op_LDD, 'LDG': op_LDG, 'LDR': op_LDR,
+        'LDX': op_LDX, 'LDXA': op_LDXA, 'LDXB': op_LDXB, 'LDYA': op_LDYA, 'LDYB': op_LDYB,
+        'MUL': op_MUL, 'NEGA': op_NEGA,
+        'PSHA': push('a', 1), 'PSHB': push('b', 1), 'PSHCB': push('blue', 1), 'PSHCG': push('green', 1),
+        'PSHCR': push('red', 1), 'PSHX': op_PSHX, 'PSHXA': push('xa', 2), 'PSHXB': push('xb', 2),
+        'PSHYA': push('ya', 2), 'PSHYB': push('yb', 2),
+        'PULA': pull('a', 1), 'PULB': pull('b', 1), 'PULCB': pull('blue', 1), 'PULCG': pull('green', 1),
+        'PULCR': pull('red', 1), 'PULX': op_PULX, 'PULXA': pull('xa', 2), 'PULXB': pull('xb', 2),
+        'PULYA': pull('ya', 2), 'PULYB': pull('yb', 2),
+        'RNDA': op_RNDA, 'RSTK': op_RSTK, 'RTS': op_RTS,
+        'STAA': op_STAA, 'STAB': op_STAB, 'STD': op_STD, 'STX': op_STX,
+        'SUBA': op_SUBA, 'SUBD': op_SUBD,
+        'TDX': transfer('x'), 'TDXA': transfer('xa'), 'TDXB': transfer('xb'), 'TDYA': transfer('ya'),
+        'TDYB': transfer('yb'), 'XGDX': op_XGDX
+        }
+
+# Instructions that take a value: in direct and extended mode, the decoder
+# reads it from memory before calling the handler
+VALUE_HANDLERS = {'ADDD', 'CPX', 'LDAA', 'LDAB', 'LDB', 'LDD', 'LDG', 'LDR', 'LDX', 'LDXA', 'LDXB',
+        'LDYA', 'LDYB', 'SUBA', 'SUBD'}
+
+def read_memory(handler, size):
+    "Wrap a handler that takes a value, to read it from the operand address."
+    if size == 1:
+        def op_read(m, addr, pc):
+            return handler(m, m.mem[addr], pc)
+    else:
+        def op_read(m, addr, pc):
+            return handler(m, read16(m.mem, addr), pc)
+    return op_read
+
+def indexed(handler):
+    "Wrap a handler that takes an address, to add the X register."
+    def op_indexed(m, offset, pc):
+        return handler(m, (m.x + offset) & 0xFFFF, pc)
+    return op_indexed
+
+def build_decoder():
+    """Build the decoding table from the op codes: for each op code, the
+    instruction, the addressing mode, the size, the handler and the cycles.
+    """
+    table = {}
+    for name in sorted(OP_CODES):
+        codes = OP_CODES[name]
+        if not isinstance(codes, dict):
+            if name in RELATIVE:
+                mode, size = 'rel', 2
+            elif name in ABSOLUTE:
+                mode, size = 'ext', 3
+            elif name == 'BKE':
+                mode, size = 'imm-rel', 3
+            else:
+                mode, size = 'inh', 1
+            codes = {mode: codes}
+        for mode, code in codes.items():
+            handler = HANDLERS[name]
+            cycles = CYCLES[name] if mode in {'inh', 'rel', 'imm-rel'} or name in ABSOLUTE else CYCLES[name][mode]
+            if mode == 'imm':
+                size = 2 if name in IMM_ONE_BYTE else 3
+            elif mode in {'dir', 'ind'}:
+                size = 2
+            elif mode == 'ext':
+                size = 3
+            if mode in {'dir', 'ext'} and name in VALUE_HANDLERS:
+                handler = read_memory(handler, 1 if name in INST_ONE_BYTE else 2)
+            elif mode == 'ind':
+                handler = indexed(handler)
+            if code not in table:
+                table[code] = (name, mode, size, handler, cycles)
+    return table
+
+DECODER = build_decoder()
+
+
+class Machine:
+    """The state of a 68112D running a program: memory, the 68HC11 registers,
+    the game registers (XA, XB, YA, YB and the colours), the game clock and the
+    keys that are pressed.
+
+    The draw commands of the current frame are in draws, and the ones of the
+    last complete frame in last_frame. A draw command is a tuple with the
+    instruction, the XA, YA, XB and YB registers (for DRSYM, XB is the symbol)
+    and the colour.
+    """
+
+    def __init__(self, image, size=MEMORY_SIZE, code_size=None, seed=0, tick_cycles=TICK_CYCLES):
+        """Load a memory image (a bytearray, or anything with a data attribute
+        like asmcodegen.MemoryImage). The code is decoded again if the program
+        writes to the first code_size bytes (by default, the whole image).
+        """
+        data = getattr(image, 'data', image)
+        self.mem = bytearray(max(size, len(data)))
+        self.mem[:len(data)] = data
+        self.code_size = len(data) if code_size is None else code_size
+        self.decoded = [None] * len(self.mem)
+
+        self.pc, self.sp = 0, len(self.mem) - 1
+        self.a = self.b = self.x = 0
+        self.n = self.z = self.v = self.c = False
+        self.xa = self.xb = self.ya = self.yb = 0
+        self.red = self.green = self.blue = 0
+
+        self.random = random.Random(seed)
+        self.tick_cycles = tick_cycles
+        self.clock_start = 0
+        self.keys = set()
+
+        self.cycles = 0
+        self.instructions = 0
+        self.frames = 0
+        self.frame_limit = None
+        self.halted = False
+        self.draws = []
+        self.last_frame = []
+        self.on_frame = None
+
+    @property
+    def d(self):
+        return (self.a << 8) | self.b
+
+    @property
+    def ccr(self):
+        "The condition code register (only N, Z, V and C are modelled)."
+        return (self.n << 3) | (self.z << 2) | (self.v << 1) | self.c
+
+    def clock(self):
+        "The value of the game clock (ticks since the last RSTK)."
+        return ((self.cycles - self.clock_start) // self.tick_cycles) & 0xFF
+
+    def end_frame(self):
+        self.frames += 1
+        self.last_frame, self.draws = self.draws, []
+        if self.on_frame is not None:
+            self.on_frame(self)
+
+    def decode(self, pc):
+        "Decode the instruction at an address."
+        mem = self.mem
+        if mem[pc] not in DECODER:
+            raise SimulationError("Unknown op code {0:02X}".format(mem[pc]), pc)
+        name, mode, size, handler, cycles = DECODER[mem[pc]]
+        next_pc = pc + size
+        if mode == 'imm':
+            operand = mem[pc + 1] if size == 2 else read16(mem, pc + 1)
+            if name == 'CPK' and mem[next_pc] == OP_CODES['BNE'] and signed8(mem[next_pc + 1]) == -size - 2:
+                handler = op_CPK_wait
+        elif mode == 'rel':
+            operand = next_pc + signed8(mem[pc + 1])
+        elif mode == 'imm-rel':
+            operand = (KEYS.get(mem[pc + 1]), next_pc + signed8(mem[pc + 2]))
+        elif mode in {'dir', 'ind'}:
+            operand = mem[pc + 1] if mode == 'dir' else signed8(mem[pc + 1])
+        elif mode == 'ext':
+            operand = read16(mem, pc + 1)
+        else:
+            operand = None
+        if name in SYNC:
+            handler, operand = op_sync, (handler, operand)
+        entry = self.decoded[pc] = (handler, operand, next_pc, cycles)
+        return entry
+
+    def invalidate(self, addr, size):
+        "Forget the decoded instructions that include some bytes."
+        for i in range(max(addr - 2, 0), addr + size):
+            self.decoded[i] = None
+
+    def run(self, frames=None, instructions=None):
+        """Run the program until it returns from the main label, or for a
+        number of frames or instructions (whatever comes first). Returns the
+        number of instructions run.
+        """
+        self.frame_limit = None if frames is None else self.frames + frames
+        limit = instructions if instructions is not None else float('inf')
+        decoded = self.decoded
+        pc, count, cycles = self.pc, 0, self.cycles
+        try:
+            while count < limit:
+                try:
+                    while count < limit:
+                        entry = decoded[pc]
+                        if entry is None:
+                            entry = self.decode(pc)
+                        handler, operand, next_pc, cost = entry
+                        count += 1
+                        cycles += cost
+                        pc = handler(self, operand, next_pc)
+                except _Sync as sync:
+                    self.cycles = cycles
+                    pc = sync.handler(self, sync.operand, sync.pc)
+                    cycles = self.cycles
+        except _Stop as stop:
+            pc, self.halted = stop.pc, stop.halted
+        except IndexError:
+            raise SimulationError("Address out of memory", pc)
+        finally:
+            self.pc = pc
+            self.cycles = cycles
+            self.instructions += count
+        return count
@@ -1,11 +1,15 @@
+import re
 from os.path import dirname, join
 from setuptools import setup
 
 def fread(fname):
     return open(join(dirname(__file__), fname)).read()
 
+def version():
+    return re.search(r"__version__ = '(.*)'", fread('asm2d/__init__.py')).group(1)
+
 setup(name = 'asm2d',
-      version = '0.2.3',
+      version = version(),
       description = 'An assembler for the 68112D microprocessor',
       long_description = fread('README.rst'),
       url = 'http://tapichu.github.com/asm2d/',
@@ -13,7 +17,7 @@ setup(name = 'asm2d',
       author_email = 'eduardo.biagi@gmail.com',
       license = 'BSD',
       packages = ['asm2d'],
-      install_requires = ['ply', 'bitstring'],
+      install_requires = ['ply'],
       classifiers = [
           'Development Status :: 3 - Alpha',
           'License :: OSI Approved :: BSD License',
@@ -22,6 +26,7 @@ setup(name = 'asm2d',
       ],
       keywords = 'asm2d 6811 68HC11 68112d assembler',
       entry_points = {
-          'console_scripts': ['asm2d=asm2d.assembler:main'],
+          'console_scripts': ['asm2d=asm2d.assembler:main', 'asm2d-prof=asm2d.asmprofile:main',
+              'asm2d-link=asm2d.asmlink:main'],
       },
       zip_safe = False)
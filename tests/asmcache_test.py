@@ -0,0 +1,47 @@
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import time
+import asm2d.asmcache as asmcache
+from asm2d.assembler import build
+
+def test_cache(input_string, no_entries=4):
+    "Store builds with different sizes of memory, in a cache that keeps only two."
+    path = tempfile.mkdtemp()
+    try:
+        entry = build(input_string, None)
+        cache = asmcache.BuildCache(path, max_size=2 * len(entry['output']) + 1024)
+        keys = []
+        for words in range(no_entries):
+            key = asmcache.build_key(input_string, no_words=len(entry['output']) + words)
+            assert key not in keys
+            assert cache.get(key) is None
+            cache.put(key, entry)
+            # Older entries were used longer ago
+            used = time.time() - 10 * (no_entries - words)
+            os.utime(cache.entry_file(key), (used, used))
+            keys.append(key)
+
+        cache.evict()
+        assert cache.get(keys[-1])['output'] == entry['output']
+        assert cache.get(keys[0]) is None
+        return [key for key in keys if cache.get(key) is not None]
+    finally:
+        shutil.rmtree(path)
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: asmcache_test.py file_path")
+        sys.exit(1)
+
+    file_name = sys.argv[1]
+    with open(file_name) as f:
+        contents = f.read()
+
+    kept = test_cache(contents)
+    print("{0:d} entries kept".format(len(kept)))
+
+if __name__ == '__main__':
+    main()
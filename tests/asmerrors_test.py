@@ -0,0 +1,76 @@
+from __future__ import print_function
+import json
+import sys
+from StringIO import StringIO
+import asm2d.asmutil as asmutil
+from asm2d.assembler import Assembler
+from asm2d.asmerrors import ErrorReport, from_json, parse_warning_filter, write_diagnostics
+
+def assemble(assembler, input_string, filters=(), max_diagnostics=None):
+    errors = ErrorReport(verbose=False, fatal=False, filters=[parse_warning_filter(text) for text in filters],
+            max_diagnostics=max_diagnostics)
+    return assembler.assemble(input_string, errors=errors)
+
+def test_filters(assembler, input_string):
+    "Check that the warning filters ignore warnings, or turn them into errors."
+    result = assemble(assembler, input_string)
+    warnings = [d for d in result.diagnostics if d.severity == 'warning']
+    assert all(d.code is not None for d in result.diagnostics), result.diagnostics
+
+    ignored = assemble(assembler, input_string, ['no-*'])
+    assert [d for d in ignored.diagnostics if d.severity == 'warning'] == []
+
+    code = warnings[0].code if warnings else 'unused-label'
+    errors = assemble(assembler, input_string, ['no-*', 'error=' + code])
+    assert [d.code for d in errors.diagnostics if d.severity == 'error'] == \
+            [d.code for d in warnings if d.code == code]
+    assert errors.ok == (not warnings)
+
+    enabled = assemble(assembler, input_string, ['no-*', code])
+    assert [str(d) for d in enabled.diagnostics] == [str(d) for d in warnings if d.code == code]
+    return result
+
+def test_cap(assembler):
+    "Check that the diagnostics over the cap are dropped, and the errors still counted."
+    input_string = ".main LDAA %3\n  LDAA %4\n  LDAA %5\n"
+    result = assemble(assembler, input_string, max_diagnostics=2)
+    assert len(result.diagnostics) == 2 and result.errors.dropped == 1, result.diagnostics
+    assert result.errors.num_errors() == 3
+    assert [d.column for d in result.diagnostics] == [12, 8], result.diagnostics
+
+def test_end_of_input():
+    "Check that a syntax error at the end of the input goes to the error report."
+    errors = ErrorReport(verbose=False, fatal=False, filters=[parse_warning_filter('no-*')])
+    asmparser = asmutil.create_parser(errors)
+    asmparser.parse(".main LDX 1", lexer=asmutil.create_lexer(errors))
+    assert [(d.code, d.severity) for d in errors.diagnostics] == [('syntax-error', 'error')], errors.diagnostics
+    assert errors.num_errors() == 1
+
+def test_json(diagnostics):
+    "Check that the diagnostics are written as JSON, and read back."
+    outfile = StringIO()
+    write_diagnostics([d.to_json() for d in diagnostics], outfile, 'json', num_errors=0)
+    document = json.loads(outfile.getvalue())
+    assert [str(from_json(fields)) for fields in document['diagnostics']] == [str(d) for d in diagnostics]
+    for fields in document['diagnostics']:
+        assert sorted(fields) == ['code', 'column', 'line', 'message', 'severity'], fields
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: asmerrors_test.py file_path")
+        sys.exit(1)
+
+    file_name = sys.argv[1]
+    with open(file_name) as f:
+        contents = f.read()
+
+    assembler = Assembler()
+    result = test_filters(assembler, contents)
+    test_cap(assembler)
+    test_end_of_input()
+    test_json(result.diagnostics)
+    for diagnostic in result.diagnostics:
+        print("{0:<20} {1}".format(diagnostic.code, diagnostic))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+from __future__ import print_function
+import os
+import sys
+import time
+import asm2d.asmutil as asmutil
+from asm2d.asmerrors import ErrorReport
+
+# The example the lexers are timed on by default
+PONG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docs', 'examples', 'pong.s2d')
+RUNS = 15
+
+def best_time(asmlexer, input_string, runs):
+    "The best time to tokenize the input, over a number of runs."
+    best = None
+    for i in range(runs):
+        start = time.time()
+        asmlexer.input(input_string)
+        token = asmlexer.token
+        while token(): pass
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_lexers(input_string, runs=RUNS):
+    """Time the PLY lexer and the fast lexer on the input, returning the best
+    time of each (the lexers alternate, so both see the same load).
+    """
+    errors = ErrorReport(verbose=False, fatal=False)
+    ply_lexer, fast_lexer = asmutil.create_lexer(errors), asmutil.create_lexer(errors, fast=True)
+    ply_times, fast_times = [], []
+    for i in range(runs):
+        ply_times.append(best_time(ply_lexer, input_string, 5))
+        fast_times.append(best_time(fast_lexer, input_string, 5))
+    return min(ply_times), min(fast_times)
+
+def main():
+    file_names = sys.argv[1:] or [PONG]
+
+    print('{0:<24} {1:>10} {2:>10} {3:>8}'.format('file', 'PLY ms', 'fast ms', 'ratio'))
+    for file_name in file_names:
+        with open(file_name) as f:
+            ply_time, fast_time = bench_lexers(f.read())
+        print('{0:<24} {1:>10.3f} {2:>10.3f} {3:>8.2f}'.format(os.path.basename(file_name), ply_time * 1000,
+            fast_time * 1000, fast_time / ply_time))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+from __future__ import print_function
+import sys
+import asm2d.asmutil as asmutil
+from asm2d.asmerrors import ErrorReport
+
+def tokens(asmlexer, input_string):
+    asmlexer.input(input_string)
+    result = []
+    while True:
+        token = asmlexer.token()
+        if not token: break
+        result.append((token.type, token.value, token.lineno, token.lexpos))
+    return result
+
+def test_conformance(input_string):
+    "Check that both lexers give the same tokens."
+    errors = ErrorReport()
+    expected = tokens(asmutil.create_lexer(errors), input_string)
+    result = tokens(asmutil.create_lexer(errors, fast=True), input_string)
+
+    for i, (token, expected_token) in enumerate(zip(result, expected)):
+        assert token == expected_token, (i, token, expected_token)
+    assert len(result) == len(expected), (len(result), len(expected))
+    return result
+
+def test_errors():
+    "Check that both lexers report the same illegal characters, and skip them."
+    input_string = "  LDAA %3 ; comment\n  STAA {x}\n"
+    ply_errors, fast_errors = ErrorReport(verbose=False), ErrorReport(verbose=False)
+    expected = tokens(asmutil.create_lexer(ply_errors), input_string)
+    result = tokens(asmutil.create_lexer(fast_errors, fast=True), input_string)
+    assert result == expected, (result, expected)
+    assert [str(d) for d in fast_errors.diagnostics] == [str(d) for d in ply_errors.diagnostics]
+    assert fast_errors.num_errors() == 3, fast_errors.num_errors()
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: asmfastlex_test.py file_path [file_path ...]")
+        sys.exit(1)
+
+    test_errors()
+    for file_name in sys.argv[1:]:
+        with open(file_name) as f:
+            contents = f.read()
+        result = test_conformance(contents)
+        print("{0}: {1:d} tokens".format(file_name, len(result)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+from __future__ import print_function
+import sys
+import pprint
+import asm2d.asmflow as asmflow
+import asm2d.asmsemantic as asmsemantic
+import asm2d.asmutil as asmutil
+from asm2d.asmerrors import ErrorReport
+
+def test_dead_code(input_string):
+    errors = ErrorReport()
+    asmlexer = asmutil.create_lexer(errors)
+    asmparser = asmutil.create_parser(errors)
+
+    ast = asmparser.parse(input_string, lexer=asmlexer)
+    asmsemantic.analyse(ast, asmparser.const_table, asmparser.data_table, asmparser.inst_table, errors)
+    dead_blocks, dead_vars = asmflow.eliminate_dead(ast, asmparser.data_table, asmparser.inst_table)
+    asmflow.report_dead(dead_blocks, dead_vars, errors)
+    asmsemantic.allocate(ast, asmparser.data_table, asmparser.inst_table)
+
+    return (ast, dead_blocks, dead_vars)
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: asmflow_test.py file_path")
+        sys.exit(1)
+
+    file_name = sys.argv[1]
+    with open(file_name) as f:
+        contents = f.read()
+
+    ast, dead_blocks, dead_vars = test_dead_code(contents)
+
+    pp = pprint.PrettyPrinter(indent=4)
+    pp.pprint(dead_blocks)
+    pp.pprint(dead_vars)
+    pp.pprint(ast)
+
+if __name__ == '__main__':
+    main()
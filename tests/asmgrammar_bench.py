@@ -0,0 +1,44 @@
+from __future__ import print_function
+import sys
+import time
+import asm2d.asmutil as asmutil
+from asm2d.asmerrors import ErrorReport
+
+SIZES = [1000, 10000, 100000, 1000000]
+
+def generate_source(no_lines):
+    "Generate a program with the given number of lines."
+    lines = ['.main       LDX     $0000']
+    for i in range(1, no_lines - 1):
+        if i % 2:
+            lines.append('            LDD     {0:d}'.format(i % 1000))
+        else:
+            lines.append('L{0:<10d} ADDD    #STEP'.format(i))
+    lines.append('STEP        EQU     3')
+    lines.insert(0, lines.pop())
+    return '\n'.join(lines) + '\n'
+
+def bench_parser(no_lines):
+    "Time the parser on a generated program, return the seconds taken."
+    input_string = generate_source(no_lines)
+    errors = ErrorReport()
+    asmlexer = asmutil.create_lexer(errors)
+    asmparser = asmutil.create_parser(errors)
+
+    start = time.time()
+    ast = asmparser.parse(input_string, lexer=asmlexer)
+    elapsed = time.time() - start
+
+    assert len(ast) == no_lines - 1
+    return elapsed
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+
+    print('{0:>10} {1:>10} {2:>12}'.format('lines', 'seconds', 'us/line'))
+    for no_lines in sizes:
+        elapsed = bench_parser(no_lines)
+        print('{0:>10d} {1:>10.3f} {2:>12.2f}'.format(no_lines, elapsed, elapsed * 1e6 / no_lines))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+from __future__ import print_function
+import gc
+import resource
+import sys
+import time
+import asm2d.asmutil as asmutil
+from asm2d.asmerrors import ErrorReport
+from asm2d.asmgrammar import Inst, Var
+
+NO_LINES = 100000
+# Bytes per AST node that the benchmark accepts
+NODE_BUDGET = 160
+
+def generate_source(no_lines):
+    """Generate a program with the given number of lines, with instructions in
+    every addressing mode, in blocks of 10 lines.
+    """
+    lines = ['STEP        EQU     3', '.main       LDX     #STEP']
+    for i in range((no_lines - 4) // 10):
+        lines.extend([
+            'L{0:<10d} LDAA    V{1:d}'.format(i, i % 100),
+            '            ADDD    #STEP',
+            '            STAA    V{0:d}'.format((i + 1) % 100),
+            '            STAB    2,X',
+            '            PSHA',
+            '            PULA',
+            '            JSR     SUB',
+            '            BKE     (KEY_1) L{0:d}'.format(i),
+            '            CPX     $7F',
+            '            BNE     L{0:d}'.format(i),
+            ])
+    lines.extend(['SUB         RTS'] + ['V{0:<10d} RMB     1'.format(i) for i in range(100)])
+    return '\n'.join(lines) + '\n'
+
+def node_size(elem):
+    "The bytes taken by an AST node (with its attributes dictionary, if it has one)."
+    size = sys.getsizeof(elem)
+    if hasattr(elem, '__dict__'):
+        size += sys.getsizeof(elem.__dict__)
+    return size
+
+def bench_memory(no_lines):
+    """Parse a generated program. Returns the number of nodes, the bytes per
+    node, the growth of the peak memory of the process (in KB) and the seconds
+    taken.
+    """
+    input_string = generate_source(no_lines)
+    errors = ErrorReport()
+    asmlexer = asmutil.create_lexer(errors)
+    asmparser = asmutil.create_parser(errors)
+    gc.collect()
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    ast = asmparser.parse(input_string, lexer=asmlexer)
+    elapsed = time.time() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    assert errors.num_errors() == 0
+    nodes = [elem for elem in ast if isinstance(elem, (Inst, Var))]
+    assert not any(hasattr(elem, '__dict__') for elem in nodes)
+    per_node = sum(node_size(elem) for elem in nodes) / float(len(nodes))
+    assert per_node <= NODE_BUDGET, per_node
+    return len(nodes), per_node, peak_rss - start_rss, elapsed
+
+def main():
+    no_lines = int(sys.argv[1]) if len(sys.argv) > 1 else NO_LINES
+
+    nodes, per_node, peak, elapsed = bench_memory(no_lines)
+    print('{0:>10} {1:>10} {2:>12} {3:>12} {4:>10}'.format('lines', 'nodes', 'bytes/node', 'peak KB', 'seconds'))
+    print('{0:>10d} {1:>10d} {2:>12.1f} {3:>12d} {4:>10.3f}'.format(no_lines, nodes, per_node, peak, elapsed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+from __future__ import print_function
+import sys
+import asm2d.asmlink as asmlink
+import asm2d.asmoutput as asmoutput
+from asm2d.assembler import Assembler
+from asm2d.asmerrors import ErrorReport
+
+def test_link(sources):
+    """Assemble each source as a module, link them, and check that the result
+    is the same as assembling all the sources together.
+    """
+    assembler = Assembler()
+    modules = []
+    for i, source in enumerate(sources):
+        result = assembler.assemble(source, relocatable=True)
+        assert result.ok, [str(diagnostic) for diagnostic in result.diagnostics]
+        modules.append(asmlink.Module('module{0:d}'.format(i), result.object))
+
+    image = asmlink.link(modules, ErrorReport(verbose=False, fatal=False))
+    expected = assembler.assemble(''.join(sources))
+    assert expected.ok, [str(diagnostic) for diagnostic in expected.diagnostics]
+    assert image.data == expected.image.data
+    assert image.notes == expected.image.notes
+
+    return image, modules
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: asmlink_test.py file_path [file_path ...]")
+        sys.exit(1)
+
+    sources = []
+    for file_name in sys.argv[1:]:
+        with open(file_name) as f:
+            sources.append(f.read())
+
+    image, modules = test_link(sources)
+    asmoutput.output_mif(image, len(image), sys.stdout)
+    asmoutput.output_map(asmlink.symbol_map(modules), sys.stdout)
+
+if __name__ == '__main__':
+    main()
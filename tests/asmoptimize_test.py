@@ -0,0 +1,50 @@
+from __future__ import print_function
+import sys
+import pprint
+import asm2d.asmoptimize as asmoptimize
+import asm2d.asmsemantic as asmsemantic
+import asm2d.asmutil as asmutil
+from asm2d.asmerrors import ErrorReport
+
+def test_optimizer(input_string):
+    errors = ErrorReport()
+    asmlexer = asmutil.create_lexer(errors)
+    asmparser = asmutil.create_parser(errors)
+
+    ast = asmparser.parse(input_string, lexer=asmlexer)
+    asmsemantic.analyse(ast, asmparser.const_table, asmparser.data_table, asmparser.inst_table, errors)
+    stats = asmoptimize.optimize(ast, asmparser.inst_table)
+    asmsemantic.allocate(ast, asmparser.data_table, asmparser.inst_table)
+
+    return (ast, stats)
+
+def test_unsafe_rewrites():
+    """Check that a cycle of branches isn't threaded forever, and that a
+    subroutine that pulls its return address is still called.
+    """
+    ast, stats = test_optimizer(".main BRA L1\nL1 BRA L2\nL2 BRA L1\n")
+    assert [elem.target for elem in ast] == ['L1', 'L2', 'L1'], ast
+    assert stats.hits['thread-branch'] == 0
+
+    source = ".main JSR R\nR PSHX\n JSR TAKE_ARG\n RTS\nTAKE_ARG PULA\n PULB\n PULX\n PSHB\n PSHA\n RTS\n"
+    ast, stats = test_optimizer(source)
+    assert ast[2].name == 'JSR' and stats.hits['tail-call'] == 0, ast
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: asmoptimize_test.py file_path")
+        sys.exit(1)
+
+    file_name = sys.argv[1]
+    with open(file_name) as f:
+        contents = f.read()
+
+    test_unsafe_rewrites()
+    ast, stats = test_optimizer(contents)
+
+    stats.report(sys.stdout)
+    pp = pprint.PrettyPrinter(indent=4)
+    pp.pprint(ast)
+
+if __name__ == '__main__':
+    main()
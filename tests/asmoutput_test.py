@@ -0,0 +1,59 @@
+from __future__ import print_function
+import sys
+from io import BytesIO
+from StringIO import StringIO
+import asm2d.asmoutput as asmoutput
+from asm2d.assembler import Assembler
+
+def test_listing(input_string):
+    "Check that the listing and the symbol map agree on the address of each label."
+    result = Assembler().assemble(input_string, listing=True, symbols=True)
+    assert result.ok, [str(diagnostic) for diagnostic in result.diagnostics]
+
+    lines = dict((int(line[:4], 16), line) for line in result.listing.splitlines() if line[:4].strip())
+    for name, entry in result.symbols['labels'].items():
+        line = lines[entry['addr']]
+        assert int(line[4 + 3 * asmoutput.LISTING_BYTES + 2:].split()[0]) == entry['line'], (name, line)
+
+    return result
+
+def test_memory_size(input_string):
+    """Check that a memory size smaller than the program is an error in every
+    format, and that the writers never drop bytes of the image.
+    """
+    assembler = Assembler()
+    size = len(assembler.assemble(input_string).image)
+    for output_format, writer in sorted(asmoutput.FORMATS.items()):
+        result = assembler.assemble(input_string, no_words=size - 1, output_format=output_format)
+        assert not result.ok and result.output is None, output_format
+        assert [d.code for d in result.diagnostics if d.severity == 'error'] == ['memory-size'], result.diagnostics
+        assert str(size) in result.diagnostics[-1].message, result.diagnostics
+
+        image = assembler.assemble(input_string).image
+        outputs = []
+        for depth in (size - 1, size):
+            outfile = BytesIO() if output_format in asmoutput.BINARY_FORMATS else StringIO()
+            writer(image, depth, outfile)
+            outputs.append(outfile.getvalue())
+        if output_format == 'mif':
+            assert len([line for line in outputs[0].splitlines() if ' : ' in line]) == size, output_format
+        else:
+            assert outputs[0] == outputs[1], output_format
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: asmoutput_test.py file_path")
+        sys.exit(1)
+
+    file_name = sys.argv[1]
+    with open(file_name) as f:
+        contents = f.read()
+
+    test_memory_size(contents)
+    result = test_listing(contents)
+    print(result.listing, end='')
+    print()
+    asmoutput.output_map(result.symbols, sys.stdout)
+
+if __name__ == '__main__':
+    main()
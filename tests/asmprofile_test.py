@@ -0,0 +1,34 @@
+from __future__ import print_function
+import sys
+import asm2d.asmprofile as asmprofile
+from asm2d.assembler import Assembler
+
+def test_profile(input_string, no_frames, script=()):
+    result = Assembler().assemble(input_string)
+    assert result.ok, [str(diagnostic) for diagnostic in result.diagnostics]
+    profile = asmprofile.run_profile(result, no_frames, script)
+
+    assert sum(profile.lines.values()) == profile.instructions
+    assert sum(profile.line_cycles.values()) == profile.cycles
+    assert sum(profile.self_cycles.values()) == profile.cycles
+    return profile
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: asmprofile_test.py file_path [frames] [key_script]")
+        sys.exit(1)
+
+    file_name = sys.argv[1]
+    no_frames = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    with open(file_name) as f:
+        contents = f.read()
+    script = []
+    if len(sys.argv) > 3:
+        with open(sys.argv[3]) as f:
+            script = asmprofile.read_key_script(f.read())
+
+    profile = test_profile(contents, no_frames, script)
+    asmprofile.report(profile, contents, sys.stdout)
+
+if __name__ == '__main__':
+    main()
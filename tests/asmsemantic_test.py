@@ -3,6 +3,7 @@ import sys
 import pprint
 import asm2d.asmsemantic as asmsemantic
 import asm2d.asmutil as asmutil
+from asm2d.assembler import Assembler
 from asm2d.asmerrors import ErrorReport
 
 def test_semantic_analysis(input_string):
@@ -15,6 +16,34 @@ def test_semantic_analysis(input_string):
 
     return (ast, asmparser.const_table, asmparser.data_table, asmparser.inst_table)
 
+def test_constants():
+    """Check that constants can be defined after they're used (in a chain too
+    long for a recursive evaluation), that each one is evaluated once, and that
+    circular definitions are reported.
+    """
+    no_consts = 5000
+    lines = ['.main       LDX     #C0'] + ['            LDD     #C0 + #C{0:d}'.format(i) for i in range(1, 50)]
+    lines += ['C{0:<10d} EQU     #C{1:d} + 1'.format(i, i + 1) for i in range(no_consts)]
+    lines += ['C{0:<10d} EQU     -{0:d}'.format(no_consts)]
+    evaluated = []
+    eval_expr = asmsemantic.eval_expr
+    def counting_eval_expr(expr, const_table, lineno, errors):
+        evaluated.append(expr)
+        return eval_expr(expr, const_table, lineno, errors)
+    asmsemantic.eval_expr = counting_eval_expr
+    try:
+        result = Assembler().assemble('\n'.join(lines))
+    finally:
+        asmsemantic.eval_expr = eval_expr
+    assert result.ok, result.diagnostics[:5]
+    assert result.const_table['C0'].value == 0 and result.ast[0].value == 0
+    exprs = set(id(const.expr) for const in result.const_table.values())
+    assert sum(1 for expr in evaluated if id(expr) in exprs) == no_consts
+
+    result = Assembler().assemble('A EQU #B + 1\nB EQU #A\nC EQU #B\n.main LDX #C\n')
+    assert [str(d) for d in result.diagnostics] == \
+            ['ERROR: Circular definition of constant A: A -> B -> A (at line: 2)'], result.diagnostics
+
 def main():
     if len(sys.argv) < 2:
         print("Usage: asmsemantic_test.py file_path")
@@ -24,6 +53,7 @@ def main():
     with open(file_name) as f:
         contents = f.read()
 
+    test_constants()
     ast, const_table, data_table, inst_table = test_semantic_analysis(contents)
 
     pp = pprint.PrettyPrinter(indent=4)
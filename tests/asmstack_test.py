@@ -0,0 +1,33 @@
+from __future__ import print_function
+import sys
+import asm2d.asmsemantic as asmsemantic
+import asm2d.asmstack as asmstack
+import asm2d.asmutil as asmutil
+from asm2d.asmerrors import ErrorReport
+
+def test_stack(input_string):
+    errors = ErrorReport()
+    asmlexer = asmutil.create_lexer(errors)
+    asmparser = asmutil.create_parser(errors)
+
+    ast = asmparser.parse(input_string, lexer=asmlexer)
+    asmsemantic.analyse(ast, asmparser.const_table, asmparser.data_table, asmparser.inst_table, errors)
+    analysis = asmstack.StackAnalysis(ast, asmparser.inst_table, errors)
+    analysis.check()
+
+    return analysis, asmparser.data_table
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: asmstack_test.py file_path")
+        sys.exit(1)
+
+    file_name = sys.argv[1]
+    with open(file_name) as f:
+        contents = f.read()
+
+    analysis, data_table = test_stack(contents)
+    asmstack.report(analysis, data_table, sys.stdout)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+from __future__ import print_function
+import sys
+import asm2d.asmsemantic as asmsemantic
+import asm2d.asmtiming as asmtiming
+import asm2d.asmutil as asmutil
+from asm2d.asmerrors import ErrorReport
+
+def test_timing(input_string):
+    errors = ErrorReport()
+    asmlexer = asmutil.create_lexer(errors)
+    asmparser = asmutil.create_parser(errors)
+
+    ast = asmparser.parse(input_string, lexer=asmlexer)
+    asmsemantic.analyse(ast, asmparser.const_table, asmparser.data_table, asmparser.inst_table, errors)
+    analysis = asmtiming.TimingAnalysis(ast, asmtiming.loop_bounds(input_string))
+    asmtiming.check_timing(analysis, errors)
+
+    return analysis
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: asmtiming_test.py file_path")
+        sys.exit(1)
+
+    file_name = sys.argv[1]
+    with open(file_name) as f:
+        contents = f.read()
+
+    analysis = test_timing(contents)
+    asmtiming.report(analysis, sys.stdout)
+
+if __name__ == '__main__':
+    main()
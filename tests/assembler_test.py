@@ -0,0 +1,43 @@
+from __future__ import print_function
+import sys
+import threading
+from asm2d.assembler import Assembler
+
+def test_assembler(input_string, no_threads=8, no_runs=4):
+    "Assemble the same program from many threads, sharing one assembler."
+    assembler = Assembler()
+    expected = assembler.assemble(input_string)
+    failures = []
+
+    def run():
+        for i in range(no_runs):
+            result = assembler.assemble(input_string)
+            if result.output != expected.output or \
+                    [str(d) for d in result.diagnostics] != [str(d) for d in expected.diagnostics]:
+                failures.append(result)
+
+    threads = [threading.Thread(target=run) for i in range(no_threads)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+    return expected, failures
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: assembler_test.py file_path")
+        sys.exit(1)
+
+    file_name = sys.argv[1]
+    with open(file_name) as f:
+        contents = f.read()
+
+    result, failures = test_assembler(contents)
+
+    for diagnostic in result.diagnostics:
+        print(diagnostic)
+    print("{0:d} failed runs".format(len(failures)))
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
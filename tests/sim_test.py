@@ -0,0 +1,40 @@
+from __future__ import print_function
+import sys
+import time
+import pprint
+from asm2d.asmconstants import SIZE
+from asm2d.assembler import Assembler
+from asm2d.sim import Machine
+
+def test_simulation(input_string, no_frames):
+    result = Assembler().assemble(input_string)
+    assert result.ok, [str(diagnostic) for diagnostic in result.diagnostics]
+    machine = Machine(result.image, code_size=result.inst_table[SIZE])
+
+    start = time.time()
+    count = machine.run(frames=no_frames, instructions=100 * 1000 * 1000)
+    elapsed = time.time() - start
+
+    assert machine.frames == no_frames or machine.halted
+    return machine, count, elapsed
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: sim_test.py file_path [frames]")
+        sys.exit(1)
+
+    file_name = sys.argv[1]
+    no_frames = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    with open(file_name) as f:
+        contents = f.read()
+
+    machine, count, elapsed = test_simulation(contents, no_frames)
+
+    print("{0:d} frames, {1:d} instructions run ({2:d} skipped while waiting), {3:d} cycles".format(
+        machine.frames, count, machine.instructions - count, machine.cycles))
+    print("{0:.3f} seconds, {1:.0f} instructions/second".format(elapsed, count / elapsed))
+    pp = pprint.PrettyPrinter(indent=4)
+    pp.pprint(machine.last_frame)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+from __future__ import print_function
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Start up time of the command line, in seconds (the best of a few runs)
+STARTUP_BUDGET = 0.25
+# Modules that must only be imported when they're needed
+LAZY_MODULES = ('ply.lex', 'ply.yacc', 'bitstring', 'pkg_resources', 'multiprocessing')
+
+# Run the command line, and print the modules loaded when it exits
+RUN_MAIN = """
+import atexit, sys
+atexit.register(lambda: sys.stderr.write('MODULES ' + ' '.join(sorted(sys.modules)) + '\\n'))
+from asm2d import assembler
+sys.argv = ['asm2d'] + sys.argv[1:]
+assembler.main()
+"""
+
+# Time the imports of the command line, module by module (like -X importtime)
+IMPORT_TIMES = """
+import sys, time
+for name in sys.argv[1:]:
+    start = time.time()
+    __import__(name)
+    print('{0} {1:.6f}'.format(name, time.time() - start))
+"""
+
+def run(args, env):
+    "Run the command line, returning its exit status, stderr and loaded modules."
+    process = subprocess.Popen([sys.executable, '-c', RUN_MAIN] + args, env=env, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    lines = stderr.decode('utf-8').splitlines()
+    modules = [line for line in lines if line.startswith('MODULES ')][-1].split()[1:]
+    return process.returncode, [line for line in lines if not line.startswith('MODULES ')], set(modules)
+
+def test_imports(env):
+    "Check that importing the assembler doesn't import the lazy modules, and time it."
+    names = ['argparse', 'json', 'asm2d.asmutil', 'asm2d.asmcache', 'asm2d.assembler']
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_TIMES] + names, env=env)
+    times = [line.split() for line in output.decode('utf-8').splitlines()]
+    _, _, modules = run(['--help'], env)
+    loaded = [name for name in LAZY_MODULES if name in modules]
+    assert not loaded, loaded
+    return [(name, float(seconds)) for name, seconds in times]
+
+def test_version(env, runs=5):
+    "The best start up time of --version, which must be within the budget."
+    best = None
+    for i in range(runs):
+        start = time.time()
+        subprocess.Popen([sys.executable, '-m', 'asm2d.assembler', '--version'], env=env,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    assert best <= STARTUP_BUDGET, best
+    return best
+
+def test_cache_hit(file_name, env):
+    "Check that a build found in the build cache doesn't load PLY."
+    work_dir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(work_dir, 'source.s2d')
+        shutil.copy(file_name, source)
+        args = [source, '--cache-dir', os.path.join(work_dir, 'cache')]
+        status, expected, modules = run(args, env)
+        assert status == 0 and 'ply.yacc' in modules, (status, expected)
+        status, diagnostics, modules = run(args, env)
+        assert status == 0 and diagnostics == expected, (status, diagnostics)
+        loaded = [name for name in LAZY_MODULES if name in modules]
+        assert not loaded, loaded
+    finally:
+        shutil.rmtree(work_dir)
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: startup_test.py file_path")
+        sys.exit(1)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([root] + [path for path in env.get('PYTHONPATH', '').split(os.pathsep)
+        if path])
+
+    for name, seconds in test_imports(env):
+        print("import {0:<20} {1:7.1f} ms".format(name, seconds * 1000))
+    print("--version {0:.1f} ms (budget {1:.0f} ms)".format(test_version(env) * 1000, STARTUP_BUDGET * 1000))
+    test_cache_hit(sys.argv[1], env)
+
+if __name__ == '__main__':
+    main()